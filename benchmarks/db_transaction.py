@@ -0,0 +1,49 @@
+"""
+Сравнение скорости записи в БД: commit на каждый запрос против одной транзакции на пачку строк
+
+    python -m benchmarks.db_transaction [кол-во строк]
+"""
+import asyncio
+import sys
+import time
+
+from src.api.db.db import execute_command, transaction, close_db_pool
+
+TABLE = 'bench_transaction'
+
+
+async def _prepare() -> None:
+    await execute_command(f'create table if not exists {TABLE} (id int primary key, val varchar(64))')
+    await execute_command(f'delete from {TABLE}')
+
+
+async def _insert(i: int) -> None:
+    await execute_command(f'insert into {TABLE} (id, val) values (?, ?)', i, f'row-{i}')
+
+
+async def commit_per_statement(rows: int) -> None:
+    for i in range(rows):
+        await _insert(i)
+
+
+async def single_transaction(rows: int) -> None:
+    async with transaction():
+        for i in range(rows):
+            await _insert(i)
+
+
+async def main(rows: int) -> None:
+    try:
+        for func in (commit_per_statement, single_transaction):
+            await _prepare()
+            start = time.perf_counter()
+            await func(rows)
+            elapsed = time.perf_counter() - start
+            print(f'{func.__name__:>22}: {rows / elapsed:10.1f} строк/сек ({elapsed:.2f} сек)')
+        await execute_command(f'drop table {TABLE}')
+    finally:
+        await close_db_pool()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000))
@@ -0,0 +1,102 @@
+"""
+Сравнение хэширования файлов для отправки в хранилище ГИС ЖКХ: MD5 файла, MD5 частей по 5 Мб и ГОСТ Р 34.11-94
+отдельными проходами в цикле событий (с копированием частей) против FilePayload (MD5 файла, MD5 частей и потоковый
+ГОСТ за один проход в пуле потоков). Замеряются оба пути FilePayload:
+    - write_base64 - файлы судебных приказов из ответа Мобилл (FileContent в base64), основной путь;
+    - from_bytes + ensure_hashes - файл, уже загруженный в память
+
+    python -m benchmarks.file_hashing [кол-во повторов]
+"""
+import asyncio
+import base64
+import os
+import sys
+import time
+
+from src.api.gis.payload import PART_SIZE, FilePayload
+from src.api.gis.utils import calc_hash_by_gost, calc_hash_by_md5
+
+SIZES_MB = (1, 5, 20, 50)
+# размер части base64, передаваемой в write_base64
+B64_CHUNK = 65536
+
+
+def _synthetic_pdf(size: int) -> bytes:
+    head = b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n'
+    tail = b'\n%%EOF\n'
+    return head + os.urandom(size - len(head) - len(tail)) + tail
+
+
+def _legacy(data: bytes) -> tuple:
+    parts = [data[x:x + PART_SIZE] for x in range(0, len(data), PART_SIZE)]
+    return calc_hash_by_md5(data), [calc_hash_by_md5(part) for part in parts], calc_hash_by_gost(data)
+
+
+async def _legacy_async(data: bytes) -> tuple:
+    return _legacy(data)
+
+
+async def _single_pass(data: bytes) -> tuple:
+    payload = FilePayload.from_bytes(data)
+    await payload.ensure_hashes()
+    return payload.md5, payload.part_md5, payload.gost
+
+
+async def _legacy_base64(content: str) -> tuple:
+    return _legacy(base64.b64decode(content))
+
+
+def _decode(content: str) -> tuple:
+    with FilePayload() as payload:
+        for pos in range(0, len(content), B64_CHUNK):
+            payload.write_base64(content[pos:pos + B64_CHUNK])
+        payload.finish()
+        return payload.md5, payload.part_md5, payload.gost
+
+
+async def _single_pass_base64(content: str) -> tuple:
+    # как в агентах: разбор ответа Мобилл с декодированием файлов выполняется вне цикла событий
+    return await asyncio.to_thread(_decode, content)
+
+
+async def _measure(title: str, run, data: bytes | str, repeat: int, size: int):
+    """
+    Время хэширования и наибольшая задержка цикла событий (насколько хэширование блокирует другие задачи)
+    """
+    lag = 0.0
+
+    async def _ticker():
+        nonlocal lag
+        while True:
+            tick = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lag = max(lag, time.perf_counter() - tick - 0.001)
+
+    ticker = asyncio.create_task(_ticker())
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = await run(data)
+        await asyncio.sleep(0.002)
+    elapsed = (time.perf_counter() - start) / repeat - 0.002
+    ticker.cancel()
+    print(f'{title:>40}: {elapsed * 1000:8.1f} мс, {size / 1048576 / elapsed:8.1f} Мб/сек, '
+          f'блокировка цикла событий до {lag * 1000:7.1f} мс')
+    return result
+
+
+async def main(repeat: int) -> None:
+    for size_mb in SIZES_MB:
+        data = _synthetic_pdf(size_mb * 1048576)
+        print(f'{size_mb} Мб')
+        content = base64.b64encode(data).decode('ascii')
+        legacy = await _measure('base64, отдельные проходы', _legacy_base64, content, repeat, len(data))
+        single = await _measure('base64, write_base64 в пуле потоков', _single_pass_base64, content, repeat, len(data))
+        assert legacy == single, 'хэши не совпадают'
+        legacy = await _measure('bytes, отдельные проходы', _legacy_async, data, repeat, len(data))
+        single = await _measure('bytes, from_bytes в пуле потоков', _single_pass, data, repeat, len(data))
+        assert legacy == single, 'хэши не совпадают'
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 3))
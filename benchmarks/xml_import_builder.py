@@ -0,0 +1,110 @@
+"""
+Сравнение скорости построения importDebtResponses (Send) на 100 ответов: копирование узлов шаблона (deepcopy)
+с поиском элементов в копии против построения по разметке шаблона (SubElement).
+Перед замером проверяется, что каноническая форма документов совпадает побайтно
+
+    python -m benchmarks.xml_import_builder [кол-во документов]
+"""
+import copy
+import sys
+import time
+
+from src.api.gis.file import GISFileDataFormat
+from src.base.utils import gen_guid
+from src.debt.debt_xml import EXEC_GUID, SendImportDebtResponses
+from src.debt.schema import GISDebtorsData, GISResponseDataFormat, PersonName
+
+
+class CopiedSendImportDebtResponses(SendImportDebtResponses):
+    """
+    Построение копированием узлов action, debtInfo и document
+    """
+    def _build_body(self):
+        ns = self.get_namespaces()
+        for item in self.data:
+            clone = copy.deepcopy(self.action)
+            clone.find('base:TransportGUID', namespaces=ns).text = gen_guid()
+            clone.find('drs:subrequestGUID', namespaces=ns).text = item.subrequestGUID
+            clone.find('drs:actionType', namespaces=ns).text = 'Send'
+            clone.find('drs:responseData/drs:description', namespaces=ns).text = ' '
+            clone.find('drs:responseData/drs:executorGUID', namespaces=ns).text = EXEC_GUID
+            if not item.debtorsData:
+                clone.find('drs:responseData/drs:hasDebt', namespaces=ns).text = 'false'
+            else:
+                for debtors in item.debtorsData:
+                    for name in debtors.persons:
+                        clone.find('drs:responseData/drs:hasDebt', namespaces=ns).text = 'true'
+                        resp_data_node = clone.find('drs:responseData', namespaces=ns)
+                        debt_info_clone = copy.deepcopy(self.debt_info)
+                        debt_info_clone.find('drs:person/drs:firstName', namespaces=ns).text = name.firstName
+                        debt_info_clone.find('drs:person/drs:lastName', namespaces=ns).text = name.lastName
+                        middle_name_elem = debt_info_clone.find('drs:person/drs:middleName', namespaces=ns)
+                        if name.middleName != '':
+                            middle_name_elem.text = name.middleName
+                        else:
+                            middle_name_elem.getparent().remove(middle_name_elem)
+                        for file in debtors.files or ():
+                            attachment_file_clone = copy.deepcopy(self.attachment_file)
+                            attachment_file_clone.find('drs:attachment/base:Name',
+                                                       namespaces=ns).text = file.name
+                            attachment_file_clone.find('drs:attachment/base:Description',
+                                                       namespaces=ns).text = file.desc
+                            attachment_file_clone.find('drs:attachment/base:Attachment/base:AttachmentGUID',
+                                                       namespaces=ns).text = file.attachmentGUID
+                            attachment_file_clone.find('drs:attachment/base:AttachmentHASH',
+                                                       namespaces=ns).text = file.attachmentHASH
+                            debt_info_clone.append(attachment_file_clone)
+                        resp_data_node.append(debt_info_clone)
+            self.node.append(clone)
+        self._sign()
+
+
+def _synthetic_data(count: int = 100) -> list[GISResponseDataFormat]:
+    """
+    Ответы вперемешку: без долга, должник с отчеством и двумя файлами, двое должников (без отчества) с файлом
+    """
+    data = []
+    for i in range(count):
+        match i % 3:
+            case 0:
+                debtors = []
+            case 1:
+                debtors = [GISDebtorsData(persons=[PersonName('Иванов', 'Иван', 'Иванович')],
+                                          files=[GISFileDataFormat(f'order{i}.pdf', f'guid{i}', f'hash{i}'),
+                                                 GISFileDataFormat(f'act{i}.pdf', f'guid{i}a', f'hash{i}a', 'акт')])]
+            case _:
+                debtors = [GISDebtorsData(persons=[PersonName('Петров', 'Петр', ''), PersonName('Петрова', 'Анна')],
+                                          files=[GISFileDataFormat(f'order{i}.pdf', f'guid{i}', f'hash{i}')])]
+        data.append(GISResponseDataFormat(f'subrequest{i}', debtors))
+    return data
+
+
+def _canonical(doc: SendImportDebtResponses) -> bytes:
+    """
+    Каноническая форма без случайных значений (дата, MessageGUID, TransportGUID)
+    """
+    for elem in doc.get_elements('//base:Date | //base:MessageGUID | //base:TransportGUID'):
+        elem.text = ''
+    return doc.get_xml()
+
+
+def _measure(title: str, build, count: int) -> None:
+    start = time.perf_counter()
+    for _ in range(count):
+        build()
+    elapsed = time.perf_counter() - start
+    print(f'{title:>40}: {count / elapsed:10.1f} док/сек')
+
+
+def main(count: int) -> None:
+    data = _synthetic_data()
+    copied = _canonical(CopiedSendImportDebtResponses(data, signed=False))
+    built = _canonical(SendImportDebtResponses(data, signed=False))
+    assert copied == built, 'документы не совпадают'
+
+    _measure('importResponses (Send), deepcopy', lambda: CopiedSendImportDebtResponses(data, signed=False), count)
+    _measure('importResponses (Send), разметка', lambda: SendImportDebtResponses(data, signed=False), count)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,65 @@
+"""
+Сравнение скорости построения документов: разбор шаблона с диска на каждый документ против кэша шаблонов
+
+    python -m benchmarks.xml_templates [кол-во документов]
+"""
+import sys
+import time
+
+import lxml.etree as ET
+
+from src.base.state import GetStateXML
+from src.debt.debt_xml import RevokeImportDebtResponses
+
+
+class ParsedGetStateXML(GetStateXML):
+    """
+    Построение без кэша: шаблон читается с диска, узлы ищутся по xpath
+    """
+    def __init__(self) -> None:
+        self.tree = ET.parse(self.TEMPLATE)
+        self._build_header()
+
+
+class ParsedRevokeImportDebtResponses(RevokeImportDebtResponses):
+    def __init__(self, subrequests_guid: list[str]) -> None:
+        self.tree = ET.parse(self.TEMPLATE)
+        self._build_header()
+        self.signed = False
+        self.node = self.get_element(self.NODES['node'])
+        self.set_version('14.0.0.0')
+        resp_data = self.get_element(self.NODES['resp_data'])
+        self.debt_info = self.get_element(self.NODES['debt_info'])
+        self.attachment_file = self.get_element(self.NODES['attachment_file'])
+        self.debt_info.remove(self.attachment_file)
+        resp_data.remove(self.debt_info)
+        self.action = self.get_element(self.NODES['action'])
+        self.node.remove(self.action)
+        self.transport_guids = {}
+        self.subrequests_guid = subrequests_guid
+        self._build_body()
+
+
+def _measure(title: str, build, count: int) -> None:
+    start = time.perf_counter()
+    for _ in range(count):
+        build()
+    elapsed = time.perf_counter() - start
+    print(f'{title:>40}: {count / elapsed:10.1f} док/сек')
+
+
+def main(count: int) -> None:
+    guids = ['00000000-0000-0000-0000-000000000000']
+
+    def _state(cls):
+        doc = cls()
+        doc.set_message_guid(guids[0])
+
+    _measure('getState, разбор шаблона', lambda: _state(ParsedGetStateXML), count)
+    _measure('getState, кэш шаблона', lambda: _state(GetStateXML), count)
+    _measure('importResponses (Revoke), разбор шаблона', lambda: ParsedRevokeImportDebtResponses(guids), count)
+    _measure('importResponses (Revoke), кэш шаблона', lambda: RevokeImportDebtResponses(guids, signed=False), count)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -1,6 +1,8 @@
 import argparse
 import asyncio
+import sys
 from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
 
 import src.debt.agent_create_sheet
 import src.debt.agent_control
@@ -8,7 +10,15 @@ import src.debt.agent_get_req
 import src.debt.agent_send_debt2
 import src.debt.agent_read_sheet
 import src.debt.agent_mng_report
-from src.api.db.db import select_command, execute_command
+from src.api.db.db import close_db_pool
+from src.api.db.lease import Lease
+from src.api.db.migrations import migrate, require_schema_version
+from src.api.db.writer import close_writers
+from src.api.session import close_sessions
+from src.base.crypto import close_crypto_backends
+from src.base.signer import close_signer
+from src.config import project_config
+from src.debt.plans import check_query_plans
 from src.log.log import logger
 
 
@@ -16,17 +26,9 @@ class Agent(ABC):
     NAME = None
 
     @abstractmethod
-    async def is_agent_running(self) -> bool:
+    def get_lease(self) -> Lease:
         raise NotImplementedError
 
-    async def mark_agent_run(self, status: int) -> None:
-        sql = f"""
-            update agents 
-            set status = ?
-            where name = '{self.NAME}'
-        """
-        await execute_command(sql, status)
-
     @abstractmethod
     async def run_agent(self):
         raise NotImplementedError
@@ -41,16 +43,8 @@ class BaseAgent(Agent, ABC):
         'REP_MNG_AGENT': ('REP_MNG_AGENT', '')
     }
 
-    async def is_agent_running(self) -> bool:
-        check_agents = self.CHECK_AGENTS[self.NAME]
-        sql = f"""
-            select sum(STATUS)
-            from agents
-            where name IN {check_agents} 
-        """
-        if f := await select_command(sql):
-            return bool(f[0][0])
-        raise ValueError
+    def get_lease(self) -> Lease:
+        return Lease(self.NAME, self.CHECK_AGENTS[self.NAME])
 
 
 class ReqAgent(BaseAgent):
@@ -89,15 +83,135 @@ class CreateMngReportAgent(BaseAgent):
 
 
 async def start_agent(agent: BaseAgent):
-    if not await agent.is_agent_running():
-        await agent.mark_agent_run(1)
+    await require_schema_version()
+    lease = agent.get_lease()
+    if await lease.acquire():
+        async with lease.hold():
+            try:
+                await agent.run_agent()
+            except Exception as e:
+                logger.error(e)
+                raise
+
+
+class ControlAgent:
+    """
+    Проверка статусов отправленных ответов. Аренды в таблице agents нет, исключение только внутри процесса
+    """
+    NAME = 'CTRL_AGENT'
+
+    async def run_agent(self):
+        await require_schema_version()
         try:
-            await agent.run_agent()
+            await src.debt.agent_control.worker()
         except Exception as e:
             logger.error(e)
             raise
+
+
+AGENTS = {
+    'get': ReqAgent,
+    'send': RespAgent,
+    'create': CreateSpreadsheetAgent,
+    'read': ReadSpreadsheetAgent,
+    'mng': CreateMngReportAgent,
+    'ctrl': ControlAgent,
+}
+
+
+class Schedule:
+    """
+    Расписание агента в режиме daemon:
+        число - интервал в секундах, запуски выравниваются по часам (900 - в 00, 15, 30 и 45 минут)
+        HH:MM[,HH:MM...] - ежедневно в указанное время
+    """
+    def __init__(self, value: str) -> None:
+        self.value = value
+        self.times = []
+        self.interval = None
+        if ':' in value:
+            self.times = sorted(datetime.strptime(t.strip(), '%H:%M').time() for t in value.split(','))
+        else:
+            self.interval = float(value)
+
+    def next_delay(self, now: datetime) -> float:
+        if self.interval is not None:
+            return self.interval - now.timestamp() % self.interval
+        for day in (0, 1):
+            for t in self.times:
+                at = datetime.combine(now.date() + timedelta(days=day), t)
+                if at > now:
+                    return (at - now).total_seconds()
+
+
+class Daemon:
+    """
+    Запуск агентов по расписанию в одном цикле событий. Пулы соединений, сессии и подписант общие для всех запусков.
+    Правила CHECK_AGENTS соблюдаются в памяти процесса, аренда в таблице agents остается для других хостов
+    """
+    def __init__(self, schedules: dict[str, Schedule]) -> None:
+        self.schedules = schedules
+        self._running: set[str] = set()
+
+    def _try_lock(self, agent) -> bool:
+        conflicts = {agent.NAME, *BaseAgent.CHECK_AGENTS.get(agent.NAME, ())} - {''}
+        if self._running & conflicts:
+            return False
+        self._running.add(agent.NAME)
+        return True
+
+    async def run_once(self, command: str) -> None:
+        agent = AGENTS[command]()
+        if not self._try_lock(agent):
+            logger.info(f'{agent.NAME}: пропуск запуска, выполняется конфликтующий агент')
+            return
+        try:
+            if isinstance(agent, BaseAgent):
+                await start_agent(agent)
+            else:
+                await agent.run_agent()
+        except Exception as e:
+            # ошибка агента не останавливает остальные расписания
+            logger.info(f'{agent.NAME}: запуск завершился ошибкой: {e}')
         finally:
-            await agent.mark_agent_run(0)
+            self._running.discard(agent.NAME)
+
+    async def _loop(self, command: str, schedule: Schedule) -> None:
+        while True:
+            await asyncio.sleep(schedule.next_delay(datetime.now()))
+            await self.run_once(command)
+
+    async def run(self) -> None:
+        logger.info(f'Запуск в режиме daemon: {', '.join(f'{c}={s.value}' for c, s in self.schedules.items())}')
+        async with asyncio.TaskGroup() as tg:
+            for command, schedule in self.schedules.items():
+                tg.create_task(self._loop(command, schedule))
+
+
+def get_schedules() -> dict[str, Schedule]:
+    """
+    Расписания из секции [daemon]: <команда> = <расписание>, например get = 900, mng = 08:00
+    """
+    return {command: Schedule(project_config.config.get('daemon', command))
+            for command in AGENTS if project_config.config.get('daemon', command, fallback='')}
+
+
+async def shutdown() -> None:
+    """
+    Освобождение общих ресурсов процесса перед завершением
+    """
+    await close_writers()
+    await close_sessions()
+    await close_db_pool()
+    close_signer()
+    close_crypto_backends()
+
+
+async def run(coro):
+    try:
+        return await coro
+    finally:
+        await shutdown()
 
 
 if __name__ == '__main__':
@@ -109,21 +223,32 @@ if __name__ == '__main__':
     subparser.add_parser('read')
     subparser.add_parser('mng')
     subparser.add_parser('ctrl')
+    subparser.add_parser('daemon')
+    migrate_parser = subparser.add_parser('migrate')
+    migrate_parser.add_argument('--target', type=int, default=None, help='версия схемы БД')
+    subparser.add_parser('explain')
 
     args = parser.parse_args()
 
     match args.command:
         case 'get':
-            asyncio.run(start_agent(ReqAgent()))
+            asyncio.run(run(start_agent(ReqAgent())))
         case 'send':
-            asyncio.run(start_agent(RespAgent()))
+            asyncio.run(run(start_agent(RespAgent())))
         case 'create':
-            asyncio.run(start_agent(CreateSpreadsheetAgent()))
+            asyncio.run(run(start_agent(CreateSpreadsheetAgent())))
         case 'read':
-            asyncio.run(start_agent(ReadSpreadsheetAgent()))
+            asyncio.run(run(start_agent(ReadSpreadsheetAgent())))
         case 'mng':
-            asyncio.run(start_agent(CreateMngReportAgent()))
+            asyncio.run(run(start_agent(CreateMngReportAgent())))
         case 'ctrl':
-            asyncio.run(src.debt.agent_control.worker())
+            asyncio.run(run(ControlAgent().run_agent()))
+        case 'daemon':
+            asyncio.run(run(Daemon(get_schedules()).run()))
+        case 'migrate':
+            asyncio.run(run(migrate(args.target)))
+        case 'explain':
+            ok = asyncio.run(run(check_query_plans()))
+            sys.exit(0 if ok else 1)
         case _:
             parser.print_help()
@@ -1,26 +1,197 @@
+import asyncio
 import os
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 from functools import wraps
-from typing import Any
+from typing import Any, Optional
 
 import aioodbc
 
+from src.config import project_config
 from src.log.log import logger
 
 
+def _get_dsn() -> str:
+    return (
+        "Driver={MariaDB ODBC 3.2 Driver};"
+        "Server=localhost;"
+        "Database=Rinoca2;"
+        f"UID={os.getenv('gis_uid')};"
+        f"PWD={os.getenv('gis_pwd')};"
+        "MAX_ALLOWED_PACKET=1073741824;"  # 1GB (по умолчанию 16MB)
+        "NET_BUFFER_LENGTH=1048576;"
+        "TrustServerCertificate=no;"
+    )
+
+
+class DBPool:
+    """
+    Пул соединений с БД. Создается лениво при первом обращении и живет до вызова close()
+        minsize / maxsize - границы размера пула
+        pool_recycle - через сколько секунд простоя соединение пересоздается (-1 - никогда)
+        ping_interval - через сколько секунд простоя соединение проверяется запросом перед выдачей
+    """
+    def __init__(self, minsize: int = 1, maxsize: int = 10, pool_recycle: int = 3600, ping_interval: int = 60) -> None:
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.pool_recycle = pool_recycle
+        self.ping_interval = ping_interval
+        self._pool: Optional[aioodbc.Pool] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def get_pool(self) -> aioodbc.Pool:
+        if self._pool is None:
+            if self._lock is None:
+                self._lock = asyncio.Lock()
+            async with self._lock:
+                if self._pool is None:
+                    self._pool = await aioodbc.create_pool(dsn=_get_dsn(),
+                                                           minsize=self.minsize,
+                                                           maxsize=self.maxsize,
+                                                           pool_recycle=self.pool_recycle)
+                    logger.info(f'Создан пул соединений с БД ({self.minsize}-{self.maxsize})')
+        return self._pool
+
+    async def _is_alive(self, conn: aioodbc.Connection) -> bool:
+        """
+        Проверка соединения, которое долго простаивало в пуле
+        """
+        if conn.closed:
+            return False
+        if asyncio.get_running_loop().time() - conn.last_usage < self.ping_interval:
+            return True
+        try:
+            async with conn.cursor() as cursor:
+                await cursor.execute('select 1')
+                await cursor.fetchone()
+            return True
+        except Exception as e:
+            logger.info(f'Соединение с БД не прошло проверку: {e}')
+            return False
+
+    @staticmethod
+    async def _reset(conn: aioodbc.Connection) -> None:
+        """
+        Откат незавершенной транзакции перед возвратом соединения в пул. Если откат не удался,
+        соединение закрывается: сервер откатит транзакцию и снимет блокировки строк сам
+        """
+        if conn.closed:
+            return
+        try:
+            await conn.rollback()
+        except BaseException as e:
+            logger.info(f'Откат транзакции не выполнен, соединение с БД закрывается: {e!r}')
+            await conn.close()
+            if not isinstance(e, Exception):
+                raise
+
+    @asynccontextmanager
+    async def acquire(self):
+        """
+        Выдача проверенного соединения из пула. Соединение, не ответившее на проверку, закрывается
+        и возвращается в пул сразу, поэтому в finally освобождается только выданное соединение.
+        Соединение, возвращаемое после исключения (в том числе отмены задачи), откатывается,
+        чтобы следующий владелец не зафиксировал чужую незавершенную работу
+        """
+        pool = await self.get_pool()
+        conn = await pool.acquire()
+        try:
+            if not await self._is_alive(conn):
+                stale, conn = conn, None
+                try:
+                    if not stale.closed:
+                        await stale.close()
+                finally:
+                    await pool.release(stale)
+                conn = await pool.acquire()
+            try:
+                yield conn
+            except BaseException:
+                await self._reset(conn)
+                raise
+        finally:
+            if conn is not None:
+                await pool.release(conn)
+
+    async def close(self) -> None:
+        if self._pool is not None:
+            self._pool.close()
+            await self._pool.wait_closed()
+            self._pool = None
+            self._lock = None
+            logger.info('Пул соединений с БД закрыт')
+
+
+db_pool = DBPool(minsize=project_config.config.getint('db_pool', 'minsize', fallback=1),
+                 maxsize=project_config.config.getint('db_pool', 'maxsize', fallback=10),
+                 pool_recycle=project_config.config.getint('db_pool', 'recycle', fallback=3600),
+                 ping_interval=project_config.config.getint('db_pool', 'ping_interval', fallback=60))
+
+
+async def close_db_pool() -> None:
+    await db_pool.close()
+
+
+class Transaction:
+    """
+    Единица работы: одно соединение и один курсор на несколько запросов с общим commit
+    """
+    def __init__(self, cursor) -> None:
+        self.cursor = cursor
+
+    async def select(self, command: str, *args):
+        await self.cursor.execute(command, args)
+        return await self.cursor.fetchall()
+
+    async def execute(self, command: str, *args) -> int:
+        await self.cursor.execute(command, args)
+        return self.cursor.rowcount
+
+    async def executemany(self, command: str, params: list[tuple[Any]]) -> None:
+        await self.cursor.executemany(command, params)
+
+
+_current_transaction: ContextVar[Optional[Transaction]] = ContextVar('_current_transaction', default=None)
+
+
+@asynccontextmanager
+async def transaction():
+    """
+    Все вызовы select_command/execute_command/executemany_command внутри блока выполняются в одной транзакции
+    и фиксируются одним commit на выходе (rollback при исключении и отмене задачи). Вложенный блок присоединяется
+    к внешнему.
+    Курсор общий, поэтому внутри блока запросы к БД нельзя выполнять параллельно (asyncio.gather)
+    """
+    if (tx := _current_transaction.get()) is not None:
+        yield tx
+        return
+
+    async with db_pool.acquire() as conn:
+        async with conn.cursor() as cursor:
+            tx = Transaction(cursor)
+            token = _current_transaction.set(tx)
+            try:
+                yield tx
+                await conn.commit()
+            except BaseException:
+                await conn.rollback()
+                raise
+            finally:
+                _current_transaction.reset(token)
+
+
 def connect_db(func):
     @wraps(func)
     async def wrapper(*args, **kwargs):
-        dsn = (
-            "Driver={MariaDB ODBC 3.2 Driver};"
-            "Server=localhost;"
-            "Database=Rinoca2;"
-            f"UID={os.getenv("gis_uid")};"
-            f"PWD={os.getenv("gis_pwd")};"
-            "MAX_ALLOWED_PACKET=1073741824;"  # 1GB (по умолчанию 16MB)
-            "NET_BUFFER_LENGTH=1048576;" 
-            "TrustServerCertificate=no;"
-        )
-        async with aioodbc.connect(dsn=dsn) as conn:
+        if (tx := _current_transaction.get()) is not None:
+            try:
+                return await func(*args, cursor=tx.cursor, **kwargs)
+            except Exception as e:
+                if 'duplicate' not in str(e).lower():
+                    logger.error(f"Error executing {func.__name__}: {e}")
+                raise Exception(f"Error executing {func.__name__}: {e}")
+
+        async with db_pool.acquire() as conn:
             async with conn.cursor() as cursor:
                 try:
                     result = await func(*args, cursor=cursor, **kwargs)
@@ -31,8 +202,10 @@ def connect_db(func):
                         logger.error(f"Error executing {func.__name__}: {e}")
                     await conn.rollback()
                     raise Exception(f"Error executing {func.__name__}: {e}")
-                # finally:
-                #     await conn.close()
+                except BaseException:
+                    # отмена задачи: соединение возвращается в пул без открытой транзакции
+                    await conn.rollback()
+                    raise
     return wrapper
 
 
@@ -0,0 +1,149 @@
+import asyncio
+import os
+import socket
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Iterable, Optional
+
+from src.api.db.db import transaction
+from src.config import project_config
+from src.log.log import logger
+
+# срок аренды, сек
+LEASE_TTL = project_config.config.getint('lease', 'ttl', fallback=120)
+# период продления аренды, сек
+HEARTBEAT = project_config.config.getint('lease', 'heartbeat', fallback=LEASE_TTL // 3)
+# владелец аренды: хост, процесс и экземпляр
+OWNER = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+# колонки аренды в таблице agents
+LEASE_COLUMNS_DDL = """
+    alter table agents
+        add column if not exists owner varchar(128) null,
+        add column if not exists lease_until datetime null
+"""
+
+
+_columns_checked = False
+
+
+class LeaseLost(Exception):
+    pass
+
+
+async def check_lease_columns() -> None:
+    """
+    Проверка схемы перед первым захватом аренды: без колонок owner и lease_until агент останавливается
+    с понятной ошибкой, а не ошибкой SQL
+    """
+    global _columns_checked
+    if _columns_checked:
+        return
+    async with transaction() as tx:
+        rows = await tx.select("""
+            select column_name
+            from information_schema.columns
+            where table_schema = database() and table_name = 'agents' and column_name in ('owner', 'lease_until')
+        """)
+    if missing := {'owner', 'lease_until'} - {row[0].lower() for row in rows}:
+        raise RuntimeError(f'В таблице agents нет колонок аренды {sorted(missing)}: выполните migrate '
+                           f'(миграция agents_lease, LEASE_COLUMNS_DDL)')
+    _columns_checked = True
+
+
+class Lease:
+    """
+    Аренда агента в таблице agents вместо флага status.
+    Захват атомарный: строки конфликтующих агентов блокируются (select ... for update), и аренда берется,
+    только если ни одна из них не занята действующей арендой другого владельца.
+    Просроченная аренда (процесс завершился аварийно) перехватывается. Пока агент работает,
+    аренда продлевается в фоне; при потере аренды агент отменяется
+    """
+    def __init__(self, name: str, conflicts: Iterable[str] = (), ttl: int = LEASE_TTL,
+                 heartbeat: int = HEARTBEAT, owner: str = OWNER) -> None:
+        self.name = name
+        self.names = sorted({name, *conflicts} - {''})
+        self.ttl = ttl
+        self.heartbeat = heartbeat
+        self.owner = owner
+        self.lost = False
+        self._renewed: Optional[float] = None
+
+    async def acquire(self) -> bool:
+        await check_lease_columns()
+        async with transaction() as tx:
+            rows = await tx.select(f"""
+                select name, status, owner, lease_until > now()
+                from agents
+                where name in ({', '.join(['?'] * len(self.names))})
+                order by name
+                for update
+            """, *self.names)
+            for name, status, owner, active in rows:
+                if status and owner != self.owner:
+                    if active:
+                        logger.info(f'{self.name}: выполняется {name} ({owner})')
+                        return False
+                    logger.info(f'{self.name}: перехват просроченной аренды {name} ({owner})')
+            await tx.execute("""
+                update agents
+                set status = 1, owner = ?, lease_until = now() + interval ? second
+                where name = ?
+            """, self.owner, self.ttl, self.name)
+        self._renewed = time.monotonic()
+        return True
+
+    async def renew(self) -> bool:
+        async with transaction() as tx:
+            count = await tx.execute("""
+                update agents
+                set lease_until = now() + interval ? second
+                where name = ? and owner = ? and status = 1
+            """, self.ttl, self.name, self.owner)
+        if count:
+            self._renewed = time.monotonic()
+        return bool(count)
+
+    async def release(self) -> None:
+        async with transaction() as tx:
+            await tx.execute("""
+                update agents
+                set status = 0, owner = null, lease_until = null
+                where name = ? and owner = ?
+            """, self.name, self.owner)
+
+    async def _keep_alive(self, task: asyncio.Task) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            try:
+                if await self.renew():
+                    continue
+                logger.error(f'{self.name}: аренда перехвачена другим владельцем')
+            except Exception as e:
+                if time.monotonic() - self._renewed < self.ttl - self.heartbeat:
+                    logger.info(f'{self.name}: ошибка продления аренды: {e}')
+                    continue
+                logger.error(f'{self.name}: аренда истекла, продление не удалось: {e}')
+            self.lost = True
+            task.cancel()
+            return
+
+    @asynccontextmanager
+    async def hold(self):
+        """
+        Продление захваченной аренды на время блока и освобождение на выходе
+        """
+        task = asyncio.current_task()
+        keep_alive = asyncio.create_task(self._keep_alive(task))
+        try:
+            yield self
+        except asyncio.CancelledError:
+            if self.lost:
+                task.uncancel()
+                raise LeaseLost(f'{self.name}: аренда потеряна, выполнение прервано')
+            raise
+        finally:
+            keep_alive.cancel()
+            if not self.lost:
+                await self.release()
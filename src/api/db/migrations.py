@@ -0,0 +1,274 @@
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Optional
+
+from src.api.db.db import Transaction, transaction
+from src.api.db.lease import LEASE_COLUMNS_DDL
+from src.api.db.queue import WORK_QUEUE_DDL
+from src.log.log import logger
+
+
+@dataclass(frozen=True)
+class Migration:
+    """
+    Версия схемы БД. DDL в MariaDB фиксируется неявно, поэтому команды написаны повторяемыми
+    (if not exists либо шаг с проверкой текущей схемы): после сбоя посередине миграция запускается заново.
+    Команда - строка SQL либо асинхронная функция, получающая транзакцию
+    """
+    version: int
+    name: str
+    statements: tuple[str | Callable[[Transaction], Awaitable[None]], ...]
+
+
+SCHEMA_MIGRATIONS_DDL = """
+    create table if not exists schema_migrations (
+        version int not null primary key,
+        name varchar(128) not null,
+        applied_at datetime not null default current_timestamp
+    )
+"""
+
+async def _ext_reports_form_date(tx: Transaction) -> None:
+    """
+    ext_reports.form_date: строка 'dd-mm-YYYY' -> DATE (условие по str_to_date не использует индекс).
+    Тип колонки проверяется заранее, поэтому шаг повторяем; строки, которые не разбираются, не теряются -
+    миграция останавливается с их перечнем
+    """
+    rows = await tx.select("""
+        select data_type
+        from information_schema.columns
+        where table_schema = database() and table_name = 'ext_reports' and column_name = 'form_date'
+    """)
+    if rows and rows[0][0].lower() == 'date':
+        await tx.execute('alter table ext_reports drop column if exists form_day')
+        return
+    await tx.execute('alter table ext_reports add column if not exists form_day date null')
+    await tx.execute("""
+        update ext_reports
+        set form_day = str_to_date(form_date, '%d-%m-%Y')
+        where form_day is null and str_to_date(form_date, '%d-%m-%Y') is not null
+    """)
+    if invalid := await tx.select('select report_id, form_date from ext_reports where form_day is null'):
+        logger.error(f'ext_reports: form_date не в формате dd-mm-YYYY: {invalid}')
+        raise ValueError(f'ext_reports: не разобрано {len(invalid)} значений form_date')
+    await tx.execute("""
+        alter table ext_reports
+            drop column form_date,
+            change column form_day form_date date not null
+    """)
+
+
+MIGRATIONS = (
+    # схема, существовавшая до миграций: на рабочей БД команды ничего не меняют (if not exists),
+    # новая БД создается с нуля. Типы колонок - исходные, их изменения выполняют следующие миграции
+    Migration(1, 'baseline', (
+        """
+        create table if not exists agents (
+            name varchar(32) not null primary key,
+            status tinyint not null default 0
+        )
+        """,
+        """
+        insert ignore into agents (name)
+        values ('REQ_AGENT'), ('RESP_AGENT'), ('REP_R_AGENT'), ('REP_C_AGENT'), ('REP_MNG_AGENT')
+        """,
+        # resp_status - RequestState либо описание ошибки из importResult
+        """
+        create table if not exists details_a (
+            id bigint not null auto_increment primary key,
+            sent_date date null,
+            response_date date null,
+            subrequestguid varchar(36) not null,
+            fias varchar(36) null,
+            address varchar(512) null,
+            apartment varchar(32) null,
+            persons varchar(1024) null,
+            account varchar(32) null,
+            doc_arm_number varchar(32) null,
+            doc_date varchar(32) null,
+            case_number varchar(64) null,
+            sum_debt decimal(12, 2) not null default 0,
+            penalty decimal(12, 2) not null default 0,
+            duty decimal(12, 2) not null default 0,
+            total decimal(12, 2) not null default 0,
+            is_exp tinyint not null default 0,
+            is_debt tinyint not null default 0,
+            resp_status varchar(512) null,
+            ack_guid varchar(36) null
+        )
+        """,
+        """
+        create table if not exists requests (
+            requestguid varchar(36) not null primary key,
+            answer varchar(32) not null,
+            sent_date date null,
+            answer_time datetime null
+        )
+        """,
+        """
+        create table if not exists ext_reports (
+            form_date varchar(10) not null,
+            report_id varchar(64) not null primary key,
+            title varchar(255) null,
+            comment varchar(1024) null
+        )
+        """,
+        """
+        create table if not exists check_history (
+            id bigint not null auto_increment primary key,
+            sent_date varchar(32) null,
+            requestguid varchar(36) null,
+            debtors varchar(1024) null,
+            sp_no varchar(64) null,
+            buh varchar(32) null
+        )
+        """,
+        """
+        create table if not exists holidays (
+            date date not null primary key
+        )
+        """,
+        # помесячные итоги за период до появления таблицы requests (период - 'mm.YYYY')
+        """
+        create table if not exists statistics (
+            period varchar(7) not null primary key,
+            total int not null default 0,
+            debt int not null default 0
+        )
+        """,
+    )),
+    Migration(2, 'agents_lease', (LEASE_COLUMNS_DDL,)),
+    Migration(3, 'ext_reports_form_date', (_ext_reports_form_date,)),
+    Migration(4, 'hot_query_indexes', (
+        # отправка ответов: is_debt = 1 and resp_status is null, группировка по subrequestguid
+        """
+        create index if not exists ix_details_a_send on details_a (is_debt, resp_status, subrequestguid)
+        """,
+        # выгрузка на проверку: is_exp = 0
+        """
+        create index if not exists ix_details_a_is_exp on details_a (is_exp)
+        """,
+        # сверка состояний: distinct ack_guid where resp_status != 3 (покрывающий) и update по ack_guid
+        """
+        create index if not exists ix_details_a_ack on details_a (ack_guid, resp_status)
+        """,
+        # обновление и удаление строк подзапроса
+        """
+        create index if not exists ix_details_a_subrequest on details_a (subrequestguid)
+        """,
+        # отчет по месяцам: группировка по sent_date с подсчетом answer (покрывающий)
+        """
+        create index if not exists ix_requests_sent_date on requests (sent_date, answer)
+        """,
+        """
+        create index if not exists ix_ext_reports_form_date on ext_reports (form_date)
+        """,
+    )),
+    Migration(5, 'work_queue', (
+        WORK_QUEUE_DDL,
+        # подзапросы, отмеченные до появления очереди
+        """
+        insert ignore into work_queue (queue, item_key)
+        select distinct 'send_debt', subrequestguid
+        from details_a
+        where is_debt = 1 and resp_status is null
+        """,
+    )),
+    Migration(6, 'details_a_transport_guid', (
+        # TransportGUID действия пакетной отправки: агент контроля сверяет ответы пакета по действиям
+        """
+        alter table details_a add column if not exists transport_guid varchar(36) null
+        """,
+        """
+        create index if not exists ix_details_a_transport on details_a (transport_guid)
+        """,
+    )),
+    Migration(7, 'details_a_ack_covering', (
+        # сверка состояний выбирает и transport_guid: индекс снова покрывающий
+        """
+        drop index if exists ix_details_a_ack on details_a
+        """,
+        """
+        create index ix_details_a_ack on details_a (ack_guid, resp_status, transport_guid)
+        """,
+    )),
+)
+
+
+async def get_schema_version() -> int:
+    async with transaction() as tx:
+        await tx.execute(SCHEMA_MIGRATIONS_DDL)
+        rows = await tx.select('select max(version) from schema_migrations')
+    return rows[0][0] or 0
+
+
+async def require_schema_version(version: Optional[int] = None) -> None:
+    """
+    Проверка перед запуском агента: схема БД не ниже version (по умолчанию - последней миграции).
+    Запросы агентов рассчитаны на последнюю схему, например сравнение ext_reports.form_date как DATE
+    """
+    version = MIGRATIONS[-1].version if version is None else version
+    if (current := await get_schema_version()) < version:
+        raise RuntimeError(f'Версия схемы БД {current} ниже требуемой {version}, выполните migrate')
+
+
+async def migrate(target: Optional[int] = None) -> list[Migration]:
+    """
+    Применение миграций новее текущей версии схемы (до target включительно). Каждая миграция
+    записывается в schema_migrations после выполнения всех ее команд
+    """
+    version = await get_schema_version()
+    applied = []
+    for migration in MIGRATIONS:
+        if migration.version <= version or (target is not None and migration.version > target):
+            continue
+        logger.info(f'Миграция {migration.version} {migration.name}')
+        async with transaction() as tx:
+            for statement in migration.statements:
+                if callable(statement):
+                    await statement(tx)
+                else:
+                    await tx.execute(statement)
+            await tx.execute('insert into schema_migrations (version, name) values (?, ?)',
+                             migration.version, migration.name)
+        applied.append(migration)
+    logger.info(f'Версия схемы БД: {applied[-1].version if applied else version}')
+    return applied
+
+
+@dataclass(frozen=True)
+class PlanCheck:
+    """
+    Ожидание к плану запроса: обращение к таблице table может использовать индекс index.
+    chosen - индекс должен быть выбран оптимизатором (key): для запросов без условия по началу индекса,
+    где он применяется только как покрывающий для полного просмотра
+    """
+    name: str
+    sql: str
+    table: str
+    index: str
+    args: tuple[Any, ...] = ()
+    chosen: bool = False
+
+
+async def check_plans(checks: list[PlanCheck]) -> list[str]:
+    """
+    EXPLAIN запросов и проверка, что индекс доступен оптимизатору (possible_keys) либо выбран (key).
+    Проверка по possible_keys не зависит от объема данных. Проверка chosen зависит: на малых таблицах
+    оптимизатор выбирает полный просмотр таблицы вместо индекса, поэтому такие проверки имеют смысл
+    только на БД с рабочим объемом данных. Возвращает описания нарушений
+    """
+    errors = []
+    async with transaction() as tx:
+        for check in checks:
+            # id, select_type, table, type, possible_keys, key, key_len, ref, rows, Extra
+            rows = [row for row in await tx.select(f'explain {check.sql}', *check.args) if row[2] == check.table]
+            if not rows:
+                errors.append(f'{check.name}: в плане нет таблицы {check.table}')
+                continue
+            for row in rows:
+                possible_keys = (row[4] or '').split(',')
+                logger.info(f'{check.name}: {check.table} type={row[3]} key={row[5]} rows={row[8]}')
+                if row[5] != check.index and (check.chosen or check.index not in possible_keys):
+                    errors.append(f'{check.name}: индекс {check.index} не применим '
+                                  f'(type={row[3]}, possible_keys={row[4]}, key={row[5]})')
+    return errors
@@ -0,0 +1,183 @@
+import json
+from dataclasses import dataclass
+from typing import Any, Iterable, Optional
+
+from src.api.db.db import transaction
+from src.api.db.lease import OWNER
+from src.config import project_config
+from src.log.log import logger
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# таблица очереди заданий. Для заданий в работе next_run_at - срок блокировки:
+# после аварийного завершения обработчика задание снова выдается по истечении lock_ttl
+WORK_QUEUE_DDL = """
+    create table if not exists work_queue (
+        id bigint not null auto_increment primary key,
+        queue varchar(32) not null,
+        item_key varchar(64) not null,
+        payload text null,
+        state varchar(16) not null default 'pending',
+        attempts int not null default 0,
+        next_run_at datetime not null default current_timestamp,
+        owner varchar(128) null,
+        last_error varchar(1024) null,
+        created_at datetime not null default current_timestamp,
+        updated_at datetime not null default current_timestamp on update current_timestamp,
+        unique key uq_work_queue_item (queue, item_key),
+        key ix_work_queue_claim (queue, state, next_run_at)
+    )
+"""
+
+
+def _option(queue: str, option: str, fallback: float) -> float:
+    fallback = project_config.config.getfloat('queue', option, fallback=fallback)
+    return project_config.config.getfloat(f'queue_{queue}', option, fallback=fallback)
+
+
+def _placeholders(values: list) -> str:
+    return ', '.join(['?'] * len(values))
+
+
+@dataclass(frozen=True)
+class Job:
+    """
+    Выданное задание: key - ключ объекта (например, subrequestGUID), attempts - номер попытки
+    """
+    id: int
+    key: str
+    payload: Any
+    attempts: int
+
+
+class WorkQueue:
+    """
+    Очередь заданий в таблице work_queue с явными состояниями pending -> running -> done / failed.
+    Задания выдаются пакетами (claim): строки блокируются select ... for update skip locked,
+    поэтому несколько обработчиков разбирают очередь одновременно, не пересекаясь.
+    Неудачное задание возвращается в очередь с экспоненциальной паузой,
+    после max_attempts попыток переходит в failed
+        lock_ttl - срок блокировки выданного задания, сек
+        max_attempts - количество попыток
+        backoff / max_backoff - пауза после первой неудачной попытки и предельная пауза, сек
+    """
+    def __init__(self, name: str, owner: str = OWNER) -> None:
+        self.name = name
+        self.owner = owner
+        self.lock_ttl = int(_option(name, 'lock_ttl', 7200))
+        self.max_attempts = int(_option(name, 'max_attempts', 5))
+        self.backoff = int(_option(name, 'backoff', 600))
+        self.max_backoff = int(_option(name, 'max_backoff', 86400))
+
+    async def enqueue(self, items: Iterable[tuple[str, Any]]) -> None:
+        """
+        Постановка заданий (ключ, данные). Завершенное или отклоненное задание с тем же ключом
+        ставится заново, задание в работе не меняется
+        """
+        rows = [(self.name, key, json.dumps(payload, ensure_ascii=False) if payload is not None else None)
+                for key, payload in items]
+        if not rows:
+            return
+        async with transaction() as tx:
+            await tx.executemany(f"""
+                insert into work_queue (queue, item_key, payload)
+                values (?, ?, ?)
+                on duplicate key update
+                    payload = values(payload),
+                    attempts = if(state = '{RUNNING}', attempts, 0),
+                    next_run_at = if(state = '{RUNNING}', next_run_at, now()),
+                    last_error = if(state = '{RUNNING}', last_error, null),
+                    state = if(state = '{RUNNING}', state, '{PENDING}')
+            """, rows)
+
+    async def enqueue_missing(self, keys_sql: str, *args) -> int:
+        """
+        Постановка ключей из запроса keys_sql (колонка item_key), которых еще нет в очереди.
+        Сверка с таблицами, где работа отмечается флагами: задания в любом состоянии не меняются
+        """
+        async with transaction() as tx:
+            return await tx.execute(f"""
+                insert ignore into work_queue (queue, item_key)
+                select ?, keys.item_key
+                from ({keys_sql}) keys
+            """, self.name, *args)
+
+    async def claim(self, limit: int) -> list[Job]:
+        """
+        Выдача не более limit готовых заданий: ожидающих и брошенных (срок блокировки истек)
+        """
+        async with transaction() as tx:
+            rows = await tx.select(f"""
+                select id, item_key, payload, attempts
+                from work_queue
+                where queue = ? and state in ('{PENDING}', '{RUNNING}') and next_run_at <= now()
+                order by next_run_at
+                limit ?
+                for update skip locked
+            """, self.name, limit)
+            if not rows:
+                return []
+            ids = [row[0] for row in rows]
+            await tx.execute(f"""
+                update work_queue
+                set state = '{RUNNING}', owner = ?, attempts = attempts + 1,
+                    next_run_at = now() + interval ? second
+                where id in ({_placeholders(ids)})
+            """, self.owner, self.lock_ttl, *ids)
+        return [Job(id=id_, key=key, payload=json.loads(payload) if payload is not None else None,
+                    attempts=attempts + 1)
+                for id_, key, payload, attempts in rows]
+
+    async def complete(self, jobs: list[Job]) -> None:
+        if not jobs:
+            return
+        ids = [job.id for job in jobs]
+        async with transaction() as tx:
+            count = await tx.execute(f"""
+                update work_queue
+                set state = '{DONE}', owner = null, last_error = null
+                where id in ({_placeholders(ids)}) and owner = ?
+            """, *ids, self.owner)
+        if count < len(ids):
+            logger.info(f'{self.name}: {len(ids) - count} из {len(ids)} заданий выданы повторно другому обработчику')
+
+    async def fail(self, job: Job, error: str) -> None:
+        """
+        Возврат задания в очередь с паузой backoff * 2^(попытка - 1), после max_attempts попыток - failed
+        """
+        async with transaction() as tx:
+            await tx.execute(f"""
+                update work_queue
+                set state = if(attempts >= ?, '{FAILED}', '{PENDING}'),
+                    next_run_at = now() + interval least(? * power(2, attempts - 1), ?) second,
+                    owner = null, last_error = ?
+                where id = ? and owner = ?
+            """, self.max_attempts, self.backoff, self.max_backoff, str(error)[:1024], job.id, self.owner)
+        if job.attempts >= self.max_attempts:
+            logger.error(f'{self.name}: задание {job.key} отклонено после {job.attempts} попыток: {error}')
+
+    async def stats(self) -> dict[str, int]:
+        """
+        Количество заданий по состояниям
+        """
+        async with transaction() as tx:
+            rows = await tx.select("""
+                select state, count(*)
+                from work_queue
+                where queue = ?
+                group by state
+            """, self.name)
+        return {state: count for state, count in rows}
+
+    async def purge(self, days: int = 30) -> Optional[int]:
+        """
+        Удаление завершенных заданий старше days дней
+        """
+        async with transaction() as tx:
+            return await tx.execute(f"""
+                delete from work_queue
+                where queue = ? and state = '{DONE}' and updated_at < now() - interval ? day
+            """, self.name, days)
@@ -0,0 +1,99 @@
+import asyncio
+import contextvars
+from typing import Any, Optional
+
+from src.api.db.db import transaction
+from src.config import project_config
+from src.log.log import logger
+
+_writers: list['BufferedWriter'] = []
+
+
+class BufferedWriter:
+    """
+    Накопитель строк для пакетной записи в БД одним executemany.
+    Сброс в БД происходит при накоплении size строк, через interval секунд после первой строки пакета,
+    по flush_writers и при закрытии (close_writers). Если пакет не записался, строки повторяются по одной,
+    каждая незаписанная строка попадает в лог.
+    Строки в памяти теряются при аварийном завершении процесса, поэтому через накопитель пишутся только
+    строки, которые повторная обработка сформирует заново либо запишет повторно без вреда:
+        - requests (mobill.subrequests_writer) - insert ... on duplicate key update по requestguid;
+        - details_a (mobill.check_subrequests_writer) - строки подзапросов, ответ на которые еще
+          не отправлен: перед отправкой ответов накопители сбрасываются (flush_writers), а подзапрос
+          без ответа выгружается и обрабатывается заново при следующем запуске агента
+    """
+    def __init__(self, command: str, size: int = 200, interval: float = 5.0) -> None:
+        self.command = command
+        self.size = size
+        self.interval = interval
+        self._rows: list[tuple[Any, ...]] = []
+        self._lock: Optional[asyncio.Lock] = None
+        self._timer: Optional[asyncio.Task] = None
+        _writers.append(self)
+
+    async def write(self, row: tuple[Any, ...]) -> None:
+        self._rows.append(row)
+        if len(self._rows) >= self.size:
+            await self.flush()
+        elif self._timer is None:
+            # таймер не должен наследовать транзакцию вызывающего кода
+            self._timer = asyncio.create_task(self._flush_later(), context=contextvars.Context())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.interval)
+        self._timer = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            rows, self._rows = self._rows, []
+            if not rows:
+                return
+            # запросы выполняются через transaction: ошибки не пишутся в лог по каждой строке (connect_db),
+            # а собираются в одно сообщение на пакет
+            try:
+                async with transaction() as tx:
+                    await tx.executemany(self.command, rows)
+            except Exception as e:
+                logger.info(f'Ошибка пакетной записи в БД ({len(rows)} строк), запись по одной строке. {e=}')
+                dropped = []
+                for row in rows:
+                    try:
+                        async with transaction() as tx:
+                            await tx.execute(self.command, *row)
+                    except Exception as e:
+                        dropped.append(f'{row}. {e=}')
+                if dropped:
+                    logger.error(f'Отброшено {len(dropped)} из {len(rows)} строк ({" ".join(self.command.split())}):\n'
+                                 + '\n'.join(dropped))
+
+    async def close(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await self.flush()
+        self._lock = None
+
+
+def create_writer(command: str) -> BufferedWriter:
+    return BufferedWriter(command,
+                          size=project_config.config.getint('db_writer', 'size', fallback=200),
+                          interval=project_config.config.getfloat('db_writer', 'interval', fallback=5.0))
+
+
+async def flush_writers() -> None:
+    """
+    Запись накопленных строк всех накопителей, например перед отправкой ответов в ГИС ЖКХ
+    """
+    for writer in _writers:
+        await writer.flush()
+
+
+async def close_writers() -> None:
+    """
+    Запись всех накопленных строк. Вызывается при завершении агента
+    """
+    for writer in _writers:
+        await writer.close()
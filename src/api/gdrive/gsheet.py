@@ -19,6 +19,8 @@ def cast_column_to_A1_note(col_num: int) -> str:
 
 class GoogleAsyncAPI:
     """Google Sheets API"""
+    # менеджер клиента на профиль: авторизация переиспользуется и обновляется самим менеджером
+    _managers: dict[str, AsyncioGspreadClientManager] = {}
 
     def __init__(self, gc: AsyncioGspreadClient) -> None:
         if isinstance(gc, AsyncioGspreadClient):
@@ -46,14 +48,16 @@ class GoogleAsyncAPI:
             path = Path(__file__).resolve().parents[3] / 'conf/sah.json'
             return _get_creds(path)
 
-        match profile:
-            case 'rinoca':
-                agcm = AsyncioGspreadClientManager(rinoca_service_creds)
-            case 'sah':
-                agcm = AsyncioGspreadClientManager(sah_service_creds)
-            case _:
-                logger.error('Неверно указан профиль авторизации Google')
-                raise
+        if (agcm := cls._managers.get(profile)) is None:
+            match profile:
+                case 'rinoca':
+                    agcm = AsyncioGspreadClientManager(rinoca_service_creds)
+                case 'sah':
+                    agcm = AsyncioGspreadClientManager(sah_service_creds)
+                case _:
+                    logger.error('Неверно указан профиль авторизации Google')
+                    raise
+            cls._managers[profile] = agcm
 
         agc = await agcm.authorize()
         return cls(agc)
@@ -1,9 +1,10 @@
 from dataclasses import dataclass
+from datetime import date
 
 
 @dataclass(frozen=True)
 class GReportAttributes:
-    form_date: str
+    form_date: date
     report_id: str
     title: str = 'Report'
     comment: str = ''
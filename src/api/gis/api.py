@@ -1,5 +1,8 @@
+from typing import AsyncIterator
+
 import aiohttp
 
+from src.api.session import GIS, get_session
 from src.log.log import logger
 
 
@@ -8,11 +11,29 @@ async def gis_api_fetch(url: str, soap_action: str, xml: str) -> str:
         'SOAPAction': soap_action,
         'Content-Type': 'text/xml'
     }
-    async with aiohttp.ClientSession() as s:
-        try:
-            async with s.post(url=url, headers=headers, data=xml) as response:
-                text = await response.text(encoding='utf-8')
-                return text
-        except aiohttp.ClientResponseError as e:
-            logger.error(f'HTTP error occurred {e.status}')
-            raise
+    s = get_session(GIS)
+    try:
+        async with s.post(url=url, headers=headers, data=xml) as response:
+            text = await response.text(encoding='utf-8')
+            return text
+    except aiohttp.ClientResponseError as e:
+        logger.error(f'HTTP error occurred {e.status}')
+        raise
+
+
+async def gis_api_stream(url: str, soap_action: str, xml: str, chunk_size: int = 65536) -> AsyncIterator[bytes]:
+    """
+    Тело ответа частями по мере получения
+    """
+    headers = {
+        'SOAPAction': soap_action,
+        'Content-Type': 'text/xml'
+    }
+    s = get_session(GIS)
+    try:
+        async with s.post(url=url, headers=headers, data=xml) as response:
+            async for chunk in response.content.iter_chunked(chunk_size):
+                yield chunk
+    except aiohttp.ClientResponseError as e:
+        logger.error(f'HTTP error occurred {e.status}')
+        raise
@@ -15,3 +15,12 @@ class UploadFileError(GISError):
         super().__init__(f"Ошибка отправки файла: {self.filename}. Ответ портала: {self.service_response}")
 
 
+
+
+class UploadPartError(GISError):
+    """Ошибка отправки части файла на портал ГИС ЖКХ"""
+    def __init__(self, part: int, status: int):
+        self.part = part
+        self.status = status
+
+        super().__init__(f"Ошибка отправки части {self.part}. Код ответа: {self.status}")
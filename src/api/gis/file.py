@@ -5,15 +5,18 @@ from typing import Optional
 import aiohttp
 
 from src.config import project_config
-from src.api.gis.custom_exceptions import UploadFileError
-from src.api.gis.utils import calc_hash_by_md5, calc_hash_by_gost, generate_string, get_file_extension
+from src.api.session import GIS_FILE, get_session
+from src.api.gis.custom_exceptions import UploadFileError, UploadPartError
+from src.api.gis.payload import FilePayload
+from src.api.gis.registry import upload_registry, uploaded_files
+from src.api.gis.utils import generate_string, get_file_extension
 from src.log.log import logger
 
 
 @dataclass(frozen=True)
 class File:
     filename: str
-    file: bytes
+    file: bytes | FilePayload
 
 
 @dataclass(frozen=True)
@@ -24,41 +27,50 @@ class GISFileDataFormat:
     desc: str = ' '
 
 
-def _split_file(file: bytes, byte_count=5242880) -> list[bytes]:
-    """функция разбивки файла на части"""
-    return [file[x:x+byte_count] for x in range(0, len(file), byte_count)]
+# количество частей, отправляемых одновременно
+PARALLEL_PARTS = project_config.config.getint('upload', 'parallel_parts', fallback=4)
+# количество повторов отправки части и пауза перед первым повтором, сек
+PART_RETRIES = project_config.config.getint('upload', 'part_retries', fallback=3)
+PART_BACKOFF = project_config.config.getfloat('upload', 'part_backoff', fallback=1.0)
+
+
+def _get_payload(file_: File) -> FilePayload:
+    """Содержимое файла с посчитанными хэшами"""
+    if isinstance(file_.file, FilePayload):
+        return file_.file
+    return FilePayload.from_bytes(file_.file)
 
 
 async def _post_request(url: str, headers: dict) -> dict[str, str]:
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.post(url=url, headers=headers) as response:
-                await response.text()
-                return response.headers
-        except aiohttp.ClientResponseError as e:
-            logger.error(f'HTTP error occurred {e.status}')
-            raise
+    session = get_session(GIS_FILE)
+    try:
+        async with session.post(url=url, headers=headers) as response:
+            await response.text()
+            return response.headers
+    except aiohttp.ClientResponseError as e:
+        logger.error(f'HTTP error occurred {e.status}')
+        raise
 
 
 async def _put_request(url: str, headers: dict, data: bytes) -> dict[str, str]:
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.put(url=url, headers=headers, data=data) as response:
-                await response.text()
-                return response.headers
-        except aiohttp.ClientResponseError as e:
-            logger.error(f'HTTP error occurred {e.status}')
-            raise
+    session = get_session(GIS_FILE)
+    try:
+        async with session.put(url=url, headers=headers, data=data) as response:
+            await response.text()
+            return response.headers
+    except aiohttp.ClientResponseError as e:
+        logger.error(f'HTTP error occurred {e.status}')
+        raise
 
 
 async def _head_request(url: str, headers: dict) -> dict[str, str]:
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.head(url=url, headers=headers) as response:
-                return response.headers
-        except aiohttp.ClientResponseError as e:
-            logger.error(f'HTTP error occurred {e.status}')
-            raise
+    session = get_session(GIS_FILE)
+    try:
+        async with session.head(url=url, headers=headers) as response:
+            return response.headers
+    except aiohttp.ClientResponseError as e:
+        logger.error(f'HTTP error occurred {e.status}')
+        raise
 
 
 def _construct_url(base_url: str, upload_id: str = None, completed: bool = False) -> str:
@@ -73,74 +85,157 @@ def _construct_url(base_url: str, upload_id: str = None, completed: bool = False
     return base_url
 
 
-async def _single_mode_upload(url: str, file_: File) -> Optional[str]:
+async def _single_mode_upload(url: str, file_: File, payload: FilePayload) -> Optional[str]:
     """Режим отправки файла размером менее 5Mb"""
     headers = {
-    'Content-MD5': calc_hash_by_md5(file_.file),
+    'Content-MD5': payload.md5,
     'X-Upload-Filename': generate_string() + f'.{get_file_extension(file_.filename)}',
-    'X-Upload-Length': str(len(file_.file)),
+    'X-Upload-Length': str(payload.size),
     'X-Upload-OrgPPAGUID': project_config.config.get('guid', 'org')
     }
-    response = await _put_request(_construct_url(url), headers, file_.file)
+    view = payload.view()
+    try:
+        response = await _put_request(_construct_url(url), headers, view)
+    finally:
+        FilePayload.release([view])
     if upload_id := response.get('X-Upload-UploadID'):
         return upload_id
     else:
         raise UploadFileError(file_.filename, response)
 
 
-async def _multi_mode_upload(url: str, file_: File) -> Optional[str]:
+async def _put_part(url: str, headers: dict, data: memoryview, part: int) -> None:
+    """Отправка части файла с проверкой ответа и повтором при сетевых ошибках и ответах 429/5xx"""
+    session = get_session(GIS_FILE)
+    attempt = 0
+    while True:
+        try:
+            async with session.put(url=url, headers=headers, data=data) as response:
+                await response.read()
+                if 200 <= response.status < 300:
+                    return
+                raise UploadPartError(part, response.status)
+        except (aiohttp.ClientError, asyncio.TimeoutError, UploadPartError) as e:
+            retryable = not isinstance(e, UploadPartError) or e.status == 429 or e.status >= 500
+            if not retryable or attempt >= PART_RETRIES:
+                raise
+            delay = PART_BACKOFF * 2 ** attempt
+            logger.info(f'Повтор отправки части {part} через {delay:.1f} сек: {e!r}')
+            attempt += 1
+            await asyncio.sleep(delay)
+
+
+async def _upload_parts(url: str, upload_id: str, payload: FilePayload, file_chunks: list[memoryview],
+                        completed: set[int], key: str) -> None:
+    """Параллельная отправка непринятых частей, не более PARALLEL_PARTS одновременно"""
+    semaphore = asyncio.Semaphore(PARALLEL_PARTS)
+
+    async def _upload_part(part: int, chunk: memoryview) -> None:
+        headers = {
+            'Content-MD5': payload.part_md5[part - 1],
+            'X-Upload-OrgPPAGUID': project_config.config.get('guid', 'org'),
+            'X-Upload-Length': str(len(chunk)),
+            'X-Upload-Partnumber': str(part)
+        }
+        async with semaphore:
+            await _put_part(_construct_url(url, upload_id), headers, chunk, part)
+        await upload_registry.add_part(key, part)
+
+    try:
+        async with asyncio.TaskGroup() as tg:
+            for part, chunk in enumerate(file_chunks, start=1):
+                if part not in completed:
+                    tg.create_task(_upload_part(part, chunk))
+    except* Exception as eg:
+        raise eg.exceptions[0]
+
+
+async def _multi_mode_upload(url: str, file_: File, payload: FilePayload) -> Optional[str]:
     """Режим отправки файла размером более 5Mb"""
-    file_chunks = _split_file(file_.file)
-    _is_upload_chunks = None
-
-    #  Стадия 1. Инициализация.
-    headers = {
-        'Content-MD5': calc_hash_by_md5(file_.file),
-        'X-Upload-Filename': generate_string() + f'.{get_file_extension(file_.filename)}',
-        'X-Upload-Length': str(len(file_.file)),
-        'X-Upload-OrgPPAGUID': project_config.config.get('guid', 'org'),
-        'X-Upload-Part-count': str(len(file_chunks))
-    }
-
-    result = await _post_request(_construct_url(url), headers)
-    #  Стадия 2. Отправка.
-    if upload_id := result.get('X-Upload-UploadID'):
-        for part, chunk in enumerate(file_chunks):
-            _is_upload_chunks = False
+    file_chunks = payload.parts()
+    try:
+        return await _multi_mode_upload_parts(url, file_, payload, file_chunks)
+    finally:
+        # части освобождаются и при ошибке: иначе кадры трассировки удерживают отображение файла
+        FilePayload.release(file_chunks)
+
+
+async def _multi_mode_upload_parts(url: str, file_: File, payload: FilePayload,
+                                   file_chunks: list[memoryview]) -> Optional[str]:
+    key = upload_registry.key(url, payload.md5, payload.size, payload.part_size)
+    upload_id, completed = await upload_registry.get(key)
+    result = None
+
+    while True:
+        resumed = upload_id is not None
+        if resumed:
+            logger.info(f'Продолжение отправки {file_.filename}: принято {len(completed)} из {len(file_chunks)} частей')
+        else:
+            #  Стадия 1. Инициализация.
             headers = {
-                'Content-MD5': calc_hash_by_md5(chunk),
+                'Content-MD5': payload.md5,
+                'X-Upload-Filename': generate_string() + f'.{get_file_extension(file_.filename)}',
+                'X-Upload-Length': str(payload.size),
                 'X-Upload-OrgPPAGUID': project_config.config.get('guid', 'org'),
-                'X-Upload-Length': str(len(chunk)),
-                'X-Upload-Partnumber': str(part + 1)
+                'X-Upload-Part-count': str(len(file_chunks))
             }
-            result = await _put_request(_construct_url(url, upload_id), headers, chunk)
-            if result:
-                _is_upload_chunks = True
+            result = await _post_request(_construct_url(url), headers)
+            if not (upload_id := result.get('X-Upload-UploadID')):
+                break
+            await upload_registry.start(key, upload_id)
 
-        #  Стадия 3. Закрытие сессии.
-        if _is_upload_chunks:
-            headers = {
-                'X-Upload-OrgPPAGUID': project_config.config.get('guid', 'org')
-            }
-            await _post_request(_construct_url(url, upload_id, completed=True), headers)
+        #  Стадия 2. Отправка.
+        try:
+            await _upload_parts(url, upload_id, payload, file_chunks, completed, key)
+        except UploadPartError as e:
+            if resumed and e.status < 500 and e.status != 429:
+                # сессия отправки недействительна, начинаем заново
+                logger.info(f'Сессия отправки {upload_id} файла {file_.filename} недействительна ({e}), новая сессия')
+                await upload_registry.delete(key)
+                upload_id, completed = None, set()
+                continue
+            raise
 
-            #  Стадия 4. Подтверждение принятия файда
-            upload_result = await _head_request(_construct_url(url, upload_id), headers)
-            if upload_result.get('X-Upload-Completed'):
-                return upload_id
+        #  Стадия 3. Закрытие сессии.
+        headers = {
+            'X-Upload-OrgPPAGUID': project_config.config.get('guid', 'org')
+        }
+        await _post_request(_construct_url(url, upload_id, completed=True), headers)
+
+        #  Стадия 4. Подтверждение принятия файда
+        result = await _head_request(_construct_url(url, upload_id), headers)
+        await upload_registry.delete(key)
+        if result.get('X-Upload-Completed'):
+            return upload_id
+        break
 
     logger.error(f'Ошибка отправки файла {file_.filename}')
     raise UploadFileError(file_.filename, result)
 
 
-async def _upload_file(url: str, file_: File) -> str:
-    if len(file_.file) > 5242880:
-        return await _multi_mode_upload(url, file_)
-    return await _single_mode_upload(url, file_)
+async def _upload_file(url: str, file_: File, payload: FilePayload) -> str:
+    if payload.size > payload.part_size:
+        return await _multi_mode_upload(url, file_, payload)
+    return await _single_mode_upload(url, file_, payload)
+
+
+async def _upload_file_once(url: str, file_: File) -> dict[str, str]:
+    """
+    Отправка файла, если файл с тем же содержимым еще не отправлялся.
+    Содержимое файла (временный файл, отображение в память) освобождается после отправки
+    """
+    with _get_payload(file_) as payload:
+        await payload.ensure_hashes()
+
+        async def _upload() -> dict[str, str]:
+            return {'attachmentGUID': await _upload_file(url, file_, payload), 'attachmentHASH': payload.gost}
+
+        return await uploaded_files.get_or_upload(uploaded_files.key(url, payload.md5, payload.gost, payload.size),
+                                                  _upload)
 
 
 async def upload_files(url: str, files: list[File]) -> list[GISFileDataFormat]:
-    tasks = [_upload_file(url, file_) for file_ in files]
+    tasks = [_upload_file_once(url, file_) for file_ in files]
     tasks_result = await asyncio.gather(*tasks, return_exceptions=True)
 
     results = []
@@ -150,6 +245,6 @@ async def upload_files(url: str, files: list[File]) -> list[GISFileDataFormat]:
             raise ValueError(tasks_result[i])
 
         results.append(GISFileDataFormat(name=file.filename,
-                                         attachmentGUID=tasks_result[i],
-                                         attachmentHASH=calc_hash_by_gost(file.file)))
+                                         attachmentGUID=tasks_result[i]['attachmentGUID'],
+                                         attachmentHASH=tasks_result[i]['attachmentHASH']))
     return results
@@ -0,0 +1,200 @@
+import asyncio
+import base64
+import hashlib
+import mmap
+import string
+import tempfile
+from binascii import hexlify
+from contextlib import suppress
+from typing import Iterable, Optional
+
+from src.base.crypto import Gost94Hasher, calc_hash_by_gost94
+from src.config import project_config
+from src.log.log import logger
+
+# размер данных, до которого файл хранится в памяти
+SPOOL_SIZE = project_config.config.getint('files', 'spool_size', fallback=1048576)
+# размер части при многочастной отправке в хранилище ГИС ЖКХ
+PART_SIZE = 5242880
+# размер блока при хэшировании файла, уже загруженного в память
+HASH_BLOCK = 1048576
+
+# символы вне алфавита base64 отбрасываются, как при base64.b64decode(validate=False)
+_B64_ALPHABET = (string.ascii_letters + string.digits + '+/=').encode('ascii')
+_B64_DELETE = bytes(b for b in range(256) if b not in _B64_ALPHABET)
+
+
+class FilePayload:
+    """
+    Содержимое файла для отправки в файловое хранилище ГИС ЖКХ.
+    Данные записываются частями (write / write_base64): до spool_size они хранятся в памяти, далее во временном файле.
+    При записи за один проход по данным считаются MD5 файла, MD5 каждой части размера part_size
+    и хэш по ГОСТ Р 34.11-94 (данные передаются процессу openssl по мере записи).
+    Части для отправки выдаются как memoryview без копирования.
+    Временный файл и его отображение в память освобождаются в close, объект - контекстный менеджер
+    """
+    def __init__(self, spool_size: int = SPOOL_SIZE, part_size: int = PART_SIZE) -> None:
+        self.spool_size = spool_size
+        self.part_size = part_size
+        self.size = 0
+        self.md5: Optional[str] = None
+        self.part_md5: list[str] = []
+        self.gost: Optional[str] = None
+        self._buffer: bytes | bytearray = bytearray()
+        self._file = None
+        self._mmap: Optional[mmap.mmap] = None
+        self._b64_tail = b''
+        self._md5 = hashlib.md5()
+        self._part = None
+        self._part_fill = 0
+        self._gost: Optional[Gost94Hasher] = None
+        self._hashed = False
+        self._hashing: Optional[asyncio.Future] = None
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'FilePayload':
+        """
+        Файл, уже загруженный в память: данные не копируются, хэши считаются в ensure_hashes
+        """
+        payload = cls()
+        payload._buffer = data
+        payload.size = len(data)
+        return payload
+
+    def _update_hashes(self, data) -> None:
+        if self._gost is None:
+            self._gost = Gost94Hasher()
+        self._gost.update(data)
+        self._md5.update(data)
+
+        view = memoryview(data)
+        pos = 0
+        while pos < len(view):
+            if self._part is None:
+                self._part = hashlib.md5()
+                self._part_fill = 0
+            count = min(self.part_size - self._part_fill, len(view) - pos)
+            self._part.update(view[pos:pos + count])
+            self._part_fill += count
+            pos += count
+            if self._part_fill == self.part_size:
+                self.part_md5.append(base64.b64encode(self._part.digest()).decode('utf-8'))
+                self._part = None
+
+    def _finish_hashes(self) -> None:
+        if self._gost is None:
+            # пустой файл: данных для потокового хэширования не было
+            self.gost = hexlify(calc_hash_by_gost94(b'')).decode('utf-8')
+        else:
+            try:
+                self.gost = hexlify(self._gost.digest()).decode('utf-8')
+            finally:
+                self._gost.close()
+                self._gost = None
+        if self._part is not None:
+            self.part_md5.append(base64.b64encode(self._part.digest()).decode('utf-8'))
+            self._part = None
+        self.md5 = base64.b64encode(self._md5.digest()).decode('utf-8')
+        self._hashed = True
+
+    def _hash_stored(self) -> None:
+        """
+        Хэширование данных в памяти за один проход: блоки передаются в MD5 файла, MD5 частей
+        и потоковый ГОСТ одновременно, как при записи через write
+        """
+        view = self.view()
+        for pos in range(0, self.size, HASH_BLOCK):
+            self._update_hashes(view[pos:pos + HASH_BLOCK])
+        self._finish_hashes()
+
+    async def ensure_hashes(self) -> None:
+        """
+        Хэши файла, загруженного через from_bytes: считаются один раз в пуле потоков
+        """
+        if self._hashed:
+            return
+        if self._hashing is None:
+            self._hashing = asyncio.get_running_loop().run_in_executor(None, self._hash_stored)
+        await self._hashing
+
+    def write(self, data: bytes) -> None:
+        self._update_hashes(data)
+        self.size += len(data)
+
+        if self._file is None and len(self._buffer) + len(data) > self.spool_size:
+            self._file = tempfile.TemporaryFile(prefix='rinoca-payload-')
+            self._file.write(self._buffer)
+            self._buffer = bytearray()
+        if self._file is not None:
+            self._file.write(data)
+        else:
+            self._buffer += data
+
+    def write_base64(self, chunk: str | bytes) -> None:
+        """
+        Декодирование очередной части base64. Остаток, не кратный 4 символам, переносится в следующую часть
+        """
+        if isinstance(chunk, str):
+            chunk = chunk.encode('ascii', errors='ignore')
+        data = self._b64_tail + chunk.translate(None, _B64_DELETE)
+        usable = len(data) - len(data) % 4
+        self._b64_tail = data[usable:]
+        if usable:
+            self.write(base64.b64decode(data[:usable]))
+
+    def finish(self) -> 'FilePayload':
+        """
+        Завершение записи: декодируется остаток base64 и фиксируются хэши
+        """
+        if self._b64_tail:
+            tail, self._b64_tail = self._b64_tail, b''
+            self.write(base64.b64decode(tail))
+        self._finish_hashes()
+        if self._file is not None:
+            self._file.flush()
+        return self
+
+    def view(self, start: int = 0, end: Optional[int] = None) -> memoryview:
+        if self._file is None:
+            return memoryview(self._buffer)[start:end]
+        if self._mmap is None:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self._mmap)[start:end]
+
+    def parts(self) -> list[memoryview]:
+        return [self.view(x, x + self.part_size) for x in range(0, self.size, self.part_size)]
+
+    @staticmethod
+    def release(views: Iterable[memoryview]) -> None:
+        """
+        Освобождение выданных частей, чтобы close закрыл отображение файла сразу
+        """
+        for view in views:
+            with suppress(BufferError):
+                view.release()
+
+    def close(self) -> None:
+        if self._gost is not None:
+            # запись прервана до finish: процесс openssl больше не нужен
+            self._gost.close()
+            self._gost = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # части еще используются (например, в кадрах трассировки ошибки): отображение держит
+                # собственный дескриптор и закроется сборщиком вместе с последней частью
+                logger.info(f'Отображение файла ({self.size} байт) закроется после освобождения частей')
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self) -> 'FilePayload':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.size
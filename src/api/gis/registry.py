@@ -0,0 +1,122 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Optional
+
+from src.base.storage import SQLiteStore, resolve_path
+from src.config import project_config
+
+# файл SQLite для продолжения отправки и учета отправленных файлов между запусками, пустое значение - только в памяти
+FILE = project_config.config.get('upload', 'resume_file', fallback='log/uploads.sqlite')
+# сколько хранится незавершенная сессия отправки, сек
+TTL = project_config.config.getint('upload', 'resume_ttl', fallback=86400)
+# сколько отправленный файл считается доступным в хранилище ГИС ЖКХ, сек
+DEDUP_TTL = project_config.config.getint('upload', 'dedup_ttl', fallback=259200)
+
+
+class UploadRegistry:
+    """
+    Незавершенные сессии многочастной отправки: X-Upload-UploadID и номера принятых частей по ключу файла.
+    Позволяет продолжить отправку с места обрыва, а не начинать сессию заново
+    """
+    def __init__(self, store: Optional[SQLiteStore] = None) -> None:
+        self.store = store
+        self._sessions: dict[str, dict] = {}
+        self._lock: Optional[asyncio.Lock] = None
+
+    @staticmethod
+    def key(url: str, md5: str, size: int, part_size: int) -> str:
+        return f'{url}|{md5}|{size}|{part_size}'
+
+    async def _save(self, key: str) -> None:
+        if self.store is None:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if (session := self._sessions.get(key)) is not None:
+                await asyncio.to_thread(self.store.set, key, {**session, 'parts': sorted(session['parts'])})
+
+    async def get(self, key: str) -> tuple[Optional[str], set[int]]:
+        if (session := self._sessions.get(key)) is None and self.store is not None:
+            if (stored := await asyncio.to_thread(self.store.get, key)) is not None:
+                session = {'upload_id': stored['upload_id'], 'parts': set(stored['parts'])}
+                self._sessions[key] = session
+        if session is None:
+            return None, set()
+        return session['upload_id'], set(session['parts'])
+
+    async def start(self, key: str, upload_id: str) -> None:
+        self._sessions[key] = {'upload_id': upload_id, 'parts': set()}
+        await self._save(key)
+
+    async def add_part(self, key: str, part: int) -> None:
+        if (session := self._sessions.get(key)) is not None:
+            session['parts'].add(part)
+            await self._save(key)
+
+    async def delete(self, key: str) -> None:
+        self._sessions.pop(key, None)
+        if self.store is not None:
+            await asyncio.to_thread(self.store.delete, key)
+
+
+class UploadedFiles:
+    """
+    Уже отправленные файлы по содержимому (MD5 и ГОСТ Р 34.11-94): attachmentGUID и attachmentHASH
+    хранятся в течение срока хранения файлов в ГИС ЖКХ, и повторная отправка того же файла не выполняется.
+    Одновременные отправки одного файла объединяются
+    """
+    def __init__(self, ttl: float = DEDUP_TTL, store: Optional[SQLiteStore] = None) -> None:
+        self.ttl = ttl
+        self.store = store
+        self._items: dict[str, tuple[float, dict]] = {}
+        self._inflight: dict[str, asyncio.Task] = {}
+        self.hits = 0
+
+    @staticmethod
+    def key(url: str, md5: str, gost: str, size: int) -> str:
+        return f'{url}|{md5}|{gost}|{size}'
+
+    async def get(self, key: str) -> Optional[dict]:
+        if (item := self._items.get(key)) is not None:
+            if item[0] >= time.monotonic():
+                return item[1]
+            del self._items[key]
+        if self.store is not None and (value := await asyncio.to_thread(self.store.get, key)) is not None:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            return value
+        return None
+
+    async def put(self, key: str, value: dict) -> None:
+        self._items[key] = (time.monotonic() + self.ttl, value)
+        if self.store is not None:
+            await asyncio.to_thread(self.store.set, key, value)
+
+    async def get_or_upload(self, key: str, upload: Callable[[], Awaitable[dict]]) -> dict:
+        if (value := await self.get(key)) is not None:
+            self.hits += 1
+            return value
+        if (task := self._inflight.get(key)) is None:
+            task = asyncio.create_task(self._upload(key, upload))
+            self._inflight[key] = task
+        else:
+            self.hits += 1
+        return await asyncio.shield(task)
+
+    async def _upload(self, key: str, upload: Callable[[], Awaitable[dict]]) -> dict:
+        try:
+            value = await upload()
+            await self.put(key, value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+
+def _create_store(table: str, ttl: float) -> Optional[SQLiteStore]:
+    if (path := resolve_path(FILE)) is None:
+        return None
+    return SQLiteStore(path, table, ttl)
+
+
+upload_registry = UploadRegistry(_create_store('upload_sessions', TTL))
+uploaded_files = UploadedFiles(store=_create_store('uploaded_files', DEDUP_TTL))
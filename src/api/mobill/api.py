@@ -4,6 +4,9 @@ from typing import Any
 
 import aiohttp
 
+from src.api.mobill.custom_exceptions import MobillResponseError
+from src.api.mobill.limiter import mobill_limiter
+from src.api.session import MOBILL, get_session
 from src.log.log import logger
 from src.config import project_config
 
@@ -13,21 +16,23 @@ KEY = project_config.config.get('mobill', 'key')
 def connect(func):
     @wraps(func)
     async def wrapper(*args, **kwargs):
-        async with aiohttp.ClientSession() as session:
-            return await func(session, *args, **kwargs)
+        return await func(get_session(MOBILL), *args, **kwargs)
     return wrapper
 
 
+async def _fetch(session: aiohttp.ClientSession, url: str, data: dict[str, Any]) -> json:
+    async with session.post(url=url, data=data) as response:
+        if response.status == 200:
+            return json.loads(await response.text(encoding='utf-8'))
+        raise MobillResponseError(response.status)
+
+
 async def _request(session: aiohttp.ClientSession, url: str, data: dict[str, Any]) -> json:
     try:
-        async with session.post(url=url, data=data) as response:
-            if response.status == 200:
-                json_response = json.loads(await response.text(encoding='utf-8'))
-                # print(json_response)
-                return json_response
-            else:
-                logger.error(response.status)
-                return None
+        return await _fetch(session, url, data)
+    except MobillResponseError as e:
+        logger.error(e.status)
+        return None
     except Exception as e:
         logger.error(e)
         return None
@@ -39,7 +44,14 @@ async def get_court_debt(session: aiohttp.ClientSession, data: dict[str, Any], g
 
     if getfile:
         url += '&getfile=1'
-    return await _request(session, url, data)
+    try:
+        return await mobill_limiter.call(_fetch, session, url, data)
+    except MobillResponseError as e:
+        logger.error(e.status)
+        return None
+    except Exception as e:
+        logger.error(e)
+        return None
 
 
 @connect
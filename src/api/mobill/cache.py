@@ -0,0 +1,105 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from src.api.mobill.api import get_court_debt
+from src.base.storage import SQLiteStore, resolve_path
+from src.config import project_config
+
+TTL = project_config.config.getint('mobill_cache', 'ttl', fallback=3600)
+MAXSIZE = project_config.config.getint('mobill_cache', 'maxsize', fallback=1000)
+# файл SQLite для хранения между запусками, пустое значение - только в памяти
+FILE = project_config.config.get('mobill_cache', 'file', fallback='')
+
+
+def make_key(params: dict[str, Any], getfile: bool) -> str:
+    """
+    Ключ кэша: параметры запроса (houseguid/apartment либо address) без учета регистра и лишних пробелов и ключ getfile
+    """
+    normalized = sorted((name, ' '.join(str(value or '').lower().replace('ё', 'е').split()))
+                        for name, value in params.items())
+    return json.dumps([bool(getfile), normalized], ensure_ascii=False)
+
+
+class MobillCache:
+    """
+    Кэш ответов getcourtdebt с ограничением по сроку жизни (ttl) и количеству (LRU, maxsize).
+    Одновременные запросы с одним ключом объединяются в один запрос к Мобилл.
+    Пустые ответы (ошибка соединения) и ответы с файлами (getfile, base64 судебных приказов) не кэшируются:
+    файлы только объединяются между одновременными запросами, чтобы не держать их в памяти и в хранилище
+    """
+    def __init__(self, ttl: float = TTL, maxsize: int = MAXSIZE, store: Optional[SQLiteStore] = None) -> None:
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.store = store
+        self._items: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._inflight: dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def _get(self, key: str) -> Optional[dict]:
+        if (item := self._items.get(key)) is None:
+            return None
+        expires, value = item
+        if expires < time.monotonic():
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return value
+
+    def _put(self, key: str, value: dict) -> None:
+        self._items[key] = (time.monotonic() + self.ttl, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    async def _load(self, key: str, params: dict[str, Any], getfile: bool) -> Optional[dict]:
+        try:
+            if getfile:
+                return await get_court_debt(params, getfile)
+            if self.store is not None and (value := await asyncio.to_thread(self.store.get, key)) is not None:
+                self._put(key, value)
+                return value
+            value = await get_court_debt(params, getfile)
+            if value is not None:
+                self._put(key, value)
+                if self.store is not None:
+                    await asyncio.to_thread(self.store.set, key, value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    async def get_court_debt(self, params: dict[str, Any], getfile: bool = False) -> Optional[dict]:
+        key = make_key(params, getfile)
+        if not getfile and (value := self._get(key)) is not None:
+            self.hits += 1
+            return value
+        if (task := self._inflight.get(key)) is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.create_task(self._load(key, params, getfile))
+            self._inflight[key] = task
+        return await asyncio.shield(task)
+
+    def clear(self) -> None:
+        self._items.clear()
+
+    def stats(self) -> dict:
+        return {'size': len(self._items), 'hits': self.hits, 'misses': self.misses, 'coalesced': self.coalesced}
+
+
+def _create_store() -> Optional[SQLiteStore]:
+    if (path := resolve_path(FILE)) is None:
+        return None
+    return SQLiteStore(path, 'mobill_court_debt', TTL)
+
+
+mobill_cache = MobillCache(store=_create_store())
+
+
+async def get_court_debt_cached(params: dict[str, Any], getfile: bool = False) -> Optional[dict]:
+    return await mobill_cache.get_court_debt(params, getfile)
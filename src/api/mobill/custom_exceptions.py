@@ -0,0 +1,11 @@
+class MobillError(Exception):
+    """Базовое исключение для обращений к API Мобилл"""
+    ...
+
+
+class MobillResponseError(MobillError):
+    """Ответ API Мобилл с кодом, отличным от 200"""
+    def __init__(self, status: int):
+        self.status = status
+
+        super().__init__(f"Ответ API Мобилл: {self.status}")
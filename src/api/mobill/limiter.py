@@ -0,0 +1,97 @@
+import asyncio
+import random
+import time
+from typing import Any, Awaitable, Callable
+
+import aiohttp
+
+from src.api.mobill.custom_exceptions import MobillResponseError
+from src.base.delay import RateLimiter
+from src.config import project_config
+from src.log.log import logger
+
+
+def _is_retryable(e: Exception) -> bool:
+    """
+    Повторяются ошибки соединения, таймауты, 429 и 5xx. Прочие коды ответа и ошибки разбора ответа
+    (например, некорректный JSON) повтором не исправить
+    """
+    if isinstance(e, MobillResponseError):
+        return e.status == 429 or e.status >= 500
+    return isinstance(e, (aiohttp.ClientConnectionError, asyncio.TimeoutError, ConnectionError))
+
+
+class MobillLimiter:
+    """
+    Ограничение нагрузки на API Мобилл: не более concurrency одновременных запросов,
+    не более rate запросов в секунду (token bucket, burst подряд) и повтор с экспоненциальной паузой.
+    Метрики разделяют ожидание в очереди лимитера и время обслуживания запроса
+        concurrency - одновременных запросов
+        rate / burst - запросов в секунду / подряд (rate 0 - без ограничения)
+        retries - количество повторов
+        backoff - пауза перед первым повтором, сек (далее удваивается)
+    """
+    def __init__(self, concurrency: int = 10, rate: float = 0, burst: int = 10,
+                 retries: int = 3, backoff: float = 1.0) -> None:
+        self.concurrency = concurrency
+        self.rate_limiter = RateLimiter(rate, burst)
+        self.retries = retries
+        self.backoff = backoff
+        self._semaphore = None
+        self.calls = 0
+        self.retried = 0
+        self.failed = 0
+        self.queue_wait = 0.0
+        self.service_time = 0.0
+        self.max_queue_wait = 0.0
+        self.in_flight = 0
+
+    async def _call_once(self, func: Callable[..., Awaitable[Any]], *args) -> Any:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        queued = time.monotonic()
+        await self.rate_limiter.acquire()
+        async with self._semaphore:
+            started = time.monotonic()
+            self.queue_wait += started - queued
+            self.max_queue_wait = max(self.max_queue_wait, started - queued)
+            self.in_flight += 1
+            try:
+                return await func(*args)
+            finally:
+                self.in_flight -= 1
+                self.calls += 1
+                self.service_time += time.monotonic() - started
+
+    async def call(self, func: Callable[..., Awaitable[Any]], *args) -> Any:
+        attempt = 0
+        while True:
+            try:
+                return await self._call_once(func, *args)
+            except Exception as e:
+                if attempt >= self.retries or not _is_retryable(e):
+                    self.failed += 1
+                    raise
+                delay = self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+                logger.info(f'Повтор запроса к API Мобилл через {delay:.1f} сек: {e!r}')
+                attempt += 1
+                self.retried += 1
+                await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        calls = self.calls or 1
+        return {
+            'calls': self.calls,
+            'retried': self.retried,
+            'failed': self.failed,
+            'avg_queue_wait': round(self.queue_wait / calls, 3),
+            'max_queue_wait': round(self.max_queue_wait, 3),
+            'avg_service_time': round(self.service_time / calls, 3),
+        }
+
+
+mobill_limiter = MobillLimiter(concurrency=project_config.config.getint('mobill_limiter', 'concurrency', fallback=10),
+                               rate=project_config.config.getfloat('mobill_limiter', 'rate', fallback=0),
+                               burst=project_config.config.getint('mobill_limiter', 'burst', fallback=10),
+                               retries=project_config.config.getint('mobill_limiter', 'retries', fallback=3),
+                               backoff=project_config.config.getfloat('mobill_limiter', 'backoff', fallback=1.0))
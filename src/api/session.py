@@ -0,0 +1,63 @@
+import aiohttp
+
+from src.config import project_config
+
+GIS = 'gis'
+GIS_FILE = 'gis_file'
+MOBILL = 'mobill'
+
+# значения по умолчанию, переопределяются в секции [http] или [http_<имя сервиса>]
+DEFAULTS = {
+    'limit': 100,
+    'limit_per_host': 0,
+    'keepalive_timeout': 30,
+    'dns_ttl': 300,
+    'timeout': 300,
+    'connect_timeout': 30,
+}
+
+
+class SessionRegistry:
+    """
+    Общие aiohttp-сессии по внешним сервисам (ГИС ЖКХ SOAP, файловое хранилище ГИС ЖКХ, Мобилл).
+    Сессия создается при первом обращении и живет до close(), что дает keep-alive и кэш DNS
+    """
+    def __init__(self) -> None:
+        self._sessions: dict[str, aiohttp.ClientSession] = {}
+
+    @staticmethod
+    def _option(name: str, option: str) -> float:
+        fallback = project_config.config.getfloat('http', option, fallback=DEFAULTS[option])
+        return project_config.config.getfloat(f'http_{name}', option, fallback=fallback)
+
+    def _create(self, name: str) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(limit=int(self._option(name, 'limit')),
+                                         limit_per_host=int(self._option(name, 'limit_per_host')),
+                                         keepalive_timeout=self._option(name, 'keepalive_timeout'),
+                                         ttl_dns_cache=int(self._option(name, 'dns_ttl')))
+        timeout = aiohttp.ClientTimeout(total=self._option(name, 'timeout'),
+                                        connect=self._option(name, 'connect_timeout'))
+        return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    def get(self, name: str) -> aiohttp.ClientSession:
+        session = self._sessions.get(name)
+        if session is None or session.closed:
+            session = self._create(name)
+            self._sessions[name] = session
+        return session
+
+    async def close(self) -> None:
+        sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            await session.close()
+
+
+sessions = SessionRegistry()
+
+
+def get_session(name: str) -> aiohttp.ClientSession:
+    return sessions.get(name)
+
+
+async def close_sessions() -> None:
+    await sessions.close()
@@ -1,3 +1,5 @@
+import copy
+from functools import lru_cache
 from pathlib import Path
 
 import lxml.etree as ET
@@ -8,31 +10,52 @@ from src.config import project_config
 ORG_GUID = project_config.config.get('guid', 'org')
 
 
+@lru_cache(maxsize=512)
+def compile_xpath(el_path: str, namespaces: tuple[tuple[str, str], ...]) -> ET.XPath:
+    """
+    Скомпилированное выражение XPath, общее для всех документов с той же картой пространств имен
+    """
+    return ET.XPath(el_path, namespaces=dict(namespaces))
+
+
 class ParseXMLMixin:
     tree = None
+    # известная заранее карта пространств имен: если задана, дерево не обходится в поисках объявлений
+    NAMESPACES = None
+    _nsmap = None
+    _ns_key = None
 
     def get_namespaces(self):
         """
-        Формируем словарь пространств имен xml
+        Формируем словарь пространств имен xml. Вычисляется один раз на документ
         """
-        nsmap = dict(ds='http://www.w3.org/2000/09/xmldsig#')
-        for ns in self.tree.xpath('//namespace::*'):
-            if ns[0]:
-                nsmap[ns[0]] = ns[1]
-        return nsmap
-
-    def get_elements(self, el_path):
+        if self._nsmap is None:
+            nsmap = dict(ds='http://www.w3.org/2000/09/xmldsig#')
+            if self.NAMESPACES is not None:
+                nsmap.update(self.NAMESPACES)
+            else:
+                for ns in self.tree.xpath('//namespace::*'):
+                    if ns[0]:
+                        nsmap[ns[0]] = ns[1]
+            self.set_namespaces(nsmap)
+        return self._nsmap
+
+    def set_namespaces(self, nsmap: dict[str, str]) -> None:
+        self._nsmap = nsmap
+        self._ns_key = tuple(sorted(nsmap.items()))
+
+    def get_elements(self, el_path, **variables):
         """
-        Поиск всех элементов
+        Поиск всех элементов. Значения переменных XPath ($name) передаются именованными аргументами
         """
-        elements = self.tree.xpath(el_path, namespaces=self.get_namespaces())
-        return elements
+        self.get_namespaces()
+        return compile_xpath(el_path, self._ns_key)(self.tree, **variables)
 
-    def get_element(self, el_path):
+    def get_element(self, el_path, **variables):
         """
         Поиск элемента
         """
-        if elements := self.get_elements(el_path):
+        if elements := self.get_elements(el_path, **variables):
             return elements[0]
         return None
 
@@ -57,21 +80,126 @@ class OperationMixin:
         self.node.set(r'{http://dom.gosuslugi.ru/schema/integration/base/}version', version)
 
 
+class ElementLayout:
+    """
+    Разметка элемента шаблона: тег, атрибуты, текст и отступы с дочерними элементами.
+    Повторяющиеся блоки строятся по ней через SubElement без deepcopy узла шаблона и поиска по копии.
+    Значения подставляются по локальному имени элемента, остальные элементы получают текст шаблона
+    """
+    __slots__ = ('tag', 'attrib', 'text', 'tail', 'name', 'children')
+
+    def __init__(self, element, exclude: tuple = ()) -> None:
+        self.tag = element.tag
+        self.attrib = dict(element.attrib) or None
+        self.text = element.text
+        self.tail = element.tail
+        self.name = ET.QName(element).localname
+        self.children = [ElementLayout(child, exclude) for child in element
+                         if not any(child is elem for elem in exclude)]
+
+    def build(self, parent, values: dict, omit: tuple = (), refs: dict | None = None):
+        """
+        Добавляем элемент в parent
+            values - текст элементов по локальному имени
+            omit - локальные имена элементов, которые не добавляются
+            refs - куда сложить созданные элементы по локальному имени (для вложенных блоков)
+        """
+        if self.attrib:
+            elem = ET.SubElement(parent, self.tag, self.attrib)
+        else:
+            elem = ET.SubElement(parent, self.tag)
+        elem.text = values.get(self.name, self.text)
+        elem.tail = self.tail
+        if refs is not None:
+            refs[self.name] = elem
+        for child in self.children:
+            if child.name not in omit:
+                child.build(elem, values, omit, refs)
+        return elem
+
+
+class XMLTemplate(ParseXMLMixin):
+    """
+    Разобранный шаблон XML: эталонное дерево, карта пространств имен и пути к опорным узлам.
+    Экземпляры документов получают копию эталонного дерева вместо повторного чтения файла
+    """
+    def __init__(self, template: Path, nodes: dict[str, str]) -> None:
+        self.tree = ET.parse(template)
+        self.nsmap = dict(self.get_namespaces())
+        self.paths = {}
+        for name, el_path in nodes.items():
+            if elements := self.tree.xpath(el_path, namespaces=self.nsmap):
+                self.paths[name] = self.tree.getelementpath(elements[0])
+        self._layouts: dict[tuple[str, ...], ElementLayout] = {}
+
+    def _find(self, name: str):
+        root = self.tree.getroot()
+        return root if self.paths[name] == '.' else root.find(self.paths[name])
+
+    def layout(self, name: str, *exclude: str) -> ElementLayout:
+        """
+        Разметка опорного узла name без вложенных опорных узлов exclude. Вычисляется один раз на шаблон
+        """
+        key = (name, *exclude)
+        if (layout := self._layouts.get(key)) is None:
+            layout = ElementLayout(self._find(name), tuple(self._find(other) for other in exclude))
+            self._layouts[key] = layout
+        return layout
+
+    def copy(self):
+        """
+        Копия эталонного дерева и найденные в ней опорные узлы
+        """
+        tree = copy.deepcopy(self.tree)
+        root = tree.getroot()
+        nodes = {name: root if path == '.' else root.find(path) for name, path in self.paths.items()}
+        return tree, nodes
+
+
+_templates: dict[tuple[Path, tuple[tuple[str, str], ...]], XMLTemplate] = {}
+
+
+def get_template(template: Path, nodes: dict[str, str]) -> XMLTemplate:
+    key = (template, tuple(sorted(nodes.items())))
+    if (tmpl := _templates.get(key)) is None:
+        tmpl = XMLTemplate(template, nodes)
+        _templates[key] = tmpl
+    return tmpl
+
+
 class BaseXML(ParseXMLMixin):
+    # опорные узлы шаблона, которые находятся один раз на шаблон: имя -> xpath
+    NODES = {
+        'date': './/base:Date',
+        'message_guid': './/base:MessageGUID',
+        'org': './/base:orgPPAGUID',
+    }
+    nodes = {}
+
     def __init__(self, template: Path) -> None:
-        self.tree = ET.parse(template)
+        tmpl = get_template(template, self.NODES)
+        self.tree, self.nodes = tmpl.copy()
+        self.set_namespaces(tmpl.nsmap)
         self._build_header()
 
+    def get_node(self, name: str):
+        """
+        Опорный узел шаблона, либо поиск по его xpath из NODES
+        """
+        if (elem := self.nodes.get(name)) is not None:
+            return elem
+        return self.get_element(self.NODES[name])
+
     def _build_header(self):
         """
         Заполняем RequestHeader xml-запроса
         """
         header = {
-            './/base:Date': get_isotime(),
-            './/base:MessageGUID': gen_guid(),
-            './/base:orgPPAGUID': ORG_GUID
+            'date': get_isotime(),
+            'message_guid': gen_guid(),
+            'org': ORG_GUID
         }
 
-        for path, value in header.items():
-            if (elem := self.get_element(path)) is not None:
+        for name, value in header.items():
+            if (elem := self.get_node(name)) is not None:
                 elem.text = value
@@ -1,11 +1,28 @@
+import atexit
 import base64
+import ctypes
+import ctypes.util
+import os
 import subprocess
+import tempfile
+import threading
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Optional
 
 from src.config import project_config
 from src.log.log import logger
 
 OPENSSL = project_config.config.get('crypto', 'openssl')
+# libcrypto - операции в процессе агента через библиотеку openssl: движок gost и ключи загружаются один раз
+# (OpenSSL 1.1 и 3), subprocess - новый процесс openssl на каждую операцию, shell - долгоживущий процесс openssl
+# на поток (только для сборок openssl с интерактивным режимом, в OpenSSL 3 его нет).
+# При ошибке libcrypto и shell агент переходит на subprocess
+BACKEND = project_config.config.get('crypto', 'backend', fallback='libcrypto')
+# путь к библиотеке libcrypto той же сборки, что и openssl (по умолчанию ищется рядом с openssl и в системе)
+LIBCRYPTO = project_config.config.get('crypto', 'libcrypto', fallback=None)
+# предельное время ответа долгоживущего процесса openssl, сек
+SHELL_TIMEOUT = project_config.config.getfloat('crypto', 'shell_timeout', fallback=60)
 
 
 def _run(cmd, input=None):
@@ -20,6 +37,392 @@ def _run(cmd, input=None):
     return procs.communicate(input=input)
 
 
+class OpenSSLShellError(Exception):
+    """Ошибка долгоживущего процесса openssl"""
+    ...
+
+
+class SubprocessBackend:
+    """
+    Запуск отдельного процесса openssl на каждую операцию
+    """
+    def run(self, args: list[str], data: bytes) -> bytes:
+        out, _ = _run([OPENSSL, *args], input=data)
+        return out
+
+    def close(self) -> None:
+        ...
+
+
+def _find_libcrypto() -> Optional[str]:
+    """
+    Библиотека libcrypto сборки openssl из настроек: рядом с исполняемым файлом (Windows), в ../lib, затем системная
+    """
+    binary = Path(OPENSSL)
+    for pattern in ('libcrypto*.dll', '../lib/libcrypto.so*', '../lib64/libcrypto.so*', '../lib/libcrypto*.dylib'):
+        if found := sorted(binary.parent.glob(pattern)):
+            return str(found[-1])
+    return ctypes.util.find_library('crypto')
+
+
+def _declare_libcrypto(lib: ctypes.CDLL) -> None:
+    p, i, s = ctypes.c_void_p, ctypes.c_int, ctypes.c_char_p
+    functions = {
+        'ENGINE_by_id': (p, [s]),
+        'ENGINE_init': (i, [p]),
+        'ENGINE_set_default': (i, [p, ctypes.c_uint]),
+        'ENGINE_finish': (i, [p]),
+        'ENGINE_free': (i, [p]),
+        'ENGINE_get_digest': (p, [p, i]),
+        'OBJ_sn2nid': (i, [s]),
+        'EVP_get_digestbyname': (p, [s]),
+        'EVP_MD_CTX_new': (p, []),
+        'EVP_MD_CTX_free': (None, [p]),
+        'EVP_DigestInit_ex': (i, [p, p, p]),
+        'EVP_DigestUpdate': (i, [p, s, ctypes.c_size_t]),
+        'EVP_DigestFinal_ex': (i, [p, s, ctypes.POINTER(ctypes.c_uint)]),
+        'EVP_DigestSignInit': (i, [p, p, p, p, p]),
+        'EVP_DigestSignFinal': (i, [p, s, ctypes.POINTER(ctypes.c_size_t)]),
+        'BIO_new_file': (p, [s, s]),
+        'BIO_free': (i, [p]),
+        'PEM_read_bio_PrivateKey': (p, [p, p, p, p]),
+        'EVP_PKEY_free': (None, [p]),
+        'ERR_get_error': (ctypes.c_ulong, []),
+        'ERR_error_string_n': (None, [ctypes.c_ulong, s, ctypes.c_size_t]),
+    }
+    for name, (restype, argtypes) in functions.items():
+        func = getattr(lib, name)
+        func.restype = restype
+        func.argtypes = argtypes
+
+
+class LibcryptoBackend:
+    """
+    Выполнение команд openssl dgst (хэш и подпись -sign) в процессе агента через libcrypto: движки и закрытые ключи
+    загружаются при первом обращении и живут до close, процесс на операцию не запускается.
+    Экземпляр общий для всех потоков: контекст создается на каждую операцию, ctypes отпускает GIL на время вызова
+    """
+    ENGINE_METHOD_ALL = 0xFFFF
+
+    def __init__(self, library: Optional[str] = LIBCRYPTO) -> None:
+        self._library = library
+        self._lib: Optional[ctypes.CDLL] = None
+        self._engines: dict[str, int] = {}
+        self._keys: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _load(self) -> ctypes.CDLL:
+        with self._lock:
+            if self._lib is None:
+                if (path := self._library or _find_libcrypto()) is None:
+                    raise OpenSSLShellError('Библиотека libcrypto не найдена')
+                lib = ctypes.CDLL(path)
+                try:
+                    _declare_libcrypto(lib)
+                except AttributeError as e:
+                    raise OpenSSLShellError(f'Библиотека {path} не поддерживает движки: {e}')
+                self._lib = lib
+            return self._lib
+
+    def _error(self, message: str) -> OpenSSLShellError:
+        lib = self._lib
+        errors = []
+        while code := lib.ERR_get_error():
+            buf = ctypes.create_string_buffer(256)
+            lib.ERR_error_string_n(code, buf, len(buf))
+            errors.append(buf.value.decode('utf-8', errors='replace'))
+        return OpenSSLShellError(f'{message}: {"; ".join(errors) or "нет описания"}')
+
+    def _engine(self, engine_id: Optional[str]) -> Optional[int]:
+        if engine_id is None:
+            return None
+        with self._lock:
+            if (engine := self._engines.get(engine_id)) is None:
+                lib = self._lib
+                if not (engine := lib.ENGINE_by_id(engine_id.encode())):
+                    raise self._error(f'Движок {engine_id} не загружен')
+                if not lib.ENGINE_init(engine):
+                    lib.ENGINE_free(engine)
+                    raise self._error(f'Движок {engine_id} не инициализирован')
+                # алгоритмы и типы ключей движка используются по умолчанию, как в openssl -engine
+                lib.ENGINE_set_default(engine, self.ENGINE_METHOD_ALL)
+                self._engines[engine_id] = engine
+            return engine
+
+    def _digest(self, name: str, engine: Optional[int]) -> int:
+        lib = self._lib
+        if md := lib.EVP_get_digestbyname(name.encode()):
+            return md
+        if engine and (md := lib.ENGINE_get_digest(engine, lib.OBJ_sn2nid(name.encode()))):
+            return md
+        raise self._error(f'Алгоритм хэширования {name} не найден')
+
+    def _key(self, path: str) -> int:
+        with self._lock:
+            if (key := self._keys.get(path)) is None:
+                lib = self._lib
+                if not (bio := lib.BIO_new_file(str(path).encode(), b'r')):
+                    raise self._error(f'Файл ключа {path} не открыт')
+                try:
+                    key = lib.PEM_read_bio_PrivateKey(bio, None, None, None)
+                finally:
+                    lib.BIO_free(bio)
+                if not key:
+                    raise self._error(f'Закрытый ключ {path} не загружен')
+                self._keys[path] = key
+            return key
+
+    @staticmethod
+    def _parse(args: list[str]) -> tuple[Optional[str], str, Optional[str]]:
+        """
+        Аргументы openssl dgst -> (движок, алгоритм, файл ключа подписи)
+        """
+        if not args or args[0] != 'dgst':
+            raise OpenSSLShellError(f'Команда openssl {args[:1]} не поддерживается libcrypto')
+        engine = digest = key = None
+        items = iter(args[1:])
+        for arg in items:
+            match str(arg):
+                case '-engine':
+                    engine = str(next(items))
+                case '-sign':
+                    key = str(next(items))
+                case '-binary':
+                    pass
+                case option if option.startswith('-'):
+                    digest = option[1:]
+                case option:
+                    raise OpenSSLShellError(f'Аргумент openssl dgst {option} не поддерживается libcrypto')
+        if digest is None:
+            raise OpenSSLShellError('Не указан алгоритм хэширования')
+        return engine, digest, key
+
+    def hasher(self, args: list[str]) -> 'LibcryptoHasher':
+        self._load()
+        engine_id, digest, _ = self._parse(args)
+        engine = self._engine(engine_id)
+        return LibcryptoHasher(self, self._digest(digest, engine), engine)
+
+    def run(self, args: list[str], data: bytes) -> bytes:
+        lib = self._load()
+        engine_id, digest, key_path = self._parse(args)
+        engine = self._engine(engine_id)
+        md = self._digest(digest, engine)
+        if key_path is None:
+            hasher = LibcryptoHasher(self, md, engine)
+            try:
+                hasher.update(data)
+                return hasher.digest()
+            finally:
+                hasher.close()
+
+        key = self._key(key_path)
+        ctx = lib.EVP_MD_CTX_new()
+        try:
+            data = bytes(data)
+            size = ctypes.c_size_t(0)
+            if (not lib.EVP_DigestSignInit(ctx, None, md, engine, key)
+                    or not lib.EVP_DigestUpdate(ctx, data, len(data))
+                    or not lib.EVP_DigestSignFinal(ctx, None, ctypes.byref(size))):
+                raise self._error('Ошибка подписи')
+            signature = ctypes.create_string_buffer(size.value)
+            if not lib.EVP_DigestSignFinal(ctx, signature, ctypes.byref(size)):
+                raise self._error('Ошибка подписи')
+            return signature.raw[:size.value]
+        finally:
+            lib.EVP_MD_CTX_free(ctx)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._lib is None:
+                return
+            for key in self._keys.values():
+                self._lib.EVP_PKEY_free(key)
+            self._keys.clear()
+            for engine in self._engines.values():
+                self._lib.ENGINE_finish(engine)
+                self._lib.ENGINE_free(engine)
+            self._engines.clear()
+
+
+class LibcryptoHasher:
+    """
+    Потоковое хэширование в процессе агента: контекст EVP_MD_CTX на один файл
+    """
+    def __init__(self, backend: LibcryptoBackend, md: int, engine: Optional[int]) -> None:
+        self._backend = backend
+        self._lib = backend._lib
+        self._ctx = self._lib.EVP_MD_CTX_new()
+        if not self._lib.EVP_DigestInit_ex(self._ctx, md, engine):
+            self.close()
+            raise backend._error('Ошибка инициализации хэширования')
+
+    def update(self, data) -> None:
+        data = bytes(data)
+        if not self._lib.EVP_DigestUpdate(self._ctx, data, len(data)):
+            raise self._backend._error('Ошибка хэширования')
+
+    def digest(self) -> bytes:
+        out = ctypes.create_string_buffer(64)
+        size = ctypes.c_uint(0)
+        if not self._lib.EVP_DigestFinal_ex(self._ctx, out, ctypes.byref(size)):
+            raise self._backend._error('Ошибка хэширования')
+        return out.raw[:size.value]
+
+    def close(self) -> None:
+        if self._ctx:
+            self._lib.EVP_MD_CTX_free(self._ctx)
+            self._ctx = None
+
+
+class OpenSSLShellBackend:
+    """
+    Интерактивный процесс openssl, который живет все время работы агента: движок gost загружается один раз,
+    команды передаются через stdin, входные и выходные данные - через временные файлы.
+    Экземпляр не потокобезопасен, поэтому создается на каждый поток
+    """
+    PROMPT = b'OpenSSL> '
+
+    def __init__(self, openssl: str, timeout: float = SHELL_TIMEOUT) -> None:
+        self._openssl = openssl
+        self._timeout = timeout
+        self._proc: Optional[subprocess.Popen] = None
+        self._dir: Optional[tempfile.TemporaryDirectory] = None
+
+    def _start(self) -> None:
+        self.close()
+        self._dir = tempfile.TemporaryDirectory(prefix='rinoca-openssl-')
+        self._proc = subprocess.Popen([self._openssl],
+                                      stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE,
+                                      stderr=subprocess.DEVNULL,
+                                      creationflags=subprocess.CREATE_NO_WINDOW)
+        self._read_prompt()
+
+    def _read_prompt(self) -> None:
+        """
+        Чтение до приглашения. Зависший процесс завершается по истечении timeout, чтение прерывается
+        """
+        proc = self._proc
+        watchdog = threading.Timer(self._timeout, proc.kill)
+        watchdog.daemon = True
+        watchdog.start()
+        try:
+            buf = b''
+            while not buf.endswith(self.PROMPT):
+                chunk = os.read(proc.stdout.fileno(), 4096)
+                if not chunk:
+                    if not watchdog.is_alive():
+                        raise OpenSSLShellError(f'Процесс openssl не ответил за {self._timeout} сек')
+                    raise OpenSSLShellError('Интерактивный режим openssl недоступен или процесс завершился')
+                buf += chunk
+        finally:
+            watchdog.cancel()
+
+    @staticmethod
+    def _quote(arg: str) -> str:
+        return f'"{arg}"' if ' ' in arg else arg
+
+    def run(self, args: list[str], data: bytes) -> bytes:
+        if self._proc is None or self._proc.poll() is not None:
+            self._start()
+
+        src = Path(self._dir.name) / 'in.bin'
+        dst = Path(self._dir.name) / 'out.bin'
+        src.write_bytes(data)
+        dst.unlink(missing_ok=True)
+
+        cmd = ' '.join(self._quote(str(arg)) for arg in [*args, '-out', dst, src])
+        self._proc.stdin.write(cmd.encode('utf-8') + b'\n')
+        self._proc.stdin.flush()
+        self._read_prompt()
+
+        if not dst.exists() or dst.stat().st_size == 0:
+            raise OpenSSLShellError(f'Команда openssl {args[0]} завершилась без результата')
+        return dst.read_bytes()
+
+    def close(self) -> None:
+        if self._proc is not None:
+            try:
+                self._proc.stdin.close()
+                self._proc.wait(timeout=5)
+            except Exception:
+                self._proc.kill()
+            self._proc = None
+        if self._dir is not None:
+            self._dir.cleanup()
+            self._dir = None
+
+
+_subprocess_backend = SubprocessBackend()
+_libcrypto_backend = LibcryptoBackend()
+_local = threading.local()
+_shell_backends: list[OpenSSLShellBackend] = []
+_shell_lock = threading.Lock()
+# долгоживущий механизм (libcrypto, shell) выключен настройкой или после ошибки
+_shell_disabled = BACKEND not in ('libcrypto', 'shell')
+
+
+def _get_backend() -> SubprocessBackend | LibcryptoBackend | OpenSSLShellBackend:
+    if _shell_disabled:
+        return _subprocess_backend
+    if BACKEND == 'libcrypto':
+        return _libcrypto_backend
+    if (backend := getattr(_local, 'backend', None)) is None:
+        backend = OpenSSLShellBackend(OPENSSL)
+        _local.backend = backend
+    with _shell_lock:
+        if backend not in _shell_backends:
+            _shell_backends.append(backend)
+    return backend
+
+
+def _openssl(args: list[str], data: bytes) -> bytes:
+    """
+    Выполнение команды openssl через текущий механизм с откатом на запуск отдельного процесса
+    """
+    backend = _get_backend()
+    if backend is not _subprocess_backend:
+        try:
+            return backend.run(args, data)
+        except Exception as e:
+            _disable_backend(backend, e)
+    return _subprocess_backend.run(args, data)
+
+
+def _disable_backend(backend: LibcryptoBackend | OpenSSLShellBackend, error: Exception) -> None:
+    global _shell_disabled
+    logger.info(f'Долгоживущий механизм openssl ({BACKEND}) недоступен ({error}), '
+                f'используется запуск процесса на операцию')
+    # процессы других потоков завершают начатые операции и закрываются в close_crypto_backends
+    _shell_disabled = True
+    if isinstance(backend, OpenSSLShellBackend):
+        _close_local_backend(backend)
+
+
+def _close_local_backend(backend: OpenSSLShellBackend) -> None:
+    _local.backend = None
+    with _shell_lock:
+        if backend in _shell_backends:
+            _shell_backends.remove(backend)
+    backend.close()
+
+
+def close_crypto_backends() -> None:
+    """
+    Завершение долгоживущих процессов openssl и освобождение ключей и движков libcrypto
+    """
+    with _shell_lock:
+        backends = list(_shell_backends)
+        _shell_backends.clear()
+    for backend in backends:
+        backend.close()
+    _libcrypto_backend.close()
+
+
+atexit.register(close_crypto_backends)
+
+
 def get_issuer(cert: Path):
     """
     Информация об издателе сертификата
@@ -69,6 +472,41 @@ def load_cert(cert: Path):
     return data[cert_start + len(head):cert_end]
 
 
+@dataclass(frozen=True)
+class CertInfo:
+    """
+    Данные сертификата, необходимые для XADES подписи
+    """
+    issuer: str
+    serial: str
+    cert: str
+    digest: str
+
+
+_cert_cache: dict[str, tuple[int, CertInfo]] = {}
+_cert_lock = threading.Lock()
+
+
+def get_cert_info(cert: Path) -> CertInfo:
+    """
+    Данные сертификата. Вычисляются один раз и пересчитываются только при изменении файла сертификата
+    """
+    path = str(Path(cert).resolve())
+    mtime = os.stat(path).st_mtime_ns
+    with _cert_lock:
+        if (cached := _cert_cache.get(path)) is not None and cached[0] == mtime:
+            return cached[1]
+
+    x509_cert = load_cert(cert)
+    info = CertInfo(issuer=get_issuer(cert),
+                    serial=get_serial(cert),
+                    cert=x509_cert,
+                    digest=get_digest(base64.b64decode(x509_cert)))
+    with _cert_lock:
+        _cert_cache[path] = (mtime, info)
+    return info
+
+
 def get_base64(val):
     """
     Преобразуем в BASE64 и возвращаем в utf-8
@@ -81,24 +519,65 @@ def get_digest(text):
     """
     Хэшируем. Вывод в BASE64
     """
-    cmd = [OPENSSL, 'dgst', '-engine', 'gost', '-md_gost12_256', '-binary']
-    out, _ = _run(cmd, input=text)
-    return get_base64(out)
+    cmd = ['dgst', '-engine', 'gost', '-md_gost12_256', '-binary']
+    return get_base64(_openssl(cmd, text))
 
 
 def calc_hash_by_gost94(text):
     """
     Хэшируем
     """
-    cmd = [OPENSSL, 'dgst', '-engine', 'gost', '-md_gost94', '-binary']
-    out, _ = _run(cmd, input=text)
-    return out
+    cmd = ['dgst', '-engine', 'gost', '-md_gost94', '-binary']
+    return _openssl(cmd, text)
+
+
+class Gost94Hasher:
+    """
+    Потоковое хэширование по ГОСТ Р 34.11-94, хэш возвращается после digest(). Данные передаются в контекст
+    libcrypto, а если он недоступен - по частям в stdin отдельного процесса openssl
+    """
+    ARGS = ['dgst', '-engine', 'gost', '-md_gost94', '-binary']
+
+    def __init__(self) -> None:
+        self._hasher: Optional[LibcryptoHasher] = None
+        self._proc: Optional[subprocess.Popen] = None
+        if isinstance(backend := _get_backend(), LibcryptoBackend):
+            try:
+                self._hasher = backend.hasher(self.ARGS)
+                return
+            except Exception as e:
+                _disable_backend(backend, e)
+        self._proc = subprocess.Popen([OPENSSL, *self.ARGS],
+                                      stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE,
+                                      stderr=subprocess.DEVNULL,
+                                      creationflags=subprocess.CREATE_NO_WINDOW)
+
+    def update(self, data) -> None:
+        if self._hasher is not None:
+            self._hasher.update(data)
+        else:
+            self._proc.stdin.write(data)
+
+    def digest(self) -> bytes:
+        if self._hasher is not None:
+            return self._hasher.digest()
+        out, _ = self._proc.communicate()
+        if not out:
+            raise OpenSSLShellError('Команда openssl dgst завершилась без результата')
+        return out
+
+    def close(self) -> None:
+        if self._hasher is not None:
+            self._hasher.close()
+        elif self._proc.poll() is None:
+            self._proc.kill()
+            self._proc.communicate()
 
 
 def sign(text, private_key):
     """
     Подписываем. Вывод в BASE64
     """
-    cmd = [OPENSSL, 'dgst', '-engine', 'gost', '-md_gost12_256', '-binary', '-sign', private_key]
-    out, _ = _run(cmd, input=text)
-    return get_base64(out)
+    cmd = ['dgst', '-engine', 'gost', '-md_gost12_256', '-binary', '-sign', private_key]
+    return get_base64(_openssl(cmd, text))
@@ -1,18 +1,189 @@
+import asyncio
+import json
+import random
+import statistics
+import time
+from collections import deque
+from pathlib import Path
+from typing import Optional
+
+from src.base.storage import resolve_path
+from src.config import project_config
 from src.log.log import logger
 
+EXPORT = 'export'
+IMPORT = 'import'
+REVOKE = 'revoke'
+
+# предельное время ожидания операции по умолчанию, сек
+MAX_WAIT = {EXPORT: 3600, IMPORT: 300, REVOKE: 3600}
+
+
+def _option(operation: str, option: str, fallback: float) -> float:
+    fallback = project_config.config.getfloat('polling', option, fallback=fallback)
+    return project_config.config.getfloat(f'polling_{operation}', option, fallback=fallback)
+
+
+class RateLimiter:
+    """
+    Ограничение частоты запросов (token bucket): не более rate запросов в секунду в среднем
+    и не более burst подряд
+    """
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+        self.calls = 0
+        self.waited = 0.0
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            self.calls += 1
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    self.calls += 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+                self.waited += delay
+                await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        return {'rate': self.rate, 'burst': self.burst, 'calls': self.calls, 'waited': round(self.waited, 1)}
+
+
+class Poll:
+    """
+    Ожидание готовности одной асинхронной операции ГИС ЖКХ.
+    wait() выдерживает очередную паузу, done() сообщает планировщику время выполнения операции
+    """
+    def __init__(self, scheduler: 'PollScheduler', operation: str) -> None:
+        self.scheduler = scheduler
+        self.operation = operation
+        self.started = time.monotonic()
+        self.attempt = 0
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    @property
+    def expired(self) -> bool:
+        return self.elapsed >= self.scheduler.max_wait(self.operation)
+
+    async def wait(self) -> None:
+        delay = self.scheduler.next_delay(self.operation, self.attempt, self.elapsed)
+        logger.info(f'Пауза {delay:.1f} сек ({self.operation}, попытка {self.attempt})...')
+        self.attempt += 1
+        await asyncio.sleep(delay)
+
+    def done(self) -> None:
+        self.scheduler.record(self.operation, self.elapsed)
+
+
+class PollScheduler:
+    """
+    Планировщик опроса getState. По истории последних операций каждого типа (export, import, revoke)
+    первая проверка назначается на медианное время выполнения, далее интервалы растут экспоненциально
+    со случайным разбросом (jitter). Без истории опрос начинается с коротких интервалов.
+    История может сохраняться в файл, чтобы учитываться между запусками агентов
+        min_delay / max_delay - границы интервала, сек
+        backoff - множитель роста интервала
+        jitter - доля случайного разброса интервала
+        history - количество хранимых замеров по типу операции
+        max_wait - предельное время ожидания операции, сек
+    """
+    def __init__(self, history_file: Optional[Path] = None) -> None:
+        self.history_file = history_file
+        self._history: Optional[dict[str, deque]] = None
+        self._polls: dict[str, int] = {}
+        self._waits: dict[str, float] = {}
+
+    @staticmethod
+    def max_wait(operation: str) -> float:
+        return _option(operation, 'max_wait', MAX_WAIT.get(operation, 3600))
+
+    def _load(self) -> dict[str, deque]:
+        if self._history is None:
+            self._history = {}
+            if self.history_file is not None and self.history_file.exists():
+                try:
+                    self._history = {op: deque(values) for op, values in json.loads(self.history_file.read_text()).items()}
+                except Exception as e:
+                    logger.info(f'Не удалось прочитать историю опроса {self.history_file}: {e}')
+        return self._history
+
+    def _get_history(self, operation: str) -> deque:
+        self._load()
+        size = int(_option(operation, 'history', 50))
+        history = self._history.get(operation)
+        if history is None or history.maxlen != size:
+            history = deque(history or (), maxlen=size)
+            self._history[operation] = history
+        return history
+
+    def _save(self) -> None:
+        if self.history_file is None:
+            return
+        try:
+            self.history_file.write_text(json.dumps({op: list(values) for op, values in self._history.items()}))
+        except Exception as e:
+            logger.info(f'Не удалось сохранить историю опроса {self.history_file}: {e}')
+
+    def next_delay(self, operation: str, attempt: int, elapsed: float) -> float:
+        min_delay = _option(operation, 'min_delay', 2)
+        max_delay = _option(operation, 'max_delay', 180)
+        jitter = _option(operation, 'jitter', 0.2)
+        history = self._get_history(operation)
+
+        if attempt == 0 and history:
+            # первая проверка - к медианному времени выполнения
+            delay = statistics.median(history) - elapsed
+        else:
+            delay = min_delay * _option(operation, 'backoff', 2) ** attempt
+        delay *= 1 + random.uniform(-jitter, jitter)
+        delay = min(max(delay, min_delay), max_delay)
+
+        self._polls[operation] = self._polls.get(operation, 0) + 1
+        self._waits[operation] = self._waits.get(operation, 0) + delay
+        return delay
+
+    def record(self, operation: str, elapsed: float) -> None:
+        self._get_history(operation).append(round(elapsed, 1))
+        self._save()
+
+    def start(self, operation: str) -> Poll:
+        return Poll(self, operation)
+
+    def stats(self) -> dict:
+        """
+        Статистика для настройки: по типу операции - замеры в истории, медиана и 90-й перцентиль времени выполнения,
+        количество пауз и суммарное время ожидания в текущем процессе; по getState - число вызовов и ожидание лимита
+        """
+        operations = {}
+        for operation in sorted({*self._polls, *self._load()}):
+            history = sorted(self._get_history(operation))
+            operations[operation] = {
+                'samples': len(history),
+                'median': statistics.median(history) if history else None,
+                'p90': history[int(len(history) * 0.9) - 1] if len(history) >= 10 else None,
+                'polls': self._polls.get(operation, 0),
+                'waited': round(self._waits.get(operation, 0), 1),
+            }
+        return {'operations': operations, 'state_request': state_limiter.stats()}
+
 
-def get_delay_time(attempt: int) -> int:
-    match attempt:
-        case 0:
-            delay = 30
-            logger.info('Пауза 30 сек...')
-        case 1:
-            delay = 60
-            logger.info('Пауза 60 сек...')
-        case 2:
-            delay = 90
-            logger.info('Пауза 90 сек...')
-        case _:
-            delay = 180
-            logger.info('Пауза 180 сек...')
-    return delay
+poll_scheduler = PollScheduler(resolve_path(project_config.config.get('polling', 'history_file',
+                                                                 fallback='log/poll_history.json')))
+# общий лимит на вызовы getState всеми агентами процесса
+state_limiter = RateLimiter(rate=project_config.config.getfloat('polling', 'state_rate', fallback=2),
+                            burst=project_config.config.getint('polling', 'state_burst', fallback=4))
@@ -1,3 +1,6 @@
+from dataclasses import dataclass, field
+from typing import Optional
+
 import lxml.etree as ET
 
 from src.base.base import ParseXMLMixin
@@ -8,7 +11,9 @@ class ReaderXML(ParseXMLMixin):
     """
         Парсер данных из xml ответа cервера
     """
-    def __init__(self, xml: str):
+    def __init__(self, xml: str, namespaces: dict[str, str] | None = None):
+        if namespaces is not None:
+            self.NAMESPACES = namespaces
         try:
             self.tree = ET.fromstring(xml.encode('utf-8'))
         except Exception:
@@ -17,8 +22,8 @@ class ReaderXML(ParseXMLMixin):
 
 
 class ReaderAckRequest(ReaderXML):
-    def __init__(self, xml):
-        super().__init__(xml)
+    def __init__(self, xml, namespaces: dict[str, str] | None = None):
+        super().__init__(xml, namespaces)
         self.xml = xml
 
     def get_ack_request(self):
@@ -34,8 +39,8 @@ def get_ack_message_guid(ack_xml):
 
 
 class ReaderAckImportResponses(ReaderXML):
-    def __init__(self, xml):
-        super().__init__(xml)
+    def __init__(self, xml, namespaces: dict[str, str] | None = None):
+        super().__init__(xml, namespaces)
         self.xml = xml
 
     def get_ack_import_responses(self) -> int | str:
@@ -50,3 +55,47 @@ class ReaderAckImportResponses(ReaderXML):
 def get_ack_import_responses_state(ack_xml) -> int:
     reader = ReaderAckImportResponses(ack_xml)
     return reader.get_ack_import_responses()
+
+
+@dataclass
+class ImportResults:
+    """
+    Результаты пакетного импорта из ответа getState:
+        state - RequestState
+        error - ошибка обработки сообщения целиком
+        results - TransportGUID действия -> описание ошибки (None - действие выполнено)
+    """
+    state: str
+    error: Optional[str] = None
+    results: dict[str, Optional[str]] = field(default_factory=dict)
+
+    @property
+    def done(self) -> bool:
+        return self.state == '3'
+
+
+class ReaderImportResults(ReaderXML):
+    def __init__(self, xml, namespaces: dict[str, str] | None = None):
+        super().__init__(xml, namespaces)
+        self.xml = xml
+
+    def get_import_results(self) -> ImportResults:
+        if (state := self.get_element('//ns4:RequestState')) is None:
+            logger.error(f'Неверный XML документ: {self.xml}')
+            raise ValueError('Отсутствует RequestState')
+        error_desc = self.get_element('//ns4:ErrorMessage/ns4:Description')
+        results = {}
+        for result in self.get_elements('//ns13:importResult'):
+            transport_guid = result.find('ns4:TransportGUID', namespaces=self._nsmap)
+            if transport_guid is None:
+                continue
+            error = result.find('ns4:Error/ns4:Description', namespaces=self._nsmap)
+            results[transport_guid.text] = error.text if error is not None else None
+        return ImportResults(state=state.text,
+                             error=error_desc.text if error_desc is not None else None,
+                             results=results)
+
+
+def get_import_results(state_xml) -> ImportResults:
+    reader = ReaderImportResults(state_xml)
+    return reader.get_import_results()
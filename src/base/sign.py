@@ -1,40 +1,48 @@
-import base64
+from functools import cache
 from pathlib import Path
 
 import lxml.etree as ET
 
 from src.base.utils import gen_guid, get_isotime
 from src.base.base import ParseXMLMixin
-from src.base.crypto import get_issuer, get_serial, load_cert, get_digest, sign
+from src.base.crypto import get_cert_info, get_digest, sign
 from src.log.log import logger
 
+XADES_TEMPLATE = Path(__file__).resolve().parent / 'templates/signature.xml'
+
+
+@cache
+def _load_xades_template() -> str:
+    """
+    Шаблон XADES подписи читается с диска один раз за время работы процесса
+    """
+    if XADES_TEMPLATE.exists():
+        with open(XADES_TEMPLATE) as f:
+            return f.read()
+    logger.error(f'Не найден необходимый XML для создания XADES подписи')
+    raise FileNotFoundError(XADES_TEMPLATE)
+
 
 class SignedXML(ParseXMLMixin):
     def __init__(self, tree, cert, private_key) -> None:
         self.tree = tree
         self.cert = cert
         self.private_key = private_key
+        cert_info = get_cert_info(self.cert)
         self.sign_data = {
             'signature_id': gen_guid(),
             'signing_time': get_isotime(),
             'key_info_id': gen_guid(),
-            'x509_issuer_name': get_issuer(self.cert),
-            'x509_sn': get_serial(self.cert),
-            'x509_cert': load_cert(self.cert),
+            'x509_issuer_name': cert_info.issuer,
+            'x509_sn': cert_info.serial,
+            'x509_cert': cert_info.cert,
+            'x509_cert_digest': cert_info.digest,
         }
-        self.sign_data['x509_cert_digest'] = get_digest(base64.b64decode(self.sign_data['x509_cert']))
         self.xades = self._get_xades()
         self._sign()
 
     def _get_xades(self):
-        xades_template = Path(__file__).resolve().parent / 'templates/signature.xml'
-        if xades_template.exists():
-            with open(xades_template) as f:
-                tmpl = f.read()
-        else:
-            logger.error(f'Не найден необходимый XML для создания XADES подписи')
-            raise
-        return tmpl.format(**self.sign_data)
+        return _load_xades_template().format(**self.sign_data)
 
     def _sign(self):
         """
@@ -56,10 +64,11 @@ class SignedXML(ParseXMLMixin):
         digest_value1.text = request_digest
 
         # хэш SignProperties
-        sign_prop = self.get_element(f'//*[@Id="xmldsig-{self.sign_data['signature_id']}-signedprops"]')
+        signed_props_id = f'xmldsig-{self.sign_data["signature_id"]}-signedprops'
+        sign_prop = self.get_element('//*[@Id=$id]', id=signed_props_id)
         sign_prop_canonic = self.canonicalizate_tree(sign_prop, exc=True)
         sign_prop_digest = get_digest(sign_prop_canonic)
-        digest_value2 = self.get_element(f'//ds:SignedInfo/ds:Reference[@URI="#xmldsig-{self.sign_data['signature_id']}-signedprops"]/ds:DigestValue')
+        digest_value2 = self.get_element('//ds:SignedInfo/ds:Reference[@URI=$uri]/ds:DigestValue', uri=f'#{signed_props_id}')
         digest_value2.text = sign_prop_digest
 
         # подпись SignedInfo
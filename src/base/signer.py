@@ -0,0 +1,85 @@
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
+import lxml.etree as ET
+
+from src.base.sign import SignedXML
+from src.config import project_config
+
+CERT = project_config.config.get('crypto', 'cert')
+PRIVATE_KEY = project_config.config.get('crypto', 'key')
+# thread - пул потоков (openssl работает в своих процессах), process - пул процессов
+MODE = project_config.config.get('signing', 'mode', fallback='thread')
+WORKERS = project_config.config.getint('signing', 'workers', fallback=4)
+
+_executor: Optional[Executor] = None
+
+
+def _get_executor() -> Executor:
+    global _executor
+    if _executor is None:
+        if MODE == 'process':
+            _executor = ProcessPoolExecutor(max_workers=WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='signer')
+    return _executor
+
+
+def sign_tree_sync(tree) -> None:
+    """
+    Подпись дерева в текущем потоке
+    """
+    SignedXML(tree, CERT, PRIVATE_KEY)
+
+
+def _sign_serialized(xml: bytes) -> bytes:
+    """
+    Подпись в дочернем процессе: дерево передается и возвращается в сериализованном виде
+    """
+    tree = ET.ElementTree(ET.fromstring(xml))
+    sign_tree_sync(tree)
+    return ET.tostring(tree)
+
+
+async def sign_tree(tree):
+    """
+    Каноникализация, хэширование и подпись дерева вне цикла событий.
+    Возвращает подписанное дерево: в режиме process это новый объект
+    """
+    loop = asyncio.get_running_loop()
+    if MODE == 'process':
+        signed = await loop.run_in_executor(_get_executor(), _sign_serialized, ET.tostring(tree))
+        return ET.ElementTree(ET.fromstring(signed))
+    await loop.run_in_executor(_get_executor(), sign_tree_sync, tree)
+    return tree
+
+
+def close_signer() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+class SignMixin:
+    """
+    Подпись формируемого документа: сразу при построении (signed=True)
+    или вне цикла событий через create_signed
+    """
+    tree = None
+    signed = True
+
+    def _sign(self):
+        if self.signed:
+            sign_tree_sync(self.tree)
+
+    @classmethod
+    async def create_signed(cls, *args, **kwargs):
+        """
+        Построение документа без подписи и подпись в пуле signer.
+        После подписи используется только self.tree (get_xml)
+        """
+        doc = cls(*args, signed=False, **kwargs)
+        doc.tree = await sign_tree(doc.tree)
+        return doc
@@ -9,10 +9,23 @@ class GetStateXML(BaseXML):
     Формирование XML для получения статуса отправленного запроса
     """
     TEMPLATE = Path(__file__).resolve().parent / 'templates/getState.xml'
+    NODES = {
+        **BaseXML.NODES,
+        'state_message_guid': '//base:getStateRequest/base:MessageGUID',
+    }
+
     def __init__(self) -> None:
         super().__init__(self.TEMPLATE)
 
     def set_message_guid(self, message_guid):
-        self.get_element('//base:Date').text = get_isotime()
-        elem = self.get_element('//base:getStateRequest/base:MessageGUID')
+        self.get_node('date').text = get_isotime()
+        elem = self.get_node('state_message_guid')
         elem.text = message_guid
+
+    def render(self, message_guid: str) -> str:
+        """
+        XML запроса статуса по message_guid на одном экземпляре шаблона: заголовок обновляется на каждый запрос
+        """
+        self._build_header()
+        self.get_node('state_message_guid').text = message_guid
+        return self.get_xml()
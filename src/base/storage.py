@@ -0,0 +1,63 @@
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+ROOT = Path(__file__).resolve().parent.parent.parent
+
+
+def resolve_path(name: str) -> Optional[Path]:
+    """
+    Путь из настройки: пустая строка - не задан, относительный путь - от корня проекта
+    """
+    if not name:
+        return None
+    path = Path(name)
+    return path if path.is_absolute() else ROOT / path
+
+
+class SQLiteStore:
+    """
+    Локальное хранилище ключ-значение на SQLite со сроком жизни записей.
+    Значения хранятся в JSON. Методы синхронные, из асинхронного кода вызываются через asyncio.to_thread
+    """
+    def __init__(self, path: Path, table: str, ttl: float) -> None:
+        self.path = path
+        self.table = table
+        self.ttl = ttl
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute('pragma journal_mode=wal')
+            self._conn.execute(f'create table if not exists {self.table} '
+                               f'(key text primary key, value text not null, expires real not null)')
+            self._conn.execute(f'delete from {self.table} where expires < ?', (time.time(),))
+        return self._conn
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._connect().execute(f'select value from {self.table} where key = ? and expires >= ?',
+                                          (key, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._connect().execute(f'insert or replace into {self.table} (key, value, expires) values (?, ?, ?)',
+                                    (key, json.dumps(value, ensure_ascii=False), expires))
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._connect().execute(f'delete from {self.table} where key = ?', (key,))
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
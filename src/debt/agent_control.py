@@ -1,17 +1,28 @@
 import asyncio
+from typing import Optional
 
-from src.api.db.db import execute_command, select_command
-from src.debt.state import check_import_responses_state
+from src.api.db.db import execute_command, select_command, transaction
+from src.base.state import GetStateXML
+from src.config import project_config
+from src.debt.state import get_import_responses_state, get_import_results_state
 from src.emails.emails import send_email_to_admins
+from src.log.log import logger
+
+# количество одновременных запросов состояния
+CONCURRENCY = project_config.config.getint('ctrl', 'concurrency', fallback=10)
+# количество ack_guid в одном UPDATE
+UPDATE_CHUNK = project_config.config.getint('ctrl', 'update_chunk', fallback=500)
+
+# transport_guid заполнен у ответов пакетной отправки: один ack_guid на пакет, результат - по действию
+RESPONSE_REQUESTS_SQL = """
+    select distinct ack_guid, transport_guid
+    from details_a
+    where resp_status != 3
+"""
 
 
 async def get_response_requests():
-    q = """
-        select ack_guid
-        from details_a
-        where resp_status != 3
-    """
-    return await select_command(q)
+    return await select_command(RESPONSE_REQUESTS_SQL)
 
 
 async def delete_sent_subrequest():
@@ -21,22 +32,89 @@ async def delete_sent_subrequest():
     return await select_command(q)
 
 
-async def update_status(ack_guid: str, status: int) -> None:
-    q = """
-        update details_a
-        set resp_status = ?
-        where ack_guid = ?
+async def update_statuses(statuses: list[tuple[str, int | str]], column: str = 'ack_guid') -> None:
+    """
+    Запись состояний одним UPDATE на каждые UPDATE_CHUNK ключей. column - ack_guid (ответ отправлен
+    отдельным сообщением) либо transport_guid (действие пакетной отправки)
+    """
+    for i in range(0, len(statuses), UPDATE_CHUNK):
+        chunk = statuses[i:i + UPDATE_CHUNK]
+        q = f"""
+            update details_a
+            set resp_status = case {column} {' '.join(['when ? then ?'] * len(chunk))} end
+            where {column} in ({', '.join(['?'] * len(chunk))})
+        """
+        await execute_command(q, *(value for row in chunk for value in row), *(key for key, _ in chunk))
+
+
+class StatusReconciler:
+    """
+    Сверка состояний отправленных ответов: уникальные ack_guid опрашиваются параллельно
+    (не более concurrency одновременно) одним экземпляром шаблона getState,
+    результаты записываются пакетно. Ответы пакетной отправки сверяются по TransportGUID своих действий:
+    ошибка одного ответа не переносится на весь пакет
     """
-    await execute_command(q, status, ack_guid)
+    def __init__(self, concurrency: int = CONCURRENCY) -> None:
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.state_xml = GetStateXML()
+        self.errors: list[str] = []
+
+    async def _check(self, ack_guid: str) -> Optional[tuple[str, int | str]]:
+        async with self.semaphore:
+            try:
+                return ack_guid, await get_import_responses_state(ack_guid, self.state_xml)
+            except Exception as e:
+                logger.info(f'Ошибка получения состояния отправки {ack_guid}: {e}')
+                self.errors.append(ack_guid)
+                return None
+
+    async def _check_batch(self, ack_guid: str, transport_guids: list[str]) -> list[tuple[str, int | str]]:
+        async with self.semaphore:
+            try:
+                results = await get_import_results_state(ack_guid, self.state_xml)
+            except Exception as e:
+                logger.info(f'Ошибка получения состояния отправки {ack_guid}: {e}')
+                self.errors.append(ack_guid)
+                return []
+        if not results.done:
+            return [(transport_guid, results.state) for transport_guid in transport_guids]
+        statuses = []
+        for transport_guid in transport_guids:
+            error = results.results.get(transport_guid, results.error)
+            statuses.append((transport_guid, results.state if error is None else error))
+        return statuses
+
+    async def run(self, requests: list[tuple[str, Optional[str]]]) -> tuple[list[tuple[str, int | str]],
+                                                                           list[tuple[str, int | str]]]:
+        """
+        requests - пары (ack_guid, transport_guid). Возвращает состояния по ack_guid и по transport_guid
+        """
+        batches: dict[str, list[str]] = {}
+        singles = []
+        for ack_guid, transport_guid in requests:
+            if transport_guid is None:
+                singles.append(ack_guid)
+            else:
+                batches.setdefault(ack_guid, []).append(transport_guid)
+        results, batch_results = await asyncio.gather(
+            asyncio.gather(*(self._check(ack_guid) for ack_guid in singles)),
+            asyncio.gather(*(self._check_batch(ack_guid, guids) for ack_guid, guids in batches.items())))
+        if self.errors:
+            logger.error(f'Не получено состояние {len(self.errors)} из {len(singles) + len(batches)} отправок: '
+                         f'{self.errors[:10]}')
+        return ([result for result in results if result is not None],
+                [status for statuses in batch_results for status in statuses])
 
 
 async def check_status():
     response_requests = await get_response_requests()
 
     if response_requests:
-        for response_ack in response_requests:
-            status = await check_import_responses_state(response_ack[0])
-            await update_status(response_ack[0], status)
+        statuses, transport_statuses = await StatusReconciler().run([(row[0], row[1]) for row in response_requests])
+        if statuses or transport_statuses:
+            async with transaction():
+                await update_statuses(statuses)
+                await update_statuses(transport_statuses, 'transport_guid')
 
 
 def calc_deleted_rows(rows: list[tuple[int]]) -> int:
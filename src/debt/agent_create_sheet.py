@@ -8,15 +8,16 @@ from src.debt.schema import SubrequestCheckDetails
 from src.emails.emails import send_email_to_buhs
 from src.log.log import logger
 
+CHECK_SUBREQUESTS_SQL = """
+    select sent_date, response_date, subrequestguid, fias, address, apartment, 
+           persons, account, doc_arm_number, doc_date, case_number, sum_debt, penalty, duty, total
+    from details_a
+    where is_exp = 0
+"""
+
 
 async def _get_check_subrequests() -> Optional[list[SubrequestCheckDetails]]:
-    sql = """
-        select sent_date, response_date, subrequestguid, fias, address, apartment, 
-               persons, account, doc_arm_number, doc_date, case_number, sum_debt, penalty, duty, total
-        from details_a
-        where is_exp = 0
-    """
-    if fetch := await select_command(sql):
+    if fetch := await select_command(CHECK_SUBREQUESTS_SQL):
         return [SubrequestCheckDetails(*row) for row in fetch]
     return None
 
@@ -1,96 +1,191 @@
 import asyncio
 
-from src.base.delay import get_delay_time
+from src.api.db.writer import close_writers, flush_writers
+from src.api.mobill.cache import mobill_cache
+from src.api.mobill.limiter import mobill_limiter
+from src.base.delay import EXPORT, poll_scheduler
+from src.config import project_config
 from src.debt.state import check_import_responses_state
 from src.emails.emails import send_email_to_admins
 from src.base.state import GetStateXML
 from src.base.reader import get_ack_message_guid
 from src.debt.debt_xml import ExportDebtSubrequests, SendImportDebtResponses
 from src.debt.mobill import get_responses_data
-from src.debt.reader import get_exportDSRsData
-from src.debt.service import export_debt_subrequests, import_debt_responses, state_request
+from src.debt.reader import ExportDSRsStreamReader
+from src.debt.service import export_debt_subrequests, import_debt_responses, state_request_stream
 from src.log.log import logger
 from src.utils import counter
 
 
-async def worker():
+SLICE_SIZE = 100
+# количество страниц выгрузки, которые одновременно находятся в обработке
+PAGES_IN_FLIGHT = project_config.config.getint('get_req', 'pages_in_flight', fallback=2)
+# количество параллельных обработчиков срезов по SLICE_SIZE подзапросов через API Мобилл
+MOBILL_WORKERS = project_config.config.getint('get_req', 'mobill_workers', fallback=2)
+# размер очередей между стадиями
+QUEUE_SIZE = project_config.config.getint('get_req', 'queue_size', fallback=4)
+
+
+class _Page:
+    """
+    Учет страницы выгрузки в конвейере: место в PAGES_IN_FLIGHT освобождается,
+    когда страница прочитана и все ее срезы отправлены
+    """
+    def __init__(self, slots: asyncio.Semaphore) -> None:
+        self._slots = slots
+        self._pending = 0
+        self._closed = False
+        self._released = False
+
+    def add_slice(self) -> None:
+        self._pending += 1
+
+    def slice_done(self) -> None:
+        self._pending -= 1
+        self._check()
+
+    def close(self) -> None:
+        self._closed = True
+        self._check()
+
+    def _check(self) -> None:
+        if self._closed and self._pending == 0 and not self._released:
+            self._released = True
+            self._slots.release()
+
+
+async def _read_export_page(message_guid: str, page: _Page, slices: asyncio.Queue) -> ExportDSRsStreamReader:
+    """
+    Ожидание готовности выгрузки подзапросов. Ответ разбирается потоково в срезы по SLICE_SIZE подзапросов,
+    которые передаются на следующую стадию после чтения ответа: чтение из сети не ждет освобождения
+    места в очереди (иначе при медленных стадиях ответ упирается в таймаут сессии)
+    """
+    state_exp = GetStateXML()
+    state_exp.set_message_guid(message_guid)
+    poll = poll_scheduler.start(EXPORT)
+
+    while True:
+        await poll.wait()
+        reader = ExportDSRsStreamReader()
+        batches = [[]]
+        try:
+            async for subrequest in reader.parse(state_request_stream(state_exp.get_xml())):
+                if len(batches[-1]) == SLICE_SIZE:
+                    batches.append([])
+                batches[-1].append(subrequest)
+        except Exception:
+            logger.error('Ошибка отправки запроса на получение ответа на запрос о наличии задолженности')
+            raise
+
+        for batch in batches:
+            if batch:
+                page.add_slice()
+                await slices.put((batch, page))
+
+        if reader.get_state() != 'wait':
+            poll.done()
+            return reader
+
+
+async def _export_stage(slices: asyncio.Queue) -> None:
+    """
+    Стадия 1. Постраничная выгрузка подзапросов о наличии задолженности
+    """
     sub = None
-    is_over = False
-    srv_request_count = 0
+    slots = asyncio.Semaphore(PAGES_IN_FLIGHT)
 
     while True:
+        await slots.acquire()
+        page = _Page(slots)
         # 1.  Формируем и отправляем XML на наличие задолженности
-        export_subrequests = ExportDebtSubrequests(sub)
+        export_subrequests = await ExportDebtSubrequests.create_signed(sub)
         try:
             st1_ack = await export_debt_subrequests(export_subrequests.get_xml())
-            await asyncio.sleep(2.0)
         except Exception:
             logger.error('Ошибка отправки запроса о наличии задолженности')
             raise
         # 2. Формируем и отправляем XML на получение ответа на ранее отправленный запрос на шаге 1
+        reader = await _read_export_page(get_ack_message_guid(st1_ack), page, slices)
+        page.close()
 
-        state_exp = GetStateXML()
-        state_exp.set_message_guid(get_ack_message_guid(st1_ack))
-
-        while True:
-            try:
-                st2_ack = await state_request(state_exp.get_xml())
-                #
-            except Exception:
-                logger.error('Ошибка отправки запроса на получение ответа на запрос о наличии задолженности')
-                raise
-
-            if data := get_exportDSRsData(st2_ack):
-                if data == 'wait':
-                    await asyncio.sleep(get_delay_time(srv_request_count))
-                    srv_request_count += 1
-                else:
-                    srv_request_count = 0
-                    break
-            else:
-                break
-        del state_exp
-
-        #  Обрабатываем ответ на запрос о наличии задолженности
-        # if data:
-        #     if data == 'wait':
-        #         await asyncio.sleep(get_delay_time(srv_request_count))
-        #         srv_request_count += 1
-        #     else:
-        #         srv_request_count = 0
-        if data:
-            if data.next == 'last':
-                is_over = True
-            else:
-                sub = data.next
-
-            #  В случае, когда не требуется выгрузка для проверки бухгалтерами, то сразу getfile=True,
-            # иначе False
-            #   1.
-            for i in range(0, len(data.subrequests), 100):
-                response_data = await get_responses_data(data.subrequests[i:i+100], getfile=False)
-
-                #  2. Отправка ответов
-
-            # for i in range(0, len(response_data), 100):
-                import_responses = SendImportDebtResponses(response_data)
-                try:
-                    st3_ack = await import_debt_responses(import_responses.get_xml())
-                    # Проверка на состояние отправки занимает время. Данный процесс лучше в отдельный поток
-                    # или запускать отдельно
-                    # res = await check_import_responses_state(get_ack_message_guid(st3_ack))
-                except Exception:
-                    logger.error('Ошибка отправки ответа на запрос о наличии задолженности')
-                    raise
-        else:
-            #  Отсутствуют запросы о наличии задолженности
-            is_over = True
-
-        if is_over:
-            message = f'Отвечено на {counter.get_total_subrequests()} запросов - на проверку {counter.get_check_subrequests()}'
-            send_email_to_admins('Количество отправленных запросов', message)
-            logger.info(message)
+        if reader.get_state() != 'ready' or reader.next == 'last':
+            #  Последняя страница либо отсутствуют запросы о наличии задолженности
+            break
+        if reader.next is None:
+            # без продолжения выгрузка началась бы с первой страницы заново: срезы прочитанных страниц
+            # обрабатываются, выгрузка останавливается
+            logger.error('Страница выгрузки подзапросов без lastPage и nextSubrequestGUID, выгрузка остановлена')
             break
+        sub = reader.next
+
+    for _ in range(MOBILL_WORKERS):
+        await slices.put(None)
+
+
+async def _mobill_stage(slices: asyncio.Queue, responses: asyncio.Queue) -> None:
+    """
+    Стадия 2. Данные о задолженности по API Мобилл.
+    В случае, когда не требуется выгрузка для проверки бухгалтерами, то сразу getfile=True, иначе False
+    """
+    while (item := await slices.get()) is not None:
+        batch, page = item
+        await responses.put((await get_responses_data(batch, getfile=False), page))
+
+
+async def _send_stage(responses: asyncio.Queue) -> None:
+    """
+    Стадия 3. Формирование, подпись и отправка ответов
+    """
+    while (item := await responses.get()) is not None:
+        response_data, page = item
+        import_responses = await SendImportDebtResponses.create_signed(response_data)
+        # строки details_a и requests по подзапросам пакета записываются до отправки ответа:
+        # после отправки подзапрос больше не выгружается и строки не сформируются заново
+        await flush_writers()
+        try:
+            st3_ack = await import_debt_responses(import_responses.get_xml())
+            # Проверка на состояние отправки занимает время. Данный процесс лучше в отдельный поток
+            # или запускать отдельно
+            # res = await check_import_responses_state(get_ack_message_guid(st3_ack))
+        except Exception:
+            logger.error('Ошибка отправки ответа на запрос о наличии задолженности')
+            raise
+        page.slice_done()
+
+
+async def worker():
+    """
+    Конвейер: выгрузка страниц -> данные Мобилл -> отправка ответов. Стадии связаны очередями
+    ограниченного размера, поэтому следующая страница выгружается, пока обрабатывается текущая
+    """
+    counter.reset()
+    slices = asyncio.Queue(maxsize=QUEUE_SIZE)
+    responses = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+    try:
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(_export_stage(slices))
+            mobill_tasks = [tg.create_task(_mobill_stage(slices, responses)) for _ in range(MOBILL_WORKERS)]
+
+            async def _close_responses():
+                # ошибки обработчиков попадают в лог из TaskGroup, здесь только ожидание завершения
+                await asyncio.wait(mobill_tasks)
+                await responses.put(None)
+
+            tg.create_task(_close_responses())
+            tg.create_task(_send_stage(responses))
+    except* Exception as eg:
+        for e in eg.exceptions:
+            logger.error(f'Ошибка конвейера выгрузки: {e!r}')
+        raise eg.exceptions[0]
+    finally:
+        await close_writers()
+
+    message = f'Отвечено на {counter.get_total_subrequests()} запросов - на проверку {counter.get_check_subrequests()}'
+    send_email_to_admins('Количество отправленных запросов', message)
+    logger.info(message)
+    logger.info(f'Статистика опроса getState: {poll_scheduler.stats()}')
+    logger.info(f'Кэш Мобилл: {mobill_cache.stats()}, запросы Мобилл: {mobill_limiter.stats()}')
 
 
 # async def main():
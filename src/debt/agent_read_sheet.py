@@ -3,20 +3,22 @@ from typing import Optional
 
 from src.api.gdrive.schema import GReportAttributes
 from src.api.gdrive.gsheet import delete_spreadsheet_by_id
-from src.api.db.db import select_command, execute_command
+from src.api.db.db import select_command, execute_command, transaction
 from src.debt.gsheet import get_worksheet_data, form_curr_worksheet
+from src.debt.jobs import enqueue_debt_responses
 from src.debt.schema import SubrequestCheckDetails
 from src.debt.zsp_status import update_zsp_status
 from src.emails.emails import send_email_to_buhs
 
+EXPIRED_REPORTS_SQL = """
+    SELECT form_date, report_id, title, comment
+    FROM ext_reports
+    WHERE form_date < CURRENT_DATE()
+"""
+
 
 async def get_spreadsheets_attrs() -> Optional[tuple[GReportAttributes, ...]]:
-    sql = """
-        SELECT form_date, report_id, title, comment
-        FROM ext_reports
-        WHERE str_to_date(form_date, '%d-%m-%Y') < CURRENT_DATE()
-    """
-    if fetch := await select_command(sql):
+    if fetch := await select_command(EXPIRED_REPORTS_SQL):
         return tuple(GReportAttributes(*row) for row in fetch)
     return None
 
@@ -54,16 +56,25 @@ async def write_check_history(subrequest_details: SubrequestCheckDetails) -> Non
 
 
 async def process_report_row(subrequest_details: SubrequestCheckDetails) -> Optional[SubrequestCheckDetails]:
-    await write_check_history(subrequest_details)
-
-    match subrequest_details.buh:
-        case 'Имеется':
-            await update_subrequest_status(subrequest_details.subrequestguid)
-        case 'Погашена' | 'Отмена СП':
-            await update_zsp_status(subrequest_details, subrequest_details.buh)
-            await delete_subrequest(subrequest_details.subrequestguid)
-        case _:
-            return subrequest_details
+    """
+    Обработка строки отчета. Статус ЗСП в Мобилл обновляется до транзакции: сетевой вызов не держит
+    соединение с БД, а откат транзакции его все равно не отменит. Запись истории и смена статуса строки
+    фиксируются одной транзакцией
+    """
+    if subrequest_details.buh in ('Погашена', 'Отмена СП'):
+        await update_zsp_status(subrequest_details, subrequest_details.buh)
+
+    async with transaction():
+        await write_check_history(subrequest_details)
+
+        match subrequest_details.buh:
+            case 'Имеется':
+                await update_subrequest_status(subrequest_details.subrequestguid)
+                await enqueue_debt_responses([subrequest_details.subrequestguid])
+            case 'Погашена' | 'Отмена СП':
+                await delete_subrequest(subrequest_details.subrequestguid)
+            case _:
+                return subrequest_details
     return None
 
 
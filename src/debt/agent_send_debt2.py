@@ -5,56 +5,87 @@ from typing import Optional
 
 sys.path.append(os.getcwd())
 
-from src.api.db.db import execute_command, select_command
-from src.api.mobill.api import get_court_debt
+from src.api.db.db import execute_command, select_command, transaction
+from src.api.mobill.cache import get_court_debt_cached
 from src.base.reader import get_ack_message_guid
 from src.debt.debt_xml import RevokeImportDebtResponses, SendImportDebtResponses
 from src.debt.file import upload_debt_files
-from src.debt.mobill import _process_mob_json_response, _db_insert_subrequest, DebtApiResponseData
+from src.debt.mobill import _process_mob_json_response, _db_insert_subrequest, close_debt_files, DebtApiResponseData
 from src.debt.schema import GISResponseDataFormat, GISDebtorsData, SubrequestData
 from src.debt.service import import_debt_responses
-from src.debt.state import check_import_responses_state
+from src.api.db.queue import Job
+from src.base.delay import IMPORT, REVOKE, poll_scheduler
+from src.config import project_config
+from src.debt.jobs import QUEUE_ENABLED, reconcile_send_queue, send_queue
+from src.debt.state import check_import_responses_state, wait_import_responses_state, wait_import_results
 from src.log.log import logger
 
 semaphore = asyncio.Semaphore(5)
 
+DEBT_REQUESTS_SQL = """
+    select subrequestguid, sent_date, response_date, fias, address, apartment, resp_status
+    from details_a
+    where is_debt = 1 and resp_status is NULL
+    group by subrequestguid, sent_date, response_date, fias, address, apartment, resp_status
+"""
+
+UPDATE_RESPONSE_STATUS_SQL = """
+    update details_a
+    set resp_status = ?, ack_guid = ?, transport_guid = ?
+    where subrequestguid = ?
+"""
+
+# пакетный режим: отзыв и отправка ответов одним importResponses на пакет подзапросов
+BATCHED = project_config.config.getboolean('send_debt', 'batched', fallback=False)
+# размер пакета, ГИС ЖКХ принимает не более 100 действий в запросе
+BATCH_SIZE = min(project_config.config.getint('send_debt', 'batch_size', fallback=100), 100)
+# количество пакетов, которые одновременно готовятся и отправляются
+BATCHES_IN_FLIGHT = project_config.config.getint('send_debt', 'batches_in_flight', fallback=2)
+# количество обработчиков очереди, каждый разбирает пакеты по BATCH_SIZE заданий
+QUEUE_WORKERS = project_config.config.getint('send_debt', 'queue_workers', fallback=2)
+# ответ на подзапрос еще не отправлялся - отзывать нечего
+NOT_SENT = '(не имеет статус "Ответ отправлен")'
+
 
 async def get_debt_requests() -> Optional[list[SubrequestData]]:
-    sql = """
+    if fetch := await select_command(DEBT_REQUESTS_SQL):
+        return [SubrequestData(*row) for row in fetch]
+    return None
+
+
+async def get_subrequests(subrequests_guid: list[str]) -> list[SubrequestData]:
+    """
+    Подзапросы по выданным заданиям очереди
+    """
+    sql = f"""
         select subrequestguid, sent_date, response_date, fias, address, apartment, resp_status
         from details_a
-        where is_debt = 1 and resp_status is NULL
+        where is_debt = 1 and subrequestguid in ({', '.join(['?'] * len(subrequests_guid))})
         group by subrequestguid, sent_date, response_date, fias, address, apartment, resp_status
     """
-    if fetch := await select_command(sql):
-        return [SubrequestData(*row) for row in fetch]
-    return None
+    return [SubrequestData(*row) for row in await select_command(sql, *subrequests_guid)]
 
 
-async def update_response_status(status: int, ack_guid: str, subrequest_guid: str) -> None:
-    q = """
-        update details_a
-        set resp_status = ?, ack_guid = ?
-        where subrequestguid = ?
+async def update_response_status(status: Optional[int | str], ack_guid: Optional[str], subrequest_guid: str,
+                                 transport_guid: Optional[str] = None) -> None:
+    """
+    transport_guid - TransportGUID действия в пакетной отправке: агент контроля сверяет строку
+    с результатом своего действия, а не с первой ошибкой пакета
     """
-    await execute_command(q, status, ack_guid, subrequest_guid)
+    await execute_command(UPDATE_RESPONSE_STATUS_SQL, status, ack_guid, transport_guid, subrequest_guid)
 
 
 class GISResponseHandler:
-    REVOKE_DELAY = 2
-    SEND_DELAY = 10
-
     @staticmethod
-    async def _send_import_request(xml: str, delay: int) -> str:
+    async def _send_import_request(xml: str) -> str:
         """
-        Общая логика отправки XML запроса и проверки статуса.
+        Общая логика отправки XML запроса. Паузу перед проверкой статуса выдерживает poll_scheduler.
         
         Args:
             xml: XML данные для отправки
-            delay: Задержка перед проверкой статуса
             
         Returns:
-            Результат проверки статуса
+            Идентификатор сообщения для проверки статуса
             
         Raises:
             Exception: При ошибках сетевого взаимодействия
@@ -62,8 +93,6 @@ class GISResponseHandler:
         try:
             ack_xml = await import_debt_responses(xml)
             ack_guid = get_ack_message_guid(ack_xml)
-             
-            await asyncio.sleep(delay)
             return ack_guid
             # return await check_import_responses_state(ack_guid)
 
@@ -73,12 +102,26 @@ class GISResponseHandler:
             raise e
         
     async def revoke_response(self, subrequest_guid: str) -> str:
-        revoke = RevokeImportDebtResponses([subrequest_guid])
-        return await self._send_import_request(revoke.get_xml(), GISResponseHandler.REVOKE_DELAY)
+        revoke = await RevokeImportDebtResponses.create_signed([subrequest_guid])
+        return await self._send_import_request(revoke.get_xml())
     
     async def send_response(self, response_data: GISResponseDataFormat) -> str:
-        debt = SendImportDebtResponses([response_data])
-        return await self._send_import_request(debt.get_xml(), GISResponseHandler.SEND_DELAY)
+        debt = await SendImportDebtResponses.create_signed([response_data])
+        return await self._send_import_request(debt.get_xml())
+
+    async def revoke_responses(self, subrequests_guid: list[str]) -> tuple[str, dict[str, str]]:
+        """
+        Отзыв пакета ответов. Возвращает идентификатор сообщения и соответствие TransportGUID -> subrequestGUID
+        """
+        revoke = await RevokeImportDebtResponses.create_signed(subrequests_guid)
+        return await self._send_import_request(revoke.get_xml()), revoke.transport_guids
+
+    async def send_responses(self, responses_data: list[GISResponseDataFormat]) -> tuple[str, dict[str, str]]:
+        """
+        Отправка пакета ответов. Возвращает идентификатор сообщения и соответствие TransportGUID -> subrequestGUID
+        """
+        debt = await SendImportDebtResponses.create_signed(responses_data)
+        return await self._send_import_request(debt.get_xml()), debt.transport_guids
 
 
 async def get_contracts_api_response_data(subrequestdata: SubrequestData) -> Optional[list[DebtApiResponseData]]:
@@ -100,18 +143,22 @@ async def get_contracts_api_response_data(subrequestdata: SubrequestData) -> Opt
             params = {'address': formatted_address}
         return params
 
-    api_response = await get_court_debt(_build_request_parameters(), getfile=True)
+    api_response = await get_court_debt_cached(_build_request_parameters(), getfile=True)
 
     if api_response.get('ERROR'):
         logger.info(f'На запрос {subrequestdata} ответ Мобилл: {api_response}')
         return None
-    return _process_mob_json_response(api_response)
+    return await asyncio.to_thread(_process_mob_json_response, api_response)
     
 
 async def formatting_to_gis_response_data(subrequestdata: SubrequestData) -> Optional[GISResponseDataFormat]:
     if contracts_data := await get_contracts_api_response_data(subrequestdata):
         contract = contracts_data[0]
-        upload_files_attrs = await upload_debt_files(contract.files)
+        try:
+            upload_files_attrs = await upload_debt_files(contract.files)
+        finally:
+            # отправляется только первый договор, файлы остальных освобождаются
+            close_debt_files(contracts_data)
         return GISResponseDataFormat(subrequestGUID=subrequestdata.subrequestGUID, debtorsData=[GISDebtorsData(persons=contract.persons, files=upload_files_attrs)])
     return None
 
@@ -122,40 +169,180 @@ async def resend_subrequest_response(subrequestdata: SubrequestData) -> None:
             if response_data := await formatting_to_gis_response_data(subrequestdata):
                 handler = GISResponseHandler()
                 ack_revoke_guid = await handler.revoke_response(subrequestdata.subrequestGUID)
-                attempt = 0
+                poll = poll_scheduler.start(REVOKE)
                 while True:
+                    await poll.wait()
                     status = await check_import_responses_state(ack_revoke_guid)
                     if status == '3' or '(не имеет статус "Ответ отправлен")' in status:
+                        poll.done()
                         await update_response_status(0, ack_revoke_guid, subrequestdata.subrequestGUID)
                         break
+                    elif not poll.expired:
+                        logger.info(f'Ожидаем отзыва запроса {subrequestdata.subrequestGUID}')
                     else:
-                        if attempt != 10:
-                            logger.info(f'Ожидаем отзыва запроса {subrequestdata.subrequestGUID}')
-                            attempt += 1
-                            await asyncio.sleep(360)
-                        else:
-                            logger.error(f'Количество попыток ожидания отзыва запроса {subrequestdata.subrequestGUID} '
-                                         f'превышено'
-                                         )
-                            raise f'Количество попыток ожидания отзыва запроса {subrequestdata.subrequestGUID} превышено'
+                        message = f'Количество попыток ожидания отзыва запроса {subrequestdata.subrequestGUID} превышено'
+                        logger.error(message)
+                        raise Exception(message)
 
                 ack_debt_guid = await handler.send_response(response_data)
-                status_send_response = await check_import_responses_state(ack_debt_guid)
-                await update_response_status(status_send_response, ack_debt_guid, subrequestdata.subrequestGUID)
-                await _db_insert_subrequest(subrequestdata.subrequestGUID, subrequestdata.sentDate, 'Имеется')
+                status_send_response = await wait_import_responses_state(ack_debt_guid, IMPORT)
+                async with transaction():
+                    await update_response_status(status_send_response, ack_debt_guid, subrequestdata.subrequestGUID)
+                    await _db_insert_subrequest(subrequestdata.subrequestGUID, subrequestdata.sentDate, 'Имеется')
+
+
+async def prepare_subrequest_response(
+        subrequestdata: SubrequestData) -> Optional[tuple[SubrequestData, GISResponseDataFormat]]:
+    """
+    Данные Мобилл и загруженные файлы для ответа на подзапрос
+    """
+    async with semaphore:
+        try:
+            if response_data := await formatting_to_gis_response_data(subrequestdata):
+                return subrequestdata, response_data
+        except Exception as e:
+            logger.error(f'Ошибка подготовки ответа на запрос {subrequestdata.subrequestGUID}: {e}')
+        return None
+
+
+async def resend_batch_responses(batch: list[tuple[SubrequestData, GISResponseDataFormat]]) -> dict[str, Optional[str]]:
+    """
+    Отзыв и повторная отправка пакета ответов: один запрос отзыва и один запрос отправки на пакет,
+    результаты сопоставляются с подзапросами по TransportGUID действий в importResult.
+    Ответы, которые не удалось отозвать, не отправляются; ответы с ошибкой отправки
+    сбрасываются в исходное состояние и будут отправлены повторно при следующем запуске.
+    Возвращает ошибку по каждому подзапросу пакета (None - ответ отправлен)
+    """
+    handler = GISResponseHandler()
+    subrequests = {subrequestdata.subrequestGUID: subrequestdata for subrequestdata, _ in batch}
+    outcomes = {}
+
+    ack_revoke_guid, transport_guids = await handler.revoke_responses(list(subrequests))
+    revoke = await wait_import_results(ack_revoke_guid, REVOKE)
+    if not revoke.done:
+        message = f'Время ожидания отзыва пакета из {len(batch)} запросов ({ack_revoke_guid}) превышено'
+        logger.error(message)
+        raise Exception(message)
+
+    revoked = set()
+    for transport_guid, subrequest_guid in transport_guids.items():
+        error = revoke.results.get(transport_guid, revoke.error)
+        if error is None or NOT_SENT in error:
+            revoked.add(subrequest_guid)
+        else:
+            logger.error(f'Ошибка отзыва ответа на запрос {subrequest_guid}: {error}')
+            outcomes[subrequest_guid] = error
+    if not revoked:
+        return outcomes
+    async with transaction():
+        for subrequest_guid in revoked:
+            await update_response_status(0, ack_revoke_guid, subrequest_guid)
+
+    try:
+        ack_debt_guid, transport_guids = await handler.send_responses(
+            [response_data for subrequestdata, response_data in batch if subrequestdata.subrequestGUID in revoked])
+    except Exception:
+        # отозванные, но не отправленные ответы возвращаются в исходное состояние: иначе агент контроля
+        # сверит их по ack_guid отзыва и удалит как отправленные
+        async with transaction():
+            for subrequest_guid in revoked:
+                await update_response_status(None, None, subrequest_guid)
+        raise
+    try:
+        send = await wait_import_results(ack_debt_guid, IMPORT)
+    except Exception:
+        # пакет принят, состояние каждого ответа сверит агент контроля по ack_guid и TransportGUID действия
+        async with transaction():
+            for transport_guid, subrequest_guid in transport_guids.items():
+                await update_response_status(1, ack_debt_guid, subrequest_guid, transport_guid)
+        raise
+    if not send.done:
+        logger.info(f'Пакет {ack_debt_guid} еще обрабатывается, состояние {send.state} сверит агент контроля')
+
+    async with transaction():
+        for transport_guid, subrequest_guid in transport_guids.items():
+            error = send.results.get(transport_guid, send.error) if send.done else None
+            outcomes[subrequest_guid] = error
+            if error is not None:
+                logger.error(f'Ошибка отправки ответа на запрос {subrequest_guid}: {error}')
+                await update_response_status(None, None, subrequest_guid)
+                continue
+            await update_response_status(send.state, ack_debt_guid, subrequest_guid, transport_guid)
+            await _db_insert_subrequest(subrequest_guid, subrequests[subrequest_guid].sentDate, 'Имеется')
+    return outcomes
+
+
+async def resend_batched(debt_subrequests: list[SubrequestData]) -> list:
+    """
+    Пакетная отправка: данные Мобилл и файлы готовятся для пакета непосредственно перед его отправкой,
+    одновременно обрабатывается не более BATCHES_IN_FLIGHT пакетов
+    """
+    slots = asyncio.Semaphore(BATCHES_IN_FLIGHT)
+
+    async def _resend(subrequests: list[SubrequestData]) -> dict[str, Optional[str]]:
+        async with slots:
+            prepared = await asyncio.gather(*(prepare_subrequest_response(subrequest) for subrequest in subrequests))
+            if batch := [item for item in prepared if item is not None]:
+                return await resend_batch_responses(batch)
+            return {}
+
+    chunks = [debt_subrequests[i:i + BATCH_SIZE] for i in range(0, len(debt_subrequests), BATCH_SIZE)]
+    logger.info(f'Отправка {len(debt_subrequests)} ответов пакетами: {len(chunks)}')
+    return await asyncio.gather(*(_resend(chunk) for chunk in chunks), return_exceptions=True)
+
+
+async def process_jobs(jobs: list[Job]) -> None:
+    """
+    Обработка пакета заданий очереди: отправленные ответы завершаются, остальные возвращаются
+    в очередь с паузой. Задания без строки в details_a (подзапрос уже обработан) завершаются
+    """
+    subrequests = await get_subrequests([job.key for job in jobs])
+    prepared = await asyncio.gather(*(prepare_subrequest_response(subrequest) for subrequest in subrequests))
+    outcomes = {subrequest.subrequestGUID: 'Нет данных для ответа' for subrequest in subrequests}
+    if batch := [item for item in prepared if item is not None]:
+        try:
+            outcomes.update(await resend_batch_responses(batch))
+        except Exception as e:
+            outcomes.update({subrequestdata.subrequestGUID: str(e) for subrequestdata, _ in batch})
+
+    async with transaction():
+        await send_queue.complete([job for job in jobs if outcomes.get(job.key) is None])
+        for job in jobs:
+            if (error := outcomes.get(job.key)) is not None:
+                await send_queue.fail(job, error)
+
+
+async def consume_send_queue() -> None:
+    """
+    Разбор очереди пакетами по BATCH_SIZE заданий, пока есть готовые задания
+    """
+    while jobs := await send_queue.claim(BATCH_SIZE):
+        logger.info(f'Получено заданий на отправку: {len(jobs)}')
+        await process_jobs(jobs)
 
 
 async def worker():
     """
     Точка входа в модуль отправки проверенных запросов на наличие задолженности
     """
-    if debt_subrequests := await get_debt_requests():
-        tasks = [resend_subrequest_response(debt_subrequest) for debt_subrequest in debt_subrequests]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        for res in results:
-            if isinstance(res, Exception):
-                logger.error(f'Ошибка отправки ответа о задолженности: {res}')
-                continue
+    if QUEUE_ENABLED:
+        await reconcile_send_queue()
+        results = await asyncio.gather(*(consume_send_queue() for _ in range(QUEUE_WORKERS)),
+                                       return_exceptions=True)
+        logger.info(f'Очередь отправки: {await send_queue.stats()}')
+    elif debt_subrequests := await get_debt_requests():
+        if BATCHED:
+            results = await resend_batched(debt_subrequests)
+        else:
+            tasks = [resend_subrequest_response(debt_subrequest) for debt_subrequest in debt_subrequests]
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+    else:
+        return
+    for res in results:
+        if isinstance(res, Exception):
+            logger.error(f'Ошибка отправки ответа о задолженности: {res}')
+            continue
+    logger.info(f'Статистика опроса getState: {poll_scheduler.stats()}')
 
 
 if __name__ == "__main__":
@@ -1,17 +1,14 @@
 from abc import abstractmethod
-import copy
 from datetime import datetime, timedelta
 from pathlib import Path
 
-from src.base.base import BaseXML, OperationMixin
+from src.base.base import BaseXML, OperationMixin, get_template
 from src.base.utils import gen_guid
 from src.debt.schema import GISResponseDataFormat, RequestPeriod
-from src.base.sign import SignedXML
+from src.base.signer import SignMixin
 from src.config import project_config
 from src.log.log import logger
 
-CERT = project_config.config.get('crypto', 'cert')
-PRIVATE_KEY = project_config.config.get('crypto', 'key')
 EXEC_GUID = project_config.config.get('guid', 'executor')
 
 
@@ -21,15 +18,23 @@ def get_period() -> RequestPeriod:
     return RequestPeriod(startDate=start_date, endDate=end_date)
 
 
-class ExportDebtSubrequests(BaseXML, OperationMixin):
+class ExportDebtSubrequests(BaseXML, OperationMixin, SignMixin):
     """
     Формирование xml для запроса к порталу ГИС ЖКХ
     """
     TEMPLATE = Path(__file__).resolve().parent / 'templates/exportDebtSubrequests.xml'
-
-    def __init__(self, sub) -> None:
+    NODES = {
+        **BaseXML.NODES,
+        'node': '//*[@Id="signed-data-container"]',
+        'start_date': './/base:startDate',
+        'end_date': './/base:endDate',
+        'sub_request_guid': '//drs:exportSubrequestGUID',
+    }
+
+    def __init__(self, sub, signed: bool = True) -> None:
         super().__init__(self.TEMPLATE)
-        self.node = self.get_element('//*[@Id="signed-data-container"]')
+        self.signed = signed
+        self.node = self.get_node('node')
         self.set_version('13.1.10.1')
         period = get_period()
         self.start = period.startDate
@@ -42,11 +47,11 @@ class ExportDebtSubrequests(BaseXML, OperationMixin):
         Вносим период запроса
         """
         period_elements = {
-            './/base:startDate': self.start,
-            './/base:endDate': self.end
+            'start_date': self.start,
+            'end_date': self.end
         }
-        for path, value in period_elements.items():
-            elem = self.get_element(path)
+        for name, value in period_elements.items():
+            elem = self.get_node(name)
             elem.text = value
 
     def _build_body(self):
@@ -54,37 +59,49 @@ class ExportDebtSubrequests(BaseXML, OperationMixin):
         Формируем основное тело XML
         """
         self._set_period_of_sending_request()
-        sub_request_guid = self.get_element('//drs:exportSubrequestGUID')
+        sub_request_guid = self.get_node('sub_request_guid')
         if self.sub is None:
             self.node.remove(sub_request_guid)
         else:
             sub_request_guid.text = self.sub
-        SignedXML(self.tree, CERT, PRIVATE_KEY)
+        self._sign()
 
 
-class ImportDebtResponses(BaseXML, OperationMixin):
+class ImportDebtResponses(BaseXML, OperationMixin, SignMixin):
     """
     Формирование xml запроса с ответами к порталу ГИС ЖКХ
     """
     TEMPLATE = Path(__file__).resolve().parent / 'templates/importDebtResponses.xml'
-
-    def __init__(self) -> None:
+    NODES = {
+        **BaseXML.NODES,
+        'node': '//*[@Id="signed-data-container"]',
+        'resp_data': '//drs:responseData',
+        'debt_info': '//drs:debtInfo',
+        'attachment_file': '//drs:document',
+        'action': '//drs:action',
+    }
+
+    def __init__(self, signed: bool = True) -> None:
         super().__init__(self.TEMPLATE)
-        self.node = self.get_element('//*[@Id="signed-data-container"]')
+        self.signed = signed
+        self.node = self.get_node('node')
         self.set_version('14.0.0.0')
 
-        resp_data = self.get_element('//drs:responseData')
+        resp_data = self.get_node('resp_data')
 
-        self.debt_info = self.get_element('//drs:debtInfo')
+        self.debt_info = self.get_node('debt_info')
 
-        self.attachment_file = self.get_element('//drs:document')
+        self.attachment_file = self.get_node('attachment_file')
         self.debt_info.remove(self.attachment_file)
 
         resp_data.remove(self.debt_info)
 
-        self.action = self.get_element('//drs:action')
+        self.action = self.get_node('action')
         self.node.remove(self.action)
 
+        # TransportGUID действия -> subrequestGUID, для сопоставления результатов importResult
+        self.transport_guids: dict[str, str] = {}
+
     @abstractmethod
     def _build_body(self):
         raise NotImplementedError
@@ -95,8 +112,8 @@ class SendImportDebtResponses(ImportDebtResponses):
     Формирование xml запроса с ответами к порталу ГИС ЖКХ
     """
 
-    def __init__(self, data: list[GISResponseDataFormat]) -> None:
-        super().__init__()
+    def __init__(self, data: list[GISResponseDataFormat], signed: bool = True) -> None:
+        super().__init__(signed)
         if len(data) > 100:
             logger.error(f'Ошибочный размер списка входного списка: {data}')
             raise TypeError
@@ -107,59 +124,47 @@ class SendImportDebtResponses(ImportDebtResponses):
         """
         Формируем блок action
         data - словарь с ключом subrequestGUID
+        Блоки action, debtInfo и document строятся по разметке шаблона без копирования узлов
         """
-        ns = self.get_namespaces()
+        tmpl = get_template(self.TEMPLATE, self.NODES)
+        action = tmpl.layout('action', 'debt_info')
+        debt_info = tmpl.layout('debt_info', 'attachment_file')
+        document = tmpl.layout('attachment_file')
         for item in self.data:
-            clone = copy.deepcopy(self.action)
-            clone.find('base:TransportGUID', namespaces=ns).text = gen_guid()
-            clone.find('drs:subrequestGUID', namespaces=ns).text = item.subrequestGUID
-            clone.find('drs:actionType', namespaces=ns).text = 'Send'
-            clone.find('drs:responseData/drs:description', namespaces=ns).text = ' '
-            clone.find('drs:responseData/drs:executorGUID', namespaces=ns).text = EXEC_GUID
+            transport_guid = gen_guid()
+            self.transport_guids[transport_guid] = item.subrequestGUID
+            values = {
+                'TransportGUID': transport_guid,
+                'subrequestGUID': item.subrequestGUID,
+                'actionType': 'Send',
+                'description': ' ',
+                'executorGUID': EXEC_GUID,
+            }
             if not item.debtorsData:
-                clone.find('drs:responseData/drs:hasDebt', namespaces=ns).text = 'false'
-            else:
-                for debtors in item.debtorsData:
-                    for name in debtors.persons:
-                        clone.find('drs:responseData/drs:hasDebt', namespaces=ns).text = 'true'
-                        # находим узел ResponseData для добавления информации о должниках
-                        resp_data_node = clone.find('drs:responseData', namespaces=ns)
-                        # клонируем узел debtInfo для каждого должника
-                        debt_info_clone = copy.deepcopy(self.debt_info)
-
-                        first_name_elem = debt_info_clone.find('drs:person/drs:firstName', namespaces=ns)
-                        first_name_elem.text = name.firstName
-
-                        last_name_elem = debt_info_clone.find('drs:person/drs:lastName', namespaces=ns)
-                        last_name_elem.text = name.lastName
-
-                        middle_name_elem = debt_info_clone.find('drs:person/drs:middleName', namespaces=ns)
-
-                        if name.middleName != '':
-                            middle_name_elem.text = name.middleName
-                        else:
-                            middle_name_elem_parent = middle_name_elem.getparent()
-                            middle_name_elem_parent.remove(middle_name_elem)
-
-                        if files := debtors.files:
-                            for file in files:
-                                # клонируем узел attachmentFile для каждого файла
-                                attachment_file_clone = copy.deepcopy(self.attachment_file)
-                                attachment_file_clone.find('drs:attachment/base:Name',
-                                                           namespaces=ns).text = file.name
-                                attachment_file_clone.find('drs:attachment/base:Description',
-                                                           namespaces=ns).text = file.desc
-                                attachment_file_clone.find('drs:attachment/base:Attachment/base:AttachmentGUID',
-                                                           namespaces=ns).text = file.attachmentGUID
-                                attachment_file_clone.find('drs:attachment/base:AttachmentHASH',
-                                                           namespaces=ns).text = file.attachmentHASH
-                                debt_info_clone.append(attachment_file_clone)
-
-                        # вставляем
-                        resp_data_node.append(debt_info_clone)
-
-            self.node.append(clone)
-        SignedXML(self.tree, CERT, PRIVATE_KEY)
+                values['hasDebt'] = 'false'
+            elif any(debtors.persons for debtors in item.debtorsData):
+                values['hasDebt'] = 'true'
+            refs = {}
+            action.build(self.node, values, refs=refs)
+            # узел responseData для добавления информации о должниках
+            resp_data_node = refs['responseData']
+            for debtors in item.debtorsData or ():
+                for name in debtors.persons:
+                    # узел debtInfo для каждого должника, пустое отчество не передается
+                    debt_info_node = debt_info.build(
+                        resp_data_node,
+                        {'firstName': name.firstName, 'lastName': name.lastName, 'middleName': name.middleName},
+                        omit=('middleName',) if name.middleName == '' else (),
+                    )
+                    # узел document для каждого файла
+                    for file in debtors.files or ():
+                        document.build(debt_info_node, {
+                            'Name': file.name,
+                            'Description': file.desc,
+                            'AttachmentGUID': file.attachmentGUID,
+                            'AttachmentHASH': file.attachmentHASH,
+                        })
+        self._sign()
 
 
 class RevokeImportDebtResponses(ImportDebtResponses):
@@ -167,8 +172,8 @@ class RevokeImportDebtResponses(ImportDebtResponses):
     Формирование xml запроса для отзыва отправленных ответов к порталу ГИС ЖКХ
     """
 
-    def __init__(self, subrequests_guid: list[str]) -> None:
-        super().__init__()
+    def __init__(self, subrequests_guid: list[str], signed: bool = True) -> None:
+        super().__init__(signed)
         if len(subrequests_guid) > 100:
             logger.error(f'Ошибочный размер списка входного списка: {subrequests_guid}')
             raise TypeError
@@ -180,12 +185,13 @@ class RevokeImportDebtResponses(ImportDebtResponses):
         Формируем блок action
         data - словарь с ключом subrequestGUID
         """
-        ns = self.get_namespaces()
+        action = get_template(self.TEMPLATE, self.NODES).layout('action')
         for subrequest_guid in self.subrequests_guid:
-            clone = copy.deepcopy(self.action)
-            clone.find('base:TransportGUID', namespaces=ns).text = gen_guid()
-            clone.find('drs:subrequestGUID', namespaces=ns).text = subrequest_guid
-            clone.find('drs:actionType', namespaces=ns).text = 'Revoke'
-            clone.remove(clone.find('drs:responseData', namespaces=ns))
-            self.node.append(clone)
-        SignedXML(self.tree, CERT, PRIVATE_KEY)
+            transport_guid = gen_guid()
+            self.transport_guids[transport_guid] = subrequest_guid
+            action.build(self.node, {
+                'TransportGUID': transport_guid,
+                'subrequestGUID': subrequest_guid,
+                'actionType': 'Revoke',
+            }, omit=('responseData',))
+        self._sign()
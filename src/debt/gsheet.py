@@ -44,8 +44,7 @@ async def create_spreadsheet(title: str, rows: list[SubrequestCheckDetails], cli
     await share_spreadsheet(client, ss.id, emails)
     logger.info(f'Документ ID "{ss.id}" и названием "{title}" создан!')
     # запись в БД информации о файле отчета
-    date = datetime.now().strftime('%d-%m-%Y')
-    await create_db_record_about_report(GReportAttributes(date, ss.id, title))
+    await create_db_record_about_report(GReportAttributes(datetime.now().date(), ss.id, title))
 
 
 async def form_worksheet(ws: AsyncioGspreadWorksheet, rows: list[SubrequestCheckDetails]) -> None:
@@ -0,0 +1,33 @@
+from src.api.db.queue import WorkQueue
+from src.config import project_config
+from src.log.log import logger
+
+# отправка ответов через очередь work_queue вместо выборки details_a (таблица создается миграцией)
+QUEUE_ENABLED = project_config.config.getboolean('send_debt', 'queue', fallback=False)
+
+# подзапросы с подтвержденной задолженностью без отправленного ответа
+PENDING_DEBT_RESPONSES_SQL = """
+    select distinct subrequestguid as item_key
+    from details_a
+    where is_debt = 1 and resp_status is null
+"""
+
+# подзапросы с подтвержденной задолженностью, ожидающие отзыва и отправки ответа
+send_queue = WorkQueue('send_debt')
+
+
+async def enqueue_debt_responses(subrequests_guid: list[str]) -> None:
+    """
+    Задания ставятся и при выключенной очереди: после ее включения отправляются подзапросы,
+    отмеченные в любом режиме
+    """
+    await send_queue.enqueue((subrequest_guid, None) for subrequest_guid in subrequests_guid)
+
+
+async def reconcile_send_queue() -> None:
+    """
+    Постановка в очередь подзапросов details_a, ожидающих ответа, но отсутствующих в очереди
+    (например, отмеченных до появления очереди или другим путем)
+    """
+    if count := await send_queue.enqueue_missing(PENDING_DEBT_RESPONSES_SQL):
+        logger.info(f'В очередь отправки добавлено подзапросов из details_a: {count}')
@@ -1,20 +1,39 @@
 import asyncio
-import base64
 from dataclasses import dataclass, astuple
 from datetime import datetime
 import json
+from itertools import chain
 import re
-from typing import Optional
+from typing import Iterable, Optional
 
 from src.api.db.db import execute_command
+from src.api.db.writer import create_writer
 from src.log.log import logger
 from src.api.gis.file import File
-from src.api.mobill.api import get_court_debt
+from src.api.gis.payload import FilePayload
+from src.api.mobill.cache import get_court_debt_cached
 from src.debt.file import upload_debt_files
 from src.debt.schema import GISDebtorsData, PersonName, GISResponseDataFormat, SubrequestData, SubrequestCheckDetails
 from src.utils import counter
 
 
+INSERT_CHECK_SUBREQUEST_SQL = """
+    insert into details_a (sent_date, response_date, subrequestguid, fias, address, apartment, 
+                           persons, account, doc_arm_number, doc_date, case_number, sum_debt, penalty, duty, total)
+    values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+INSERT_SUBREQUEST_SQL = """
+    insert into requests (requestguid, answer, sent_date, answer_time)
+    values (?, ?, ?, ?)
+    on duplicate key update
+    answer = values(answer)
+"""
+
+check_subrequests_writer = create_writer(INSERT_CHECK_SUBREQUEST_SQL)
+subrequests_writer = create_writer(INSERT_SUBREQUEST_SQL)
+
+
 class DebtApiResponseFile(File):...
 
 
@@ -94,17 +113,24 @@ async def _get_response_format_data(subrequest_data: SubrequestData, getfile: bo
             'address': address
         }
 
-    api_response = await get_court_debt(params, getfile)
+    api_response = await get_court_debt_cached(params, getfile)
 
     if api_response.get('ERROR'):
         logger.info(f'На запрос {subrequest_data} ответ Мобилл {api_response}')
 
     else:
         counter.increment_total_subrequest()
-        for debt_account in _process_mob_json_response(api_response):
+        # с файлами судебных приказов разбор включает декодирование и хэширование, поэтому выполняется вне цикла событий
+        debt_accounts = (await asyncio.to_thread(_process_mob_json_response, api_response) if getfile
+                         else _process_mob_json_response(api_response))
+        for i, debt_account in enumerate(debt_accounts):
             if getfile:
-                debtors_data.append(GISDebtorsData(persons=debt_account.persons,
-                                                   files=await upload_debt_files(debt_account.files)))
+                try:
+                    files = await upload_debt_files(debt_account.files)
+                except Exception:
+                    close_debt_files(debt_accounts[i + 1:])
+                    raise
+                debtors_data.append(GISDebtorsData(persons=debt_account.persons, files=files))
             else:
                 # persons = ','.join([repr(p) for p in debt_account.persons])
                 persons = '\n'.join([repr(p) for p in debt_account.persons])
@@ -126,35 +152,31 @@ async def _get_response_format_data(subrequest_data: SubrequestData, getfile: bo
                                                                          ))
                 counter.increment_check_subrequest()
     if debtors_data:
-        await _db_insert_subrequest(subrequest_data.subrequestGUID, subrequest_data.sentDate, 'Имеется')
+        await _db_buffer_subrequest(subrequest_data.subrequestGUID, subrequest_data.sentDate, 'Имеется')
         counter.increment_debtor_subrequest()
     else:
-        await _db_insert_subrequest(subrequest_data.subrequestGUID, subrequest_data.sentDate)
+        await _db_buffer_subrequest(subrequest_data.subrequestGUID, subrequest_data.sentDate)
 
     return GISResponseDataFormat(subrequestGUID=subrequest_data.subrequestGUID, debtorsData=debtors_data)
 
 
 async def _db_insert_check_subrequest(subrequest_details: SubrequestCheckDetails):
-    sql = """
-        insert into details_a (sent_date, response_date, subrequestguid, fias, address, apartment, 
-                               persons, account, doc_arm_number, doc_date, case_number, sum_debt, penalty, duty, total)
-        values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     """
-    try:
-        await execute_command(sql, *astuple(subrequest_details)[:-1])
-    except Exception as e:
-        logger.error(f'Ошибка записи в БД: {subrequest_details}. {e=}')
+    Строка попадает в details_a пакетом через check_subrequests_writer
+    """
+    await check_subrequests_writer.write(astuple(subrequest_details)[:-1])
 
 
-async def _db_insert_subrequest(subrequestguid: str, sent_date: str, answer: str='Нет задолженности'):
-    sql = """
-        insert into requests (requestguid, answer, sent_date, answer_time)
-        values (?, ?, ?, ?)
-        on duplicate key update
-        answer = values(answer)
+async def _db_buffer_subrequest(subrequestguid: str, sent_date: str, answer: str='Нет задолженности'):
     """
+    Строка попадает в requests пакетом через subrequests_writer
+    """
+    await subrequests_writer.write((subrequestguid, answer, sent_date, datetime.now()))
+
+
+async def _db_insert_subrequest(subrequestguid: str, sent_date: str, answer: str='Нет задолженности'):
     try:
-        await execute_command(sql,
+        await execute_command(INSERT_SUBREQUEST_SQL,
                               subrequestguid,
                               answer,
                               sent_date,
@@ -163,6 +185,15 @@ async def _db_insert_subrequest(subrequestguid: str, sent_date: str, answer: str
         logger.error(f'Ошибка записи в БД: {e=}')
 
 
+def close_debt_files(debt_accounts: list[DebtApiResponseData], files: Iterable[File] = ()) -> None:
+    """
+    Освобождение содержимого файлов судебных приказов, которые не будут отправлены
+    """
+    for file in chain(files, *(debt_account.files for debt_account in debt_accounts)):
+        if isinstance(file.file, FilePayload):
+            file.file.close()
+
+
 def _process_mob_json_response(mobill_json_response: json) -> Optional[list[DebtApiResponseData]]:
     resp_data = []
     # Получаем данные лс на адресе
@@ -208,10 +239,19 @@ def _process_mob_json_response(mobill_json_response: json) -> Optional[list[Debt
                         if last_document.get('File'):
                             for file in last_document['File']:
                                 if file_name := find_sp_filename(file['FileName']):
-                                    file_content = ''.join(file_chunk.replace('\n', '') for file_chunk in file['FileContent'])
+                                    file_content = file['FileContent']
+                                    payload = FilePayload()
+                                    try:
+                                        for file_chunk in [file_content] if isinstance(file_content, str) else file_content:
+                                            payload.write_base64(file_chunk)
+                                        payload.finish()
+                                    except Exception:
+                                        payload.close()
+                                        close_debt_files(resp_data, files)
+                                        raise
                                     f = DebtApiResponseFile(
                                         filename=file_name,
-                                        file=base64.b64decode(file_content)
+                                        file=payload
                                     )
                                     files.append(f)
 
@@ -239,6 +279,7 @@ def _process_mob_json_response(mobill_json_response: json) -> Optional[list[Debt
                         resp_data.append(data)
     # На портале не продуман момент, когда на одном адресе несколько лс, при том эти лс имеют задолженность.
     # Решением пока вижу возвращать срез, где данные первого лс
+    close_debt_files(resp_data[:-1])
     return resp_data[-1:] if resp_data else []
 
 
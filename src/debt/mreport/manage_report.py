@@ -29,38 +29,40 @@ class MonthStat:
         self.debts = int(self.debts)
 
 
+REQUESTS_STATISTICS_SQL = """
+    SELECT *
+    FROM (
+            SELECT 
+                COALESCE(period, 'ИТОГО') as 'Период',
+                SUM(total) as 'Поступило запросов',
+                SUM(total - debt) as 'Отсутствует задолженность',
+                SUM(debt) as 'Имеется задолженность'
+            FROM (
+                    SELECT 
+                       s.period,
+                       s.total,
+                       s.debt
+                    FROM statistics s
+                    
+                    UNION ALL
+                    
+                    SELECT
+                       DATE_FORMAT(sent_date, '%m.%Y') AS period,
+                       COUNT(*)  as total,
+                       SUM(CASE WHEN answer = 'Имеется' THEN 1 ELSE 0 END) AS debt
+                    FROM requests
+                    GROUP BY DATE_FORMAT(sent_date, '%m.%Y')
+            ) AS q
+            GROUP BY period WITH ROLLUP
+    ) q1
+    ORDER BY 
+                CASE WHEN `Период` = 'ИТОГО' THEN 1 ELSE 0 END,
+                STR_TO_DATE(CONCAT('01.', `Период`), '%d.%m.%Y')
+"""
+
+
 async def get_requests_data() -> Optional[list[MonthStat]]:
-    sql = """
-                SELECT *
-                FROM (
-                        SELECT 
-                            COALESCE(period, 'ИТОГО') as 'Период',
-                            SUM(total) as 'Поступило запросов',
-                            SUM(total - debt) as 'Отсутствует задолженность',
-                            SUM(debt) as 'Имеется задолженность'
-                        FROM (
-                                SELECT 
-                                   s.period,
-                                   s.total,
-                                   s.debt
-                                FROM statistics s
-                                
-                                UNION ALL
-                                
-                                SELECT
-                                   DATE_FORMAT(sent_date, '%m.%Y') AS period,
-                                   COUNT(*)  as total,
-                                   SUM(CASE WHEN answer = 'Имеется' THEN 1 ELSE 0 END) AS debt
-                                FROM requests
-                                GROUP BY DATE_FORMAT(sent_date, '%m.%Y')
-                        ) AS q
-                        GROUP BY period WITH ROLLUP
-                ) q1
-                ORDER BY 
-                            CASE WHEN `Период` = 'ИТОГО' THEN 1 ELSE 0 END,
-                            STR_TO_DATE(CONCAT('01.', `Период`), '%d.%m.%Y')
-    """
-    if f := await select_command(sql):
+    if f := await select_command(REQUESTS_STATISTICS_SQL):
         return [MonthStat(*row) for row in f]
     return []
 
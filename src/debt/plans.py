@@ -0,0 +1,33 @@
+from src.api.db.migrations import PlanCheck, check_plans
+from src.debt.agent_control import RESPONSE_REQUESTS_SQL
+from src.debt.agent_create_sheet import CHECK_SUBREQUESTS_SQL
+from src.debt.agent_read_sheet import EXPIRED_REPORTS_SQL
+from src.debt.agent_send_debt2 import DEBT_REQUESTS_SQL, UPDATE_RESPONSE_STATUS_SQL
+from src.debt.mreport.manage_report import REQUESTS_STATISTICS_SQL
+from src.log.log import logger
+
+# частые запросы агентов и индексы, которые они должны использовать (миграция hot_query_indexes).
+# Проверки chosen=True (полный просмотр покрывающего индекса) проходят только на БД с рабочим объемом данных
+HOT_QUERIES = [
+    PlanCheck('send: get_debt_requests', DEBT_REQUESTS_SQL, 'details_a', 'ix_details_a_send'),
+    PlanCheck('send: update_response_status', UPDATE_RESPONSE_STATUS_SQL, 'details_a', 'ix_details_a_subrequest',
+              (3, '00000000-0000-0000-0000-000000000000', '00000000-0000-0000-0000-000000000000',
+               '00000000-0000-0000-0000-000000000000')),
+    PlanCheck('ctrl: get_response_requests', RESPONSE_REQUESTS_SQL, 'details_a', 'ix_details_a_ack', chosen=True),
+    PlanCheck('create: _get_check_subrequests', CHECK_SUBREQUESTS_SQL, 'details_a', 'ix_details_a_is_exp'),
+    PlanCheck('read: get_spreadsheets_attrs', EXPIRED_REPORTS_SQL, 'ext_reports', 'ix_ext_reports_form_date'),
+    PlanCheck('mng: get_requests_data', REQUESTS_STATISTICS_SQL, 'requests', 'ix_requests_sent_date', chosen=True),
+]
+
+
+async def check_query_plans() -> bool:
+    """
+    Проверка планов частых запросов: изменение запроса или схемы, из-за которого индекс
+    перестал применяться, попадает в лог как ошибка
+    """
+    if errors := await check_plans(HOT_QUERIES):
+        for error in errors:
+            logger.error(f'План запроса: {error}')
+        return False
+    logger.info(f'Планы запросов в порядке: {len(HOT_QUERIES)}')
+    return True
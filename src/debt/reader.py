@@ -1,5 +1,7 @@
 from dataclasses import dataclass
-from typing import Optional
+from typing import AsyncIterator, Iterator, Optional
+
+import lxml.etree as ET
 
 from src.base.reader import ReaderXML
 from src.debt.schema import SubrequestData
@@ -29,6 +31,44 @@ def num_apartment(val: str | None) -> str:
         return ''
 
 
+def parse_subrequest_data(subrequest, ns: dict[str, str]) -> SubrequestData:
+    """
+    Данные подзапроса из узла subrequestData, ns - карта пространств имен с префиксом ns13
+    """
+    subrequest_guid = subrequest.find('ns13:subrequestGUID', namespaces=ns).text
+    if (sent_date_elem := subrequest.find('.//ns13:sentDate', namespaces=ns)) is not None:
+        sent_date = remove_tz(sent_date_elem.text)
+    else:
+        sent_date = None
+
+    if (response_date_elem := subrequest.find('.//ns13:responseDate', namespaces=ns)) is not None:
+        response_date = response_date_elem.text
+    else:
+        response_date = None
+
+    if (fias_house_elem := subrequest.find('.//ns13:fiasHouseGUID', namespaces=ns)) is not None:
+        fias_house = fias_house_elem.text
+    else:
+        fias_house = None
+
+    if (address_elem := subrequest.find('.//ns13:address', namespaces=ns)) is not None:
+        address = address_elem.text
+    else:
+        address = ''
+
+    if (apartment_elem := subrequest.find('.//ns13:addressDetails', namespaces=ns)) is not None:
+        apartment = num_apartment(apartment_elem.text)
+    else:
+        apartment = ''
+
+    return SubrequestData(subrequestGUID=subrequest_guid,
+                          sentDate=sent_date,
+                          responseDate=response_date,
+                          fiasHouseGUID=fias_house,
+                          address=address,
+                          apartment=apartment)
+
+
 @dataclass(frozen=True)
 class ExportDSRsData:
     """
@@ -40,8 +80,8 @@ class ExportDSRsData:
 
 
 class ReaderExportDSRsResult(ReaderXML):
-    def __init__(self, xml: str):
-        super().__init__(xml)
+    def __init__(self, xml: str, namespaces: dict[str, str] | None = None):
+        super().__init__(xml, namespaces)
         self.xml = xml
         self.ns = self.get_namespaces()
 
@@ -60,40 +100,7 @@ class ReaderExportDSRsResult(ReaderXML):
                         next_sub = next_guid.text
 
                     subrequests = self.get_elements('//ns13:subrequestData')
-                    subrequests_data = []
-                    for subrequest in subrequests:
-                        subrequest_guid = subrequest.find('ns13:subrequestGUID',namespaces=self.ns).text
-                        if (sent_date_elem := subrequest.find('.//ns13:sentDate', namespaces=self.ns)) is not None:
-                            sent_date = remove_tz(sent_date_elem.text)
-                        else:
-                            sent_date = None
-
-                        if (response_date_elem := subrequest.find('.//ns13:responseDate', namespaces=self.ns)) is not None:
-                            response_date = response_date_elem.text
-                        else:
-                            response_date = None
-
-                        if (fias_house_elem := subrequest.find('.//ns13:fiasHouseGUID', namespaces=self.ns)) is not None:
-                            fias_house = fias_house_elem.text
-                        else:
-                            fias_house = None
-
-                        if (address_elem := subrequest.find('.//ns13:address', namespaces=self.ns)) is not None:
-                            address = address_elem.text
-                        else:
-                            address = ''
-
-                        if (apartment_elem := subrequest.find('.//ns13:addressDetails', namespaces=self.ns)) is not None:
-                            apartment = num_apartment(apartment_elem.text)
-                        else:
-                            apartment = ''
-
-                        subrequests_data.append(SubrequestData(subrequestGUID=subrequest_guid,
-                                                               sentDate=sent_date,
-                                                               responseDate=response_date,
-                                                               fiasHouseGUID=fias_house,
-                                                               address=address,
-                                                               apartment=apartment))
+                    subrequests_data = [parse_subrequest_data(subrequest, self.ns) for subrequest in subrequests]
 
                     return ExportDSRsData(next=next_sub, messageGUID=message_guid, subrequests=subrequests_data)
                 else:
@@ -111,3 +118,95 @@ class ReaderExportDSRsResult(ReaderXML):
 def get_exportDSRsData(export_state_xml: str) -> Optional[ExportDSRsData] | str:
     reader = ReaderExportDSRsResult(export_state_xml)
     return reader.get_exportDSRsData()
+
+
+class ExportDSRsStreamReader:
+    """
+    Потоковый разбор ответа getState на exportDSRsRequest. Ответ подается частями по мере получения
+    (lxml XMLPullParser - iterparse для данных из сети), подзапросы отдаются сразу после разбора их узла,
+    а разобранные узлы удаляются из дерева, поэтому память не растет с размером страницы
+    """
+    NO_OBJECTS = 'Нет объектов для экспорта'
+
+    def __init__(self) -> None:
+        self._parser = ET.XMLPullParser(events=('end',))
+        self.request_state = None
+        self.message_guid = None
+        self.error = None
+        self.last_page = False
+        self.next_guid = None
+        self.count = 0
+
+    @property
+    def next(self) -> Optional[str]:
+        """
+        nextSubrequestGUID следующей страницы либо 'last'
+        """
+        return 'last' if self.last_page else self.next_guid
+
+    def feed(self, chunk: bytes) -> Iterator[SubrequestData]:
+        self._parser.feed(chunk)
+        yield from self._read_events()
+
+    def close(self) -> Iterator[SubrequestData]:
+        self._parser.close()
+        yield from self._read_events()
+
+    async def parse(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[SubrequestData]:
+        async for chunk in chunks:
+            for subrequest in self.feed(chunk):
+                yield subrequest
+        for subrequest in self.close():
+            yield subrequest
+
+    def _read_events(self) -> Iterator[SubrequestData]:
+        for _, elem in self._parser.read_events():
+            match ET.QName(elem).localname:
+                case 'subrequestData':
+                    self.count += 1
+                    yield parse_subrequest_data(elem, {'ns13': ET.QName(elem).namespace})
+                    self._release(elem)
+                case 'RequestState' if self.request_state is None:
+                    self.request_state = elem.text
+                case 'MessageGUID' if self.message_guid is None:
+                    self.message_guid = elem.text
+                case 'Description' if self.error is None and self._parent_name(elem) == 'ErrorMessage':
+                    self.error = elem.text
+                case 'lastPage':
+                    self.last_page = True
+                case 'nextSubrequestGUID' if self.next_guid is None:
+                    self.next_guid = elem.text
+
+    @staticmethod
+    def _parent_name(elem) -> Optional[str]:
+        parent = elem.getparent()
+        return ET.QName(parent).localname if parent is not None else None
+
+    @staticmethod
+    def _release(elem) -> None:
+        """
+        Удаление разобранного узла и его предшественников
+        """
+        elem.clear(keep_tail=True)
+        parent = elem.getparent()
+        while elem.getprevious() is not None:
+            del parent[0]
+
+    def get_state(self) -> Optional[str]:
+        """
+        Состояние разобранного ответа:
+            'wait' - выгрузка еще не готова
+            'ready' - страница получена
+            None - нет подзапросов для выгрузки
+        """
+        if self.request_state is None:
+            logger.error('Неверный XML документ: отсутствует RequestState')
+            raise ValueError('Отсутствует RequestState')
+        if self.request_state != '3':
+            return 'wait'
+        if self.error is not None:
+            if self.error != self.NO_OBJECTS:
+                logger.error(self.error)
+                raise ValueError(self.error)
+            return None
+        return 'ready'
@@ -1,4 +1,5 @@
-from src.api.gis.api import gis_api_fetch
+from src.api.gis.api import gis_api_fetch, gis_api_stream
+from src.base.delay import state_limiter
 from src.config import project_config
 
 HOST = project_config.config.get('connect', 'host')
@@ -12,9 +13,17 @@ async def export_debt_subrequests(xml: str):
 
 async def state_request(xml: str):
     url = f'http://{HOST}:{PORT}/ext-bus-debtreq-service/services/DebtRequestsAsync'
+    await state_limiter.acquire()
     return await gis_api_fetch(url, 'urn:getState', xml)
 
 
+async def state_request_stream(xml: str):
+    url = f'http://{HOST}:{PORT}/ext-bus-debtreq-service/services/DebtRequestsAsync'
+    await state_limiter.acquire()
+    async for chunk in gis_api_stream(url, 'urn:getState', xml):
+        yield chunk
+
+
 async def import_debt_responses(xml: str):
     url = f'http://{HOST}:{PORT}/ext-bus-debtreq-service/services/DebtRequestsAsync'
     return await gis_api_fetch(url, 'urn:importResponses', xml)
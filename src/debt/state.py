@@ -1,44 +1,72 @@
 import asyncio
+from typing import Optional
 
-from src.base.delay import get_delay_time
-from src.base.reader import get_ack_import_responses_state
+from src.base.delay import poll_scheduler
+from src.base.reader import ImportResults, get_ack_import_responses_state, get_import_results
 from src.base.state import GetStateXML
 from src.debt.service import state_request
 from src.log.log import logger
 
 
-async def check_import_responses_state(message_guid: str) -> int:
-    state_imp = GetStateXML()
-    state_imp.set_message_guid(message_guid)
+async def get_import_responses_state(message_guid: str, state_xml: Optional[GetStateXML] = None) -> int:
+    """
+    Состояние операции импорта. state_xml - заранее построенный шаблон запроса для повторного использования
+    """
+    if state_xml is None:
+        state_xml = GetStateXML()
+    sent_ack = await state_request(state_xml.render(message_guid))
+    return get_ack_import_responses_state(sent_ack)
+
+
+async def get_import_results_state(message_guid: str, state_xml: Optional[GetStateXML] = None) -> ImportResults:
+    """
+    Результаты пакетной операции импорта по действиям (TransportGUID) одним запросом getState
+    """
+    if state_xml is None:
+        state_xml = GetStateXML()
+    return get_import_results(await state_request(state_xml.render(message_guid)))
+
 
+async def check_import_responses_state(message_guid: str) -> int:
     try:
-        sent_ack = await state_request(state_imp.get_xml())
-        state = get_ack_import_responses_state(sent_ack)
-        return state
+        return await get_import_responses_state(message_guid)
     except Exception as e:
         logger.error(f'Ошибка получения состояния отправки {message_guid}')
         raise e
 
-# async def check_import_responses_state(message_guid: str) -> int:
-#     state_imp = GetStateXML()
-#     state_imp.set_message_guid(message_guid)
-#     attempt_count = 0
-#
-#     while True:
-#         sent_ack = await state_request(state_imp.get_xml())
-#         state = get_ack_import_responses_state(sent_ack)
-#         if state == '3':
-#             logger.info('Успешная операция импорта')
-#             return 1
-#         elif state in ('1', '2'):
-#             await asyncio.sleep(get_delay_time(attempt_count))
-#             attempt_count += 1
-#             if attempt_count == 10:
-#                 logger.error('Количество попыток на проверку состояния превышено!')
-#                 raise
-#         else:
-#             if 'не имеет статус \"Ответ отправлен\"' in state:
-#                 return 1
-#             else:
-#                 logger.error(f'Ошибка обработки: {state}')
-#                 raise
+
+async def wait_import_responses_state(message_guid: str, operation: str) -> int | str:
+    """
+    Опрос состояния операции импорта по расписанию poll_scheduler, пока она в обработке (1, 2)
+    и не истекло предельное время ожидания. Возвращает последнее полученное состояние
+    """
+    poll = poll_scheduler.start(operation)
+    while True:
+        await poll.wait()
+        state = await check_import_responses_state(message_guid)
+        if state not in ('1', '2'):
+            poll.done()
+            return state
+        if poll.expired:
+            return state
+
+
+async def wait_import_results(message_guid: str, operation: str) -> ImportResults:
+    """
+    Опрос пакетной операции импорта по расписанию poll_scheduler, пока она не обработана
+    и не истекло предельное время ожидания. Возвращает результаты по действиям (TransportGUID)
+    """
+    state_xml = GetStateXML()
+    poll = poll_scheduler.start(operation)
+    while True:
+        await poll.wait()
+        try:
+            results = await get_import_results_state(message_guid, state_xml)
+        except Exception as e:
+            logger.error(f'Ошибка получения состояния отправки {message_guid}')
+            raise e
+        if results.done:
+            poll.done()
+            return results
+        if poll.expired:
+            return results
@@ -7,6 +7,9 @@ class Counter:
         return cls._instance
 
     def __init__(self):
+        self.reset()
+
+    def reset(self):
         self._total_subrequests_count = 0
         self._check_subrequest_count = 0
         self._debtor_subrequest_count = 0